@@ -1,21 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g, has_request_context
 import sqlite3
+import atexit
+import fcntl
+import gc
 import hashlib
+import hmac
 import os
 import random
+import struct
+import json
+import math
+import queue
+import socket
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from functools import wraps
-
-# 🤖 Hugging Face
-from transformers import AutoImageProcessor, AutoModelForImageClassification
-from PIL import Image
-import torch
+from types import SimpleNamespace
+from werkzeug.exceptions import RequestEntityTooLarge
 import base64
 import io
 
+# 🤖 Hugging Face / PyTorch / PIL / NumPy are imported inside the functions
+# that need them, so pages that never touch the model don't pay for them
+
 # 🤖 OpenAI
 
 client = None
 
+# Outbound call limits (see the OpenAI gateway below). The client's own
+# retries are off - the gateway retries with jitter and feeds the breaker.
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_CONNECT_TIMEOUT_SECONDS", 3))
+OPENAI_READ_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_READ_TIMEOUT_SECONDS", 20))
+
 def get_openai_client():
     """Get OpenAI client with API key from environment - safe implementation"""
     global client
@@ -23,8 +42,12 @@ def get_openai_client():
         api_key = os.environ.get("OPENAI_API_KEY")
         if api_key:
             try:
-                from openai import OpenAI
-                client = OpenAI(api_key=api_key)
+                from openai import OpenAI, Timeout
+                client = OpenAI(
+                    api_key=api_key,
+                    timeout=Timeout(OPENAI_READ_TIMEOUT_SECONDS, connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+                    max_retries=0
+                )
             except Exception as e:
                 print(f"⚠️ OpenAI client initialization failed: {e}")
                 client = None
@@ -41,12 +64,21 @@ app.secret_key = os.urandom(24)
 # 🔐 DATABASE SETUP
 # =======================
 
-def init_db():
-    # Use absolute path for Render deployment
-    db_path = os.path.join(os.getcwd(), "database.db")
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+# Use absolute path for Render deployment
+DATABASE_PATH = os.environ.get("DATABASE_PATH", os.path.join(os.getcwd(), "database.db"))
+
+# Per-connection tuning: WAL only needs an fsync at checkpoints with
+# synchronous=NORMAL, and busy_timeout makes writers wait instead of failing
+# while another worker holds the write lock
+DB_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA temp_store = MEMORY",
+)
 
+
+def _migration_1_base_schema(c):
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         email TEXT UNIQUE NOT NULL,
@@ -80,24 +112,482 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )''')
 
-    conn.commit()
-    conn.close()
+    # Users waiting for a partner
+    c.execute('''CREATE TABLE IF NOT EXISTS match_queue (
+        user_id INTEGER PRIMARY KEY,
+        emotion TEXT NOT NULL,
+        enqueued_at REAL NOT NULL,
+        last_seen REAL NOT NULL
+    )''')
+
+
+def _migration_2_missing_columns(c):
+    # save_message writes sender_type, which older databases never had
+    _add_missing_columns(c, "chat_messages", {"sender_type": "TEXT DEFAULT 'user'"})
+
+
+def _migration_3_hot_path_indexes(c):
+    # Latest emotion per user: seek on user_id, newest id first, emotion
+    # read straight from the index
+    c.execute("CREATE INDEX IF NOT EXISTS idx_emotions_user_latest ON emotions (user_id, id, emotion)")
+    # Active match lookups by either participant
+    c.execute("CREATE INDEX IF NOT EXISTS idx_matches_user1 ON matches (user1_id, active)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_matches_user2 ON matches (user2_id, active)")
+    # Conversation polling / streaming by match and cursor
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_messages_match ON chat_messages (match_id, id)")
+    # Matchmaking pops the oldest waiter per emotion straight from match_queue
+    c.execute("CREATE INDEX IF NOT EXISTS idx_match_queue_emotion ON match_queue (emotion, enqueued_at)")
+    # Login by email already uses the UNIQUE constraint's automatic index
+
+
+def _migration_4_user_state(c):
+    # Denormalized latest emotion per user, kept current by record_emotion()
+    c.execute('''CREATE TABLE IF NOT EXISTS user_state (
+        user_id INTEGER PRIMARY KEY,
+        emotion TEXT,
+        confidence REAL,
+        emotion_id INTEGER,
+        updated_at REAL
+    )''')
+    c.execute('''
+        INSERT OR REPLACE INTO user_state (user_id, emotion, confidence, emotion_id, updated_at)
+        SELECT user_id, emotion, confidence, id, CAST(strftime('%s', created_at) AS REAL)
+        FROM emotions
+        WHERE id IN (SELECT MAX(id) FROM emotions GROUP BY user_id)
+    ''')
+
+
+def _migration_5_emotion_daily(c):
+    # Per-user, per-day emotion counts for the dashboard chart, kept
+    # current by record_emotion() so the chart never scans emotions
+    c.execute('''CREATE TABLE IF NOT EXISTS emotion_daily (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        emotion TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day, emotion)
+    ) WITHOUT ROWID''')
+    c.execute('''
+        INSERT OR REPLACE INTO emotion_daily (user_id, day, emotion, count)
+        SELECT user_id, date(created_at), emotion, COUNT(*)
+        FROM emotions
+        GROUP BY user_id, date(created_at), emotion
+    ''')
+
+
+def _migration_6_ai_messages(c):
+    # AI companion conversations (previously kept in the session cookie)
+    c.execute('''CREATE TABLE IF NOT EXISTS ai_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ai_messages_user ON ai_messages (user_id, id)")
+
+
+def _migration_7_smoothed_scores(c):
+    # Auto mode's moving average of softmax scores (JSON), shared by all
+    # workers; see EmotionSmoother
+    _add_missing_columns(c, "user_state", {"smoothed": "TEXT", "smoothed_at": "REAL"})
+
+
+# Append new migrations here; PRAGMA user_version records how far a
+# database has been migrated
+MIGRATIONS = [
+    (1, _migration_1_base_schema),
+    (2, _migration_2_missing_columns),
+    (3, _migration_3_hot_path_indexes),
+    (4, _migration_4_user_state),
+    (5, _migration_5_emotion_daily),
+    (6, _migration_6_ai_messages),
+    (7, _migration_7_smoothed_scores),
+]
+
+
+def _add_missing_columns(c, table, columns):
+    """ALTER TABLE ADD COLUMN for every column the table doesn't have yet"""
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to target (default: latest); returns the new version"""
+    conn.execute("BEGIN IMMEDIATE")  # Only one worker migrates at a time
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            print(f"🗄️ Applying migration {number}: {migration.__name__}")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            version = number
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    conn.execute("PRAGMA optimize")
+    return version
 
-init_db()
+
+def init_db(db_path=None, target=None):
+    conn = sqlite3.connect(db_path or DATABASE_PATH, timeout=5)
+    # WAL lets readers run alongside the writer; the mode is stored in the file
+    conn.execute("PRAGMA journal_mode = WAL")
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    migrate(conn, target)
+    conn.close()
 
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 
-def get_db():
-    # Use absolute path for Render deployment
-    db_path = os.path.join(os.getcwd(), "database.db")
-    conn = sqlite3.connect(db_path)
+# =======================
+# 🔌 CONNECTION LAYER
+# =======================
+# Each thread keeps one long-lived connection, so opening costs and
+# compiled statements (cached_statements) are reused across requests.
+# Helpers never commit: everything a request writes shares one
+# transaction that is committed once after the view returns (or rolled
+# back on a 5xx), i.e. one commit per request instead of one per helper.
+
+_db_local = threading.local()
+_db_stats = {"connections_opened": 0, "commits": 0, "rollbacks": 0}
+_db_stats_lock = threading.Lock()
+
+
+def _count_db(event):
+    # += on a dict entry isn't atomic across the worker's threads
+    with _db_stats_lock:
+        _db_stats[event] += 1
+
+
+def _connect(db_path=None):
+    _count_db("connections_opened")
+    conn = sqlite3.connect(db_path or DATABASE_PATH, timeout=5, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_db():
+    """This thread's pooled connection (never close it - the pool owns it)"""
+    conn = getattr(_db_local, "conn", None)
+    # A connection must not cross a fork into a gunicorn worker
+    if conn is None or _db_local.pid != os.getpid() or _db_local.path != DATABASE_PATH:
+        conn = _connect()
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+        _db_local.path = DATABASE_PATH
     return conn
 
 
+def after_commit(callback):
+    """Run callback once the current request's writes are committed"""
+    # Streamed responses write after finish_db_transaction has run, so
+    # they commit straight away like code outside a request
+    if has_request_context() and not g.get('_db_finished'):
+        g.setdefault('_after_commit', []).append(callback)
+    else:
+        commit_db()
+        callback()
+
+
+def commit_db():
+    """Commit this thread's open transaction, if any"""
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and _db_local.pid == os.getpid() and conn.in_transaction:
+        conn.commit()
+
+
+@app.after_request
+def finish_db_transaction(response):
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and _db_local.pid == os.getpid() and conn.in_transaction:
+        if response.status_code >= 500:
+            conn.rollback()
+            _count_db("rollbacks")
+            g.pop('_after_commit', None)
+        else:
+            conn.commit()
+            _count_db("commits")
+
+    g._db_finished = True
+    for callback in g.pop('_after_commit', []):
+        callback()
+    return response
+
+
+@app.teardown_request
+def release_db(exc):
+    # Anything still open here belongs to a request that failed mid-way
+    conn = getattr(_db_local, "conn", None)
+    if conn is not None and _db_local.pid == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
+
+# =======================
+# ✍️ WRITE-BEHIND QUEUE
+# =======================
+# Emotion readings and chat messages are the hot inserts. Instead of each
+# request committing its own row, they are handed to a per-worker flusher
+# thread that writes everything queued while its previous commit ran (up
+# to DB_GROUP_COMMIT_MAX_ROWS rows, optionally waiting DB_GROUP_COMMIT_MS
+# for more) in one transaction. DB_DURABILITY picks the trade-off:
+#   sync  - write inside the request's own transaction (one commit each)
+#   group - queue the row and wait for the shared commit before returning;
+#           nothing acknowledged is ever lost
+#   async - queue the row and return straight away; a crash can lose what
+#           was queued in the last few milliseconds (at most
+#           DB_WRITE_QUEUE_MAX rows)
+# Readers that must see a user's own writes call write_behind.barrier(),
+# which waits for this worker's queue to drain (a no-op unless async).
+# The user's next request may land on another gunicorn worker, so in async
+# mode each queued row also leaves (worker pid, sequence number) in the
+# session, every flusher publishes how far it has committed in
+# <runtime dir>/write-behind/<pid>.seq, and barrier() on any worker waits
+# until the worker named in the session has committed that far.
+# Post-commit callbacks (cache updates, bus notifications) run once the
+# row is committed, as after_commit() does for request transactions.
+
+class _WriteJob:
+    __slots__ = ("fn", "args", "callback", "done", "error", "seq")
+
+    def __init__(self, fn, args, callback):
+        self.fn = fn
+        self.args = args
+        self.callback = callback
+        self.done = threading.Event()
+        self.error = None
+        self.seq = 0
+
+
+class WriteBehindQueue:
+    """Group-commits queued inserts from request threads"""
+
+    def __init__(self, mode="group", window_ms=0, max_rows=256, max_queued=10000,
+                 db_path=None, timeout=30, state_dir=None):
+        if mode not in ("sync", "group", "async"):
+            raise ValueError(f"Unknown DB_DURABILITY {mode!r} (expected sync, group or async)")
+        self.mode = mode
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_rows = max(int(max_rows), 1)
+        self.max_queued = max_queued
+        self.db_path = db_path
+        self.timeout = timeout
+        self.state_dir = state_dir
+        self._queue = queue.Queue(max_queued)
+        self._thread = None
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+        self._pending = 0
+        self._drained = threading.Condition()
+        self._submit_lock = threading.Lock()   # keeps sequence numbers in queue order
+        self._seq = 0
+        self._state_fd = None
+        self._stats = {"rows": 0, "commits": 0, "failed_rows": 0, "max_batch": 0}
+
+    def submit(self, fn, args, callback=None):
+        """Run fn(conn, *args) according to the durability mode
+
+        callback runs after the row is committed.
+        """
+        conn = getattr(_db_local, "conn", None)
+        holding_lock = conn is not None and _db_local.pid == os.getpid() and conn.in_transaction
+        if self.mode == "sync" or (self.mode == "group" and holding_lock):
+            # A request already holding the write lock would deadlock
+            # waiting on the flusher, so it writes inline instead
+            fn(get_db(), *args)
+            if callback is not None:
+                after_commit(callback)
+            return
+
+        self._ensure_thread()
+        job = _WriteJob(fn, args, callback)
+        with self._submit_lock:
+            with self._drained:
+                self._pending += 1
+            self._seq += 1
+            job.seq = self._seq
+            self._queue.put(job)   # blocks when the queue is full
+
+        if self.mode == "group":
+            if not job.done.wait(self.timeout):
+                raise TimeoutError("Group commit timed out")
+            if job.error is not None:
+                raise job.error
+        elif has_request_context():
+            session['_write_seq'] = [os.getpid(), job.seq]
+
+    def barrier(self, timeout=None):
+        """Wait until everything this worker, and the worker that queued the
+        current user's last row, have queued so far is committed"""
+        if self.mode != "async":
+            return
+        timeout = timeout or self.timeout
+        with self._drained:
+            drained = self._drained.wait_for(lambda: self._pending == 0, timeout)
+
+        marker = session.get('_write_seq') if has_request_context() else None
+        if marker and marker[0] != os.getpid():
+            self._wait_committed(marker[0], marker[1], timeout)
+            session.pop('_write_seq', None)
+        elif marker and drained:
+            session.pop('_write_seq', None)
+
+    def _wait_committed(self, pid, seq, timeout):
+        """Poll another worker's published sequence number until it reaches seq"""
+        path = os.path.join(self._state_path(), f"{pid}.seq")
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with open(path, "rb") as f:
+                    (committed,) = struct.unpack("!Q", f.read(8))
+                os.kill(pid, 0)
+            except (OSError, struct.error):
+                # That worker has exited: close() flushed its queue, or
+                # whatever it still held is lost with it
+                return
+            if committed >= seq or time.monotonic() >= deadline:
+                return
+            time.sleep(0.002)
+
+    def _state_path(self):
+        return self.state_dir or os.path.join(RUNTIME_DIR, "write-behind")
+
+    def _publish(self, seq):
+        # Eight bytes rewritten in place - no fsync, readers only need the
+        # latest value while this process is alive
+        try:
+            if self._state_fd is None:
+                path = os.path.join(ensure_private_dir(self._state_path()), f"{os.getpid()}.seq")
+                self._state_fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+            os.pwrite(self._state_fd, struct.pack("!Q", seq), 0)
+        except OSError as e:
+            print(f"⚠️ write-behind could not publish its progress: {e}")
+
+    def close(self):
+        """Flush whatever is still queued (called on worker exit)"""
+        if self._thread_pid == os.getpid():
+            self.barrier()
+            if self._state_fd is not None:
+                try:
+                    os.close(self._state_fd)
+                    os.unlink(os.path.join(self._state_path(), f"{os.getpid()}.seq"))
+                except OSError:
+                    pass
+                self._state_fd = None
+
+    def _ensure_thread(self):
+        # Started lazily (and again after a fork) so each gunicorn worker
+        # has its own flusher and connection
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue(self.max_queued)
+                self._pending = 0
+                self._seq = 0
+                self._state_fd = None
+                if self.mode == "async":
+                    self._publish(0)
+                self._thread = threading.Thread(target=self._flush_loop, name="write-behind", daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def _flush_loop(self):
+        conn = path = None
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+
+            while len(batch) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # DATABASE_PATH is looked up per batch, like get_db() does, so
+            # the flusher follows it instead of keeping the first one
+            if conn is None or path != (self.db_path or DATABASE_PATH):
+                if conn is not None:
+                    conn.close()
+                path = self.db_path or DATABASE_PATH
+                conn = _connect(path)
+            self._flush(conn, batch)
+
+    def _flush(self, conn, batch):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                job.fn(conn, *job.args)
+            conn.commit()
+            committed = 1
+        except Exception:
+            # One bad row shouldn't sink the rest - retry them one by one
+            conn.rollback()
+            committed = 0
+            for job in batch:
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    job.fn(conn, *job.args)
+                    conn.commit()
+                    committed += 1
+                except Exception as e:
+                    conn.rollback()
+                    job.error = e
+                    print(f"❌ write-behind insert failed: {e}")
+
+        failed = sum(1 for job in batch if job.error is not None)
+        with self._drained:
+            self._stats["rows"] += len(batch) - failed
+            self._stats["commits"] += committed
+            self._stats["failed_rows"] += failed
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+
+        for job in batch:
+            if job.error is None and job.callback is not None:
+                try:
+                    job.callback()
+                except Exception as e:
+                    print(f"⚠️ write-behind callback failed: {e}")
+            job.done.set()
+
+        if self.mode == "async":
+            self._publish(batch[-1].seq)
+        with self._drained:
+            self._pending -= len(batch)
+            self._drained.notify_all()
+
+    def stats(self):
+        with self._drained:
+            stats = dict(self._stats)
+            stats["mode"] = self.mode
+            stats["queued"] = self._pending
+        stats["rows_per_commit"] = round(stats["rows"] / stats["commits"], 2) if stats["commits"] else 0
+        return stats
+
+
+write_behind = WriteBehindQueue(
+    mode=os.environ.get("DB_DURABILITY", "group"),
+    window_ms=float(os.environ.get("DB_GROUP_COMMIT_MS", 0)),
+    max_rows=int(os.environ.get("DB_GROUP_COMMIT_MAX_ROWS", 256)),
+    max_queued=int(os.environ.get("DB_WRITE_QUEUE_MAX", 10000)),
+)
+atexit.register(write_behind.close)
+
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -111,57 +601,156 @@ def login_required(f):
 # 🎯 MATCHING LOGIC
 # =======================
 
-def find_emotion_match(user_id, emotion):
+class MatchmakingPool:
     """
-    Find another user with the same most recent emotion.
-    Returns (matched_user_id, username) if found, else (None, None)
-    Excludes users who already have an active match.
+    Waiting pool per emotion with atomic pairing, kept in the match_queue
+    table so every worker sees the same pool.
+
+    Checking for an existing match or an unchanged wait is a plain read.
+    Only enqueueing and pairing take the write lock (BEGIN IMMEDIATE, or
+    the request's own transaction once it has written), and inside it the
+    partner is popped with one seek on the (emotion, enqueued_at) index, so
+    pairing costs the same however long the pool is and no user ends up in
+    two active matches. A waiter's last_seen is refreshed through
+    write_behind at most every touch_interval seconds; users not seen for
+    MATCH_WAIT_TTL_SECONDS are never paired.
     """
-    conn = get_db()
-    
-    # Find another user whose latest emotion matches (excluding current user)
-    # Also exclude users who already have an active match
-    match = conn.execute('''
-        SELECT e.user_id, u.username 
-        FROM emotions e
-        JOIN users u ON e.user_id = u.id
-        WHERE e.user_id != ? 
-        AND e.emotion = ?
-        AND e.id = (
-            SELECT MAX(e2.id) 
-            FROM emotions e2 
-            WHERE e2.user_id = e.user_id
-        )
-        AND e.user_id NOT IN (
-            SELECT CASE 
-                WHEN m.user1_id = ? THEN m.user2_id 
-                ELSE m.user1_id 
-            END
-            FROM matches m
-            WHERE m.active = 1 AND (m.user1_id = ? OR m.user2_id = ?)
-        )
-        ORDER BY e.created_at DESC
-        LIMIT 1
-    ''', (user_id, emotion, user_id, user_id, user_id)).fetchone()
-    
-    conn.close()
-    
-    if match:
-        return match['user_id'], match['username']
-    return None, None
+
+    def __init__(self, wait_ttl):
+        self.wait_ttl = wait_ttl
+        self.touch_interval = min(wait_ttl / 10, 30)
+        self._lock = threading.Lock()
+        self._stats = {"pairs": 0, "enqueued": 0, "expired": 0, "touches": 0}
+
+    def pair(self, user_id, emotion):
+        """
+        Pair user_id with the longest-waiting user who feels the same, or
+        put them in the waiting pool.
+        Returns (match_id, matched_user_id, matched_username) or (None, None, None).
+        A user who already has an active match gets that match back.
+        """
+        conn = get_db()
+        now = time.time()
+        active = self._active_match(conn, user_id)
+        waiting = conn.execute(
+            "SELECT emotion, last_seen FROM match_queue WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+        if active is not None and waiting is None:
+            return active['id'], active['partner_id'], self._username(conn, active['partner_id'])
+
+        if (active is None and waiting is not None and waiting['emotion'] == emotion
+                and now - waiting['last_seen'] <= self.wait_ttl):
+            # Still waiting on the same emotion: nobody to pair with (they
+            # would have been paired on arrival), just stay fresh
+            if now - waiting['last_seen'] >= self.touch_interval:
+                write_behind.submit(_touch_waiter, (user_id, now))
+                self._count("touches")
+            return None, None, None
+
+        return self._pair_locked(conn, user_id, emotion, now)
+
+    def _pair_locked(self, conn, user_id, emotion, now):
+        try:
+            # A request that already wrote (e.g. the emotion insert) holds
+            # the write lock in its own transaction; otherwise take it now
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+
+            # Another worker may have paired us since the unlocked read
+            active = self._active_match(conn, user_id)
+            if active is not None:
+                conn.execute("DELETE FROM match_queue WHERE user_id = ?", (user_id,))
+                result = (active['id'], active['partner_id'], self._username(conn, active['partner_id']))
+            else:
+                partner_id = self._pop_partner(conn, emotion, user_id, now)
+                if partner_id is not None:
+                    conn.execute("DELETE FROM match_queue WHERE user_id = ?", (user_id,))
+                    match_id = create_match(user_id, partner_id, emotion)
+                    self._count("pairs")
+                    result = (match_id, partner_id, self._username(conn, partner_id))
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO match_queue (user_id, emotion, enqueued_at, last_seen) VALUES (?, ?, ?, ?)",
+                        (user_id, emotion, now, now)
+                    )
+                    self._count("enqueued")
+                    result = (None, None, None)
+
+            if not has_request_context():
+                conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _pop_partner(self, conn, emotion, user_id, now):
+        """Remove and return the oldest fresh waiter for emotion; stale ones met on the way are dropped"""
+        while True:
+            row = conn.execute('''
+                SELECT user_id, last_seen FROM match_queue
+                WHERE emotion = ? AND user_id != ?
+                ORDER BY enqueued_at
+                LIMIT 1
+            ''', (emotion, user_id)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM match_queue WHERE user_id = ?", (row['user_id'],))
+            if now - row['last_seen'] <= self.wait_ttl:
+                return row['user_id']
+            self._count("expired")
+
+    def _active_match(self, conn, user_id):
+        return conn.execute('''
+            SELECT id, CASE WHEN user1_id = ? THEN user2_id ELSE user1_id END AS partner_id
+            FROM matches
+            WHERE active = 1 AND (user1_id = ? OR user2_id = ?)
+            ORDER BY id DESC
+            LIMIT 1
+        ''', (user_id, user_id, user_id)).fetchone()
+
+    def _username(self, conn, user_id):
+        row = conn.execute("SELECT username FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row['username'] if row else None
+
+    def _count(self, event, amount=1):
+        with self._lock:
+            self._stats[event] += amount
+
+    def expire_stale(self):
+        """Drop waiters past the staleness timeout (run on startup)"""
+        conn = _connect()
+        try:
+            with conn:
+                deleted = conn.execute(
+                    "DELETE FROM match_queue WHERE last_seen < ?",
+                    (time.time() - self.wait_ttl,)
+                ).rowcount
+        finally:
+            conn.close()
+        self._count("expired", deleted)
+
+    def stats(self):
+        rows = get_db().execute("SELECT emotion, COUNT(*) FROM match_queue GROUP BY emotion").fetchall()
+        with self._lock:
+            return dict(self._stats, waiting={row[0]: row[1] for row in rows})
+
+
+def _touch_waiter(conn, user_id, now):
+    conn.execute("UPDATE match_queue SET last_seen = ? WHERE user_id = ?", (now, user_id))
+
+
+matchmaker = MatchmakingPool(wait_ttl=float(os.environ.get("MATCH_WAIT_TTL_SECONDS", 600)))
 
 
 def create_match(user1_id, user2_id, emotion):
     """Create a new match record"""
     conn = get_db()
-    conn.execute(
+    cursor = conn.execute(
         "INSERT INTO matches (user1_id, user2_id, emotion, active) VALUES (?, ?, ?, 1)",
         (user1_id, user2_id, emotion)
     )
-    conn.commit()
-    match_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
-    conn.close()
-    return match_id
+    return cursor.lastrowid
 
 
 def get_user_active_match(user_id):
@@ -171,10 +760,9 @@ def get_user_active_match(user_id):
         SELECT m.id, m.user1_id, m.user2_id, m.emotion, m.active, m.created_at
         FROM matches m
         WHERE m.active = 1 AND (m.user1_id = ? OR m.user2_id = ?)
-        ORDER BY m.created_at DESC
+        ORDER BY m.id DESC
         LIMIT 1
     ''', (user_id, user_id)).fetchone()
-    conn.close()
     return match
 
 
@@ -185,7 +773,6 @@ def validate_match_access(user_id, match_id):
         SELECT * FROM matches 
         WHERE id = ? AND active = 1 AND (user1_id = ? OR user2_id = ?)
     ''', (match_id, user_id, user_id)).fetchone()
-    conn.close()
     return match is not None
 
 
@@ -193,97 +780,1286 @@ def end_match(match_id):
     """End a match by setting active = 0"""
     conn = get_db()
     conn.execute("UPDATE matches SET active = 0 WHERE id = ?", (match_id,))
-    conn.commit()
-    conn.close()
+    after_commit(lambda: notification_bus.publish(match_id))
 
 
-def save_message(match_id, sender_id, message, sender_type='user'):
-    """Save a chat message"""
+def is_match_active(match_id):
+    """Check whether a match is still active"""
     conn = get_db()
+    row = conn.execute("SELECT active FROM matches WHERE id = ?", (match_id,)).fetchone()
+    return row is not None and row['active'] == 1
+
+
+def _insert_message(conn, match_id, sender_id, message, sender_type):
     conn.execute(
         "INSERT INTO chat_messages (match_id, sender_id, message, sender_type) VALUES (?, ?, ?, ?)",
         (match_id, sender_id, message, sender_type)
     )
-    conn.commit()
-    conn.close()
 
 
-def get_messages(match_id):
-    """Get all messages for a match"""
+def save_message(match_id, sender_id, message, sender_type='user'):
+    """Save a chat message (through the write-behind queue)"""
+    write_behind.submit(
+        _insert_message, (match_id, sender_id, message, sender_type),
+        lambda: notification_bus.publish(match_id)
+    )
+
+
+def get_messages(match_id, since_id=0):
+    """Get messages for a match newer than since_id (keyset cursor)"""
+    write_behind.barrier()
     conn = get_db()
     messages = conn.execute('''
-        SELECT * FROM chat_messages 
-        WHERE match_id = ? 
-        ORDER BY created_at ASC
-    ''', (match_id,)).fetchall()
-    conn.close()
+        SELECT id, sender_id, message, created_at FROM chat_messages 
+        WHERE match_id = ? AND id > ?
+        ORDER BY id ASC
+    ''', (match_id, since_id)).fetchall()
     return messages
 
 
+def get_latest_message_id(match_id):
+    """Get the id of the newest message in a match (0 if none)"""
+    write_behind.barrier()
+    conn = get_db()
+    row = conn.execute(
+        "SELECT MAX(id) FROM chat_messages WHERE match_id = ?",
+        (match_id,)
+    ).fetchone()
+    return row[0] or 0
+
+
+# =======================
+# 🗂️ RUNTIME DIRECTORY
+# =======================
+# Unix sockets (the notification bus, the inference server) live in a
+# directory only this user can enter, never directly in the shared /tmp:
+# $XDG_RUNTIME_DIR/echobridge when the system provides one, else
+# <tmp>/echobridge-<uid>. ECHOBRIDGE_RUNTIME_DIR overrides it.
+
+RUNTIME_DIR = os.environ.get("ECHOBRIDGE_RUNTIME_DIR") or (
+    os.path.join(os.environ["XDG_RUNTIME_DIR"], "echobridge") if os.environ.get("XDG_RUNTIME_DIR")
+    else os.path.join(tempfile.gettempdir(), f"echobridge-{os.getuid()}")
+)
+
+
+def ensure_private_dir(path):
+    """
+    Create path as a 0700 directory, or tighten an existing one we own.
+    Raises OSError if it belongs to someone else (e.g. pre-created in /tmp
+    by another user to intercept the sockets).
+    """
+    if os.path.dirname(path) == RUNTIME_DIR:
+        # Whoever controls the parent could swap path out from under us
+        ensure_private_dir(RUNTIME_DIR)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not os.path.isdir(path) or os.path.islink(path) or info.st_uid != os.getuid():
+        raise OSError(f"{path} is not a directory owned by this user")
+    if info.st_mode & 0o077:
+        os.chmod(path, 0o700)
+    return path
+
+
+# =======================
+# 📡 NOTIFICATION BUS
+# =======================
+# Cross-worker notifications without an external broker. Every gunicorn
+# worker binds a Unix datagram socket in CHAT_BUS_DIR and publishing sends
+# "<topic>:<key>" to all of them.
+#   chat     - wakes /chat-stream connections when a message is saved or a
+#              chat ends (key = match id)
+#   other    - handed to the callback registered for the topic, e.g. cache
+#              invalidation (key = user id)
+
+class NotificationBus:
+    """Cross-worker wakeup and invalidation channel"""
+
+    def __init__(self, bus_dir):
+        self.bus_dir = bus_dir
+        self._cond = threading.Condition()
+        self._versions = {}      # match_id -> change counter
+        self._subscribers = {}   # match_id -> open streams in this worker
+        self._handlers = {}      # topic -> callback(key)
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+        self._sender = None
+
+    def _socket_path(self, pid):
+        return os.path.join(self.bus_dir, f"{pid}.sock")
+
+    def ensure_listener(self):
+        # Bound lazily (and again after a fork) so each worker has its own
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            try:
+                ensure_private_dir(self.bus_dir)
+                path = self._socket_path(os.getpid())
+                if os.path.exists(path):
+                    os.unlink(path)
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.bind(path)
+                self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self._sender.setblocking(False)
+                threading.Thread(target=self._listen, args=(sock,), name="notification-bus", daemon=True).start()
+                atexit.register(self._cleanup, path)
+            except OSError as e:
+                # Streams and caches still fall back to re-checks and TTLs
+                print(f"⚠️ Notification bus unavailable: {e}")
+            self._listener_pid = os.getpid()
+
+    def _cleanup(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def _listen(self, sock):
+        while True:
+            try:
+                topic, key = sock.recv(128).decode().split(":", 1)
+                if topic == "chat":
+                    self._wake(int(key))
+                elif topic in self._handlers:
+                    self._handlers[topic](int(key))
+            except (OSError, ValueError):
+                continue
+
+    def _wake(self, match_id):
+        with self._cond:
+            if match_id in self._subscribers:
+                self._versions[match_id] = self._versions.get(match_id, 0) + 1
+                self._cond.notify_all()
+
+    def register(self, topic, handler):
+        """Call handler(key) whenever another worker publishes on topic"""
+        self._handlers[topic] = handler
+
+    def publish(self, key, topic="chat"):
+        """Notify this worker's chat streams and every other worker"""
+        self.ensure_listener()
+        if topic == "chat":
+            self._wake(key)
+        if self._sender is None:
+            return
+
+        payload = f"{topic}:{key}".encode()
+        own_socket = f"{os.getpid()}.sock"
+        try:
+            names = os.listdir(self.bus_dir)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".sock") or name == own_socket:
+                continue
+            path = os.path.join(self.bus_dir, name)
+            try:
+                self._sender.sendto(payload, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone - remove its stale socket
+                self._cleanup(path)
+            except OSError:
+                # Receiver buffer full; it re-checks on heartbeat / TTL
+                pass
+
+    def subscribe(self, match_id):
+        self.ensure_listener()
+        with self._cond:
+            self._subscribers[match_id] = self._subscribers.get(match_id, 0) + 1
+            return self._versions.get(match_id, 0)
+
+    def unsubscribe(self, match_id):
+        with self._cond:
+            remaining = self._subscribers.get(match_id, 1) - 1
+            if remaining > 0:
+                self._subscribers[match_id] = remaining
+            else:
+                self._subscribers.pop(match_id, None)
+                self._versions.pop(match_id, None)
+
+    def wait(self, match_id, version, timeout):
+        """Block until the match changes past version or timeout; returns the new version"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions.get(match_id, 0) != version, timeout)
+            return self._versions.get(match_id, 0)
+
+
+notification_bus = NotificationBus(os.environ.get("CHAT_BUS_DIR", os.path.join(RUNTIME_DIR, "bus")))
+
+
+# =======================
+# 🧠 LATEST EMOTION STORE
+# =======================
+# Chat, AI and matching routes all need "the user's latest emotion". Writes
+# go through record_emotion(), which updates the user_state table in the
+# same transaction and this worker's LRU once committed; other workers
+# drop their copy when the "emotion" bus notification arrives. Entries
+# also expire after EMOTION_CACHE_TTL_SECONDS in case a notification is lost.
+
+class LatestEmotionStore:
+    """Bounded in-process LRU in front of the user_state table"""
+
+    def __init__(self, max_users, ttl):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> (emotion, cached_at)
+        self._generation = 0            # bumped on every invalidation
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, user_id):
+        """Latest emotion for user_id, or None if they never recorded one"""
+        notification_bus.ensure_listener()
+        write_behind.barrier()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and now - entry[1] <= self.ttl:
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+            generation = self._generation
+
+        row = get_db().execute("SELECT emotion FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+        emotion = row['emotion'] if row else None
+
+        with self._lock:
+            # Skip filling if an invalidation raced with our read
+            if generation == self._generation:
+                self._put(user_id, emotion, now)
+        return emotion
+
+    def written(self, user_id, emotion):
+        """Write-through after record_emotion() commits"""
+        with self._lock:
+            self._generation += 1
+            self._put(user_id, emotion, time.monotonic())
+        notification_bus.publish(user_id, topic="emotion")
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+            self._entries.pop(user_id, None)
+
+    def _put(self, user_id, emotion, now):
+        self._entries[user_id] = (emotion, now)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0,
+                "invalidations": self._invalidations,
+            }
+
+
+latest_emotions = LatestEmotionStore(
+    max_users=int(os.environ.get("EMOTION_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("EMOTION_CACHE_TTL_SECONDS", 30)),
+)
+notification_bus.register("emotion", latest_emotions.invalidate)
+
+
+def _insert_emotion(conn, user_id, emotion, confidence):
+    cursor = conn.execute(
+        "INSERT INTO emotions (user_id, emotion, confidence) VALUES (?, ?, ?)",
+        (user_id, emotion, confidence)
+    )
+    conn.execute('''
+        INSERT INTO user_state (user_id, emotion, confidence, emotion_id, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            emotion = excluded.emotion,
+            confidence = excluded.confidence,
+            emotion_id = excluded.emotion_id,
+            updated_at = excluded.updated_at
+    ''', (user_id, emotion, confidence, cursor.lastrowid, time.time()))
+    # Same day boundary (UTC) as the emotions.created_at default
+    conn.execute('''
+        INSERT INTO emotion_daily (user_id, day, emotion, count)
+        VALUES (?, date('now'), ?, 1)
+        ON CONFLICT(user_id, day, emotion) DO UPDATE SET count = count + 1
+    ''', (user_id, emotion))
+
+
+def record_emotion(user_id, emotion, confidence):
+    """Insert an emotion reading and keep the latest-emotion store current"""
+    write_behind.submit(
+        _insert_emotion, (user_id, emotion, confidence),
+        lambda: latest_emotions.written(user_id, emotion)
+    )
+
+
 # =======================
 # 🤖 LOAD LOCAL MODEL (Lazy Loading)
 # =======================
+# Load from HuggingFace hub - no local files needed
+EMOTION_MODEL_NAME = os.environ.get("EMOTION_MODEL_NAME", "trpakov/vit-face-expression")
+# Offline snapshot: a local directory with config.json,
+# preprocessor_config.json and model.safetensors. When set it replaces
+# EMOTION_MODEL_NAME, nothing is fetched from the hub and the safetensors
+# weights are memory-mapped rather than read into a buffer first.
+EMOTION_MODEL_DIR = os.environ.get("EMOTION_MODEL_DIR")
+EMOTION_MODEL_SOURCE = EMOTION_MODEL_DIR or EMOTION_MODEL_NAME
+
+# Inference backend:
+#   eager - float32 PyTorch (default)
+#   int8  - PyTorch with dynamically int8-quantized Linear layers
+#   onnx  - exported graph run by onnxruntime on CPU
+#           (create it with `flask --app app export-onnx`)
+#   torchscript - traced and frozen float32 graph, built on first start and
+#           loaded from EMOTION_MODEL_CACHE_DIR after that
+EMOTION_MODEL_BACKEND = os.environ.get("EMOTION_MODEL_BACKEND", "eager")
+EMOTION_ONNX_PATH = os.environ.get("EMOTION_ONNX_PATH", os.path.join("models", "vit-face-expression.onnx"))
+EMOTION_MODEL_CACHE_DIR = os.environ.get("EMOTION_MODEL_CACHE_DIR", os.path.join("models", "cache"))
+
 # Global variables for lazy loading
 _model = None
 _processor = None
-_model_loaded = False
+_model_lock = threading.Lock()
+_frame_preprocessor = None
+_model_stats = {"preloaded": False, "load_ms": None, "first_detect_ms": None}
+
+
+class ModelLifecycle:
+    """
+    Unloads the model after idle_seconds without inference and paces
+    reloads: /detect asks for a background load and falls back meanwhile,
+    and a failed load is retried with exponential backoff instead of
+    giving up for the life of the worker.
+    """
+
+    def __init__(self, idle_seconds=0, retry_seconds=5, max_retry_seconds=300):
+        self.idle_seconds = idle_seconds
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._in_use = 0
+        self._loading = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self._reaper = None
+        self._reaper_pid = None
+        self._loads = 0
+        self._load_failures = 0
+        self._evictions = 0
+        self._last_eviction = None
+
+    def ready(self):
+        """True if the model is loaded; otherwise start loading it in the background"""
+        if _model is not None:
+            return True
+        with self._lock:
+            if self._loading or not self.retry_due():
+                return False
+            self._loading = True
+        threading.Thread(target=self._load_in_background, name="model-loader", daemon=True).start()
+        return False
+
+    def _load_in_background(self):
+        try:
+            get_model()
+        finally:
+            with self._lock:
+                self._loading = False
+
+    def retry_due(self):
+        return time.monotonic() >= self._retry_at
+
+    def loaded(self):
+        with self._lock:
+            self._loads += 1
+            self._failures = 0
+            self._retry_at = 0.0
+            self._last_used = time.monotonic()
+
+    def load_failed(self):
+        with self._lock:
+            self._load_failures += 1
+            self._failures += 1
+            delay = min(self.retry_seconds * 2 ** (self._failures - 1), self.max_retry_seconds)
+            self._retry_at = time.monotonic() + delay
+        print(f"⏳ Retrying the model load in {delay:.0f}s")
+
+    @contextmanager
+    def in_use(self):
+        """Held around inference so the model isn't unloaded mid-batch"""
+        self._ensure_reaper()
+        with self._lock:
+            self._in_use += 1
+            self._last_used = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_use -= 1
+                self._last_used = time.monotonic()
+
+    def evictable(self):
+        # A preloaded model lives in pages the workers share copy-on-write
+        # with the gunicorn master; unloading it would free nothing there
+        # and make every worker reload a private copy
+        return self.idle_seconds > 0 and not _model_stats["preloaded"]
+
+    def _ensure_reaper(self):
+        # Started by the first inference (and again after a fork)
+        if not self.evictable():
+            return
+        if self._reaper is not None and self._reaper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._reaper is None or self._reaper_pid != os.getpid():
+                self._reaper = threading.Thread(target=self._reap, name="model-reaper", daemon=True)
+                self._reaper_pid = os.getpid()
+                self._reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(min(max(self.idle_seconds / 4, 1), 30))
+            self.evict_if_idle()
+
+    def evict_if_idle(self):
+        """Unload the model if nothing has used it for idle_seconds"""
+        return self._evict(lambda idle: idle >= self.idle_seconds and self.evictable(),
+                           "after {idle:.0f}s idle")
+
+    def release_fallback(self):
+        """Unload the worker's own model once the inference server answers again"""
+        if _model is None:
+            return False
+        # Whatever the idle policy, a private copy next to the server's is
+        # exactly the memory the server exists to save
+        return self._evict(lambda idle: not _model_stats["preloaded"],
+                           "now that the inference server is back")
+
+    def _evict(self, due, reason):
+        with self._lock:
+            idle = time.monotonic() - self._last_used
+            if _model is None or self._in_use or not due(idle):
+                return False
+            rss_before = _process_memory().get("vmrss_kb")
+            _unload_model()
+
+        # Hand the freed weights back to the OS rather than keeping them in
+        # the allocator's free lists
+        gc.collect()
+        _malloc_trim()
+        rss_after = _process_memory().get("vmrss_kb")
+
+        with self._lock:
+            self._evictions += 1
+            self._last_eviction = {
+                "at": time.time(),
+                "idle_seconds": round(idle, 1),
+                "rss_before_kb": rss_before,
+                "rss_after_kb": rss_after,
+            }
+        print(f"💤 Model unloaded {reason.format(idle=idle)} (RSS {rss_before} kB -> {rss_after} kB)")
+        return True
+
+    def stats(self):
+        with self._lock:
+            if _model is not None:
+                state = "loaded"
+            elif self._loading:
+                state = "loading"
+            elif self._failures:
+                state = "failed"
+            else:
+                state = "unloaded"
+            return {
+                "state": state,
+                "idle_seconds": self.idle_seconds,
+                "evictable": self.evictable(),
+                "idle_for": round(time.monotonic() - self._last_used, 1),
+                "loads": self._loads,
+                "load_failures": self._load_failures,
+                "retry_in": round(max(self._retry_at - time.monotonic(), 0), 1),
+                "evictions": self._evictions,
+                "last_eviction": self._last_eviction,
+            }
+
+
+model_lifecycle = ModelLifecycle(
+    idle_seconds=float(os.environ.get("EMOTION_MODEL_IDLE_SECONDS", 0)),
+    retry_seconds=float(os.environ.get("EMOTION_MODEL_RETRY_SECONDS", 5)),
+)
+
+
+def _malloc_trim():
+    # glibc only; elsewhere freed memory is left to the allocator
+    try:
+        import ctypes
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
 
 def get_model():
     """
-    Lazy load the model only when needed from HuggingFace hub.
-    This prevents crashes at startup and ensures model loads only once.
+    Lazy load the model only when needed, blocking until it's ready.
+    Returns (None, None) if loading failed and the retry backoff hasn't
+    run out yet.
     """
-    global _model, _processor, _model_loaded
-    
-    if _model_loaded:
+    if _model is not None:
         return _processor, _model
-    
+
+    with _model_lock:
+        if _model is None and model_lifecycle.retry_due():
+            _load_model()
+
+    return _processor, _model
+
+
+class ModelUnavailable(RuntimeError):
+    """The model isn't loaded right now; answer with the loading fallback"""
+
+
+def loaded_model():
+    """
+    (processor, model) if the model is loaded, without ever loading it on
+    the calling thread. Otherwise asks model_lifecycle for a background
+    load and raises ModelUnavailable, so a request that lost a race with
+    idle eviction gets the 503 fallback instead of waiting out a reload.
+    """
+    processor, model = _processor, _model
+    if model is None or processor is None:
+        model_lifecycle.ready()
+        raise ModelUnavailable("Model not loaded")
+    return processor, model
+
+
+def _load_model():
+    global _model, _processor, _frame_preprocessor
+
     try:
+        import torch
+
         # Reduce memory usage for free tier
         torch.set_num_threads(1)
         
-        # Load from HuggingFace hub - no local files needed
-        model_name = "trpakov/vit-face-expression"
+        origin = "local snapshot" if EMOTION_MODEL_DIR else "HuggingFace"
+        print(f"📥 Loading model from {origin}: {EMOTION_MODEL_SOURCE} ({EMOTION_MODEL_BACKEND} backend)")
         
-        print(f"📥 Loading model from HuggingFace: {model_name}")
+        started = time.monotonic()
+        processor, model = load_emotion_model(EMOTION_MODEL_BACKEND)
+        _frame_preprocessor = FramePreprocessor(processor)
+        _processor, _model = processor, model
+        _model_stats["load_ms"] = round((time.monotonic() - started) * 1000, 1)
         
-        _processor = AutoImageProcessor.from_pretrained(
-            model_name,
-            use_fast=True
-        )
-        _model = AutoModelForImageClassification.from_pretrained(
-            model_name,
-            torch_dtype=torch.float32,  # Use CPU float32 (avoid GPU memory)
-            low_cpu_mem_usage=True      # Reduce memory during loading
-        )
-        _model.eval()
-        
-        _model_loaded = True
-        print("✅ HuggingFace model loaded successfully")
+        model_lifecycle.loaded()
+        print("✅ Emotion model loaded successfully")
         
     except Exception as e:
         print("❌ Model loading failed:", str(e))
         _model = None
         _processor = None
-        _model_loaded = True  # Mark as loaded (even if failed) to prevent retry
-    
-    return _processor, _model
+        model_lifecycle.load_failed()
 
 
-# =======================
-# 🌐 ROUTES
-# =======================
+def _unload_model():
+    # The preprocessor holds no weights and keeps decoding frames meanwhile
+    global _model, _processor
+    _model = None
+    _processor = None
 
-# Global error handler
-@app.errorhandler(Exception)
-def handle_error(e):
-    """Handle all unhandled exceptions"""
-    print(f"❌ Global error handler caught: {str(e)}")
-    return "Internal Server Error", 500
 
+def get_frame_preprocessor():
+    """Fast-path preprocessor matching the loaded model's image processor"""
+    if _frame_preprocessor is None:
+        get_model()
+    return _frame_preprocessor
 
-@app.route('/')
-def index():
+
+def preload_model():
+    """
+    Load the model and run one dummy forward pass.
+    gunicorn.conf.py calls this in the master before forking when
+    EMOTION_MODEL_PRELOAD=1, so workers share the weights copy-on-write and
+    the first /detect in each worker doesn't wait for from_pretrained.
+    """
+    import torch
+    from PIL import Image
+
+    try:
+        # Must happen before any inter-op work; keeps torch from starting
+        # thread pools in the master that the forked workers can't use
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    processor, model = get_model()
+    if model is None or processor is None:
+        return False
+
+    with torch.no_grad():
+        model(pixel_values=_frame_preprocessor.batch([Image.new("RGB", (224, 224))]))
+
+    # Move everything allocated so far out of the collector's reach, so GC
+    # passes in the workers don't write to (and un-share) those pages
+    gc.collect()
+    gc.freeze()
+
+    _model_stats["preloaded"] = True
+    print("🔥 Model preloaded and warmed up")
+    return True
+
+
+def load_emotion_model(backend="eager"):
+    """Load the image processor and the model for an inference backend"""
+    # A snapshot directory must load without any network access
+    local = {"local_files_only": True} if EMOTION_MODEL_DIR else {}
+
+    if backend == "torchscript":
+        return load_torchscript_model(local)
+
+    import torch
+    from transformers import AutoConfig, AutoImageProcessor, AutoModelForImageClassification
+
+    processor = AutoImageProcessor.from_pretrained(
+        EMOTION_MODEL_SOURCE,
+        use_fast=True,
+        **local
+    )
+
+    if backend == "onnx":
+        return processor, OnnxEmotionModel(EMOTION_ONNX_PATH, AutoConfig.from_pretrained(EMOTION_MODEL_SOURCE, **local))
+
+    if EMOTION_MODEL_DIR:
+        local["use_safetensors"] = True
+    model = AutoModelForImageClassification.from_pretrained(
+        EMOTION_MODEL_SOURCE,
+        torch_dtype=torch.float32,  # Use CPU float32 (avoid GPU memory)
+        low_cpu_mem_usage=True,     # Reduce memory during loading
+        **local
+    )
+    model.eval()
+
+    if backend == "int8":
+        # Weights of every Linear layer stored as int8, activations
+        # quantized on the fly - most of the ViT's compute is in these layers
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend != "eager":
+        raise ValueError(f"Unknown EMOTION_MODEL_BACKEND: {backend}")
+
+    return processor, model
+
+
+def load_torchscript_model(local):
+    """
+    (processor, model) from the traced artifact in EMOTION_MODEL_CACHE_DIR,
+    tracing and caching it first if there is none for this model snapshot
+    and these torch/transformers versions. The artifact also carries the
+    image processor settings and labels, so a cached start doesn't import
+    transformers at all (importing its image processors alone takes seconds).
+    """
+    import torch
+    from importlib.metadata import version
+
+    model_dir = _local_model_dir(bool(local))
+
+    # A graph traced (and serialized) by one torch/transformers version
+    # isn't guaranteed to load or behave the same under another
+    def cache_path():
+        snapshot = model_snapshot_hash(model_dir)
+        if snapshot is None:
+            return None
+        name = f"vit-{snapshot[:16]}-torch{torch.__version__}-transformers{version('transformers')}.pt"
+        return os.path.join(EMOTION_MODEL_CACHE_DIR, name)
+
+    path = cache_path()
+    if path and os.path.exists(path):
+        print(f"📦 Loading TorchScript model from {path}")
+        extra = {"emotion.json": ""}
+        module = torch.jit.load(path, map_location="cpu", _extra_files=extra)
+        meta = json.loads(extra["emotion.json"])
+        config = SimpleNamespace(id2label={int(i): label for i, label in meta["id2label"].items()})
+        return SimpleNamespace(**meta["processor"]), TorchScriptEmotionModel(module, config)
+
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+    processor = AutoImageProcessor.from_pretrained(EMOTION_MODEL_SOURCE, use_fast=True, **local)
+    model = AutoModelForImageClassification.from_pretrained(EMOTION_MODEL_SOURCE, **local).eval()
+    module = trace_emotion_model(model)
+
+    # The files may only have been downloaded by from_pretrained above
+    path = path or cache_path()
+    if path:
+        # Everything FramePreprocessor and the batcher read from the processor and config
+        settings = {key: getattr(processor, key) for key in (
+            "resample", "do_rescale", "rescale_factor", "do_normalize", "image_mean", "image_std")}
+        settings["resample"] = int(settings["resample"])
+        settings["size"] = {"width": processor.size["width"], "height": processor.size["height"]}
+        meta = {"processor": settings, "id2label": model.config.id2label}
+        os.makedirs(EMOTION_MODEL_CACHE_DIR, exist_ok=True)
+        partial = f"{path}.{os.getpid()}.tmp"
+        torch.jit.save(module, partial, _extra_files={"emotion.json": json.dumps(meta)})
+        os.replace(partial, path)
+        print(f"💾 Cached TorchScript model at {path}")
+    return processor, TorchScriptEmotionModel(module, model.config)
+
+
+def trace_emotion_model(model):
+    """Trace pixel_values -> logits and freeze it for inference"""
+    import torch
+
+    size = model.config.image_size
+    with torch.no_grad():
+        traced = torch.jit.trace(logits_only(model), torch.zeros(1, 3, size, size), check_trace=False)
+    return torch.jit.freeze(traced)
+
+
+def logits_only(model):
+    """Wraps the HF model so an exported or traced graph has a single logits output"""
+    import torch
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model(pixel_values=pixel_values).logits
+
+    return LogitsOnly(model).eval()
+
+
+def _local_model_dir(local_files_only):
+    """Directory holding the model's files (the hub cache snapshot for a hub id)"""
+    if os.path.isdir(EMOTION_MODEL_SOURCE):
+        return EMOTION_MODEL_SOURCE
+    from huggingface_hub import hf_hub_download
+
+    return os.path.dirname(hf_hub_download(EMOTION_MODEL_SOURCE, "config.json", local_files_only=local_files_only))
+
+
+def model_snapshot_hash(model_dir):
+    """sha256 over the weight and config files in model_dir, or None if there are no weights yet"""
+    names = sorted(n for n in os.listdir(model_dir) if n.endswith((".safetensors", ".bin", ".json")))
+    if not any(n.endswith((".safetensors", ".bin")) for n in names):
+        return None
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(name.encode())
+        digest.update(_file_sha256(os.path.join(model_dir, name)).encode())
+    return digest.hexdigest()
+
+
+def _file_sha256(path):
+    # Hashing ~350 MB of weights costs about a second, so hashes are
+    # remembered in a sidecar next to the cached artifacts and reused
+    # while the file's size and mtime are unchanged
+    sidecar = os.path.join(EMOTION_MODEL_CACHE_DIR, "hashes.json")
+    stat = os.stat(path)
+    key = os.path.realpath(path)
+    try:
+        with open(sidecar) as f:
+            known = json.load(f)
+    except (OSError, ValueError):
+        known = {}
+
+    entry = known.get(key)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    known[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+
+    try:
+        os.makedirs(EMOTION_MODEL_CACHE_DIR, exist_ok=True)
+        partial = f"{sidecar}.{os.getpid()}.tmp"
+        with open(partial, "w") as f:
+            json.dump(known, f)
+        os.replace(partial, sidecar)
+    except OSError as e:
+        print(f"⚠️ Could not remember the weights hash: {e}")
+    return known[key]["sha256"]
+
+
+class FramePreprocessor:
+    """
+    Turns webcam JPEGs into the ViT's pixel_values without the generic HF
+    image processor. JPEG draft mode lets libjpeg decode straight at 1/2,
+    1/4 or 1/8 scale (never below the model's input size), and resize,
+    rescale, normalize and the HWC -> CHW layout are done in one NumPy pass
+    with the processor's own size, mean and std.
+    """
+
+    def __init__(self, processor):
+        import numpy as np
+        from PIL import Image
+
+        self.size = (processor.size["width"], processor.size["height"])
+        self.resample = getattr(processor, "resample", Image.BILINEAR)
+        scale = processor.rescale_factor if processor.do_rescale else 1.0
+        mean = np.array(processor.image_mean if processor.do_normalize else [0.0] * 3, dtype=np.float32)
+        std = np.array(processor.image_std if processor.do_normalize else [1.0] * 3, dtype=np.float32)
+        # (pixel * scale - mean) / std folded into one multiply-add
+        self._multiplier = (scale / std).astype(np.float32)
+        self._offset = (-mean / std).astype(np.float32)
+
+    def decode(self, image_bytes):
+        """Decode a frame at the smallest JPEG scale that still covers the model input"""
+        from PIL import Image
+
+        image = Image.open(io.BytesIO(image_bytes))
+        image.draft("RGB", self.size)
+        return image.convert("RGB")
+
+    def to_array(self, image):
+        """One image -> float32 array of shape (3, height, width)"""
+        import numpy as np
+
+        if image.size != self.size:
+            image = image.resize(self.size, self.resample)
+        pixels = np.asarray(image, dtype=np.float32)
+        pixels *= self._multiplier
+        pixels += self._offset
+        return pixels.transpose(2, 0, 1)
+
+    def batch(self, images):
+        """PIL images -> pixel_values tensor of shape (batch, 3, height, width)"""
+        import numpy as np
+        import torch
+
+        return torch.from_numpy(np.ascontiguousarray(np.stack([self.to_array(image) for image in images])))
+
+
+class OnnxEmotionModel:
+    """Exported ViT run by onnxruntime, called like the PyTorch model"""
+
+    def __init__(self, path, config):
+        # Optional dependency, only needed for the onnx backend
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.config = config
+
+    def __call__(self, pixel_values):
+        import torch
+
+        logits = self.session.run(["logits"], {"pixel_values": pixel_values.numpy()})[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+class TorchScriptEmotionModel:
+    """Traced ViT from the TorchScript cache, called like the PyTorch model"""
+
+    def __init__(self, module, config):
+        self.module = module
+        self.config = config
+
+    def __call__(self, pixel_values):
+        return SimpleNamespace(logits=self.module(pixel_values))
+
+
+# =======================
+# ⚡ MICRO-BATCHING INFERENCE ENGINE
+# =======================
+# Concurrent /detect requests are gathered for a few milliseconds (or until
+# the batch is full) and run through the model as one forward pass.
+# Tune with DETECT_BATCH_WINDOW_MS and DETECT_BATCH_MAX_SIZE; a window of 0
+# or a max size of 1 runs every frame inline in the request thread.
+
+class _InferenceJob:
+    """One frame waiting for a batched forward pass"""
+
+    def __init__(self, image):
+        self.image = image
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InferenceBatcher:
+    """Gathers concurrent frames and runs them through the loaded model together"""
+
+    def __init__(self, window_ms=5, max_batch_size=8, timeout=30):
+        self.window = max(window_ms, 0) / 1000.0
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_pid = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._frames = 0
+        self._batch_sizes = {}
+        self._waits_ms = deque(maxlen=1000)
+        self._inference_ms = deque(maxlen=1000)
+
+    def submit(self, image):
+        """Queue a PIL image and block until its (emotion, confidence, scores) is ready
+
+        scores maps every label to its softmax probability.
+        """
+        job = _InferenceJob(image)
+
+        if self.window == 0 or self.max_batch_size == 1:
+            self._run_batch([job])
+        else:
+            self._ensure_thread()
+            self._queue.put(job)
+            if not job.done.wait(self.timeout):
+                raise TimeoutError("Inference timed out")
+
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def submit_burst(self, images):
+        """Run a burst of frames from one request as a single forward pass
+
+        Returns one (emotion, confidence, scores) per image.
+        """
+        jobs = [_InferenceJob(image) for image in images]
+        self._run_batch(jobs)
+        for job in jobs:
+            if job.error is not None:
+                raise job.error
+        return [job.result for job in jobs]
+
+    def _ensure_thread(self):
+        # The thread is started lazily (and again after a fork) so that each
+        # gunicorn worker gets its own collector.
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._collect, name="inference-batcher", daemon=True)
+                self._thread_pid = os.getpid()
+                self._thread.start()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = batch[0].enqueued_at + self.window
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        started = time.monotonic()
+        try:
+            import torch
+
+            with model_lifecycle.in_use():
+                processor, model = loaded_model()
+                pixel_values = _frame_preprocessor.batch([job.image for job in batch])
+                with torch.no_grad():
+                    logits = model(pixel_values=pixel_values).logits
+            probs = torch.softmax(logits, dim=1)
+            confidences, class_ids = probs.max(dim=1)
+
+            labels = [model.config.id2label[i] for i in range(probs.shape[1])]
+            for i, job in enumerate(batch):
+                scores = dict(zip(labels, probs[i].tolist()))
+                job.result = (labels[class_ids[i].item()], confidences[i].item(), scores)
+        except Exception as e:
+            for job in batch:
+                job.error = e
+        finally:
+            finished = time.monotonic()
+            self._record(batch, started, finished)
+            for job in batch:
+                job.done.set()
+
+    def _record(self, batch, started, finished):
+        with self._stats_lock:
+            self._batches += 1
+            self._frames += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            for job in batch:
+                self._waits_ms.append((started - job.enqueued_at) * 1000)
+            self._inference_ms.append((finished - started) * 1000)
+
+    def stats(self):
+        """Batch-size and queue-wait metrics for tuning window/size"""
+        with self._stats_lock:
+            waits = sorted(self._waits_ms)
+            inference = sorted(self._inference_ms)
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+                "batches": self._batches,
+                "frames": self._frames,
+                "avg_batch_size": round(self._frames / self._batches, 2) if self._batches else 0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "queue_wait_ms": _percentiles(waits),
+                "inference_ms": _percentiles(inference),
+                "queue_depth": self._queue.qsize(),
+            }
+
+
+def _percentiles(sorted_values):
+    """p50/p95/max summary of an already sorted list of timings"""
+    if not sorted_values:
+        return {"p50": 0, "p95": 0, "max": 0}
+    return {
+        "p50": round(sorted_values[len(sorted_values) // 2], 2),
+        "p95": round(sorted_values[min(int(len(sorted_values) * 0.95), len(sorted_values) - 1)], 2),
+        "max": round(sorted_values[-1], 2),
+    }
+
+
+batcher = InferenceBatcher(
+    window_ms=float(os.environ.get("DETECT_BATCH_WINDOW_MS", 5)),
+    max_batch_size=int(os.environ.get("DETECT_BATCH_MAX_SIZE", 8)),
+)
+
+
+# =======================
+# 🛰️ SHARED INFERENCE SERVER
+# =======================
+# With INFERENCE_SOCKET set, /detect sends frames to one
+# `flask --app app inference-server` process (tools/inference_server.py)
+# over a Unix socket instead of loading a model copy into every gunicorn
+# worker. The server owns the only model and batches frames from all
+# workers together. A request is a 4-byte
+# frame count followed by that many frames, each a 4-byte length and the
+# JPEG bytes; the reply is one length-prefixed JSON message. If the server
+# can't be reached, the worker loads its own model through model_lifecycle
+# (answering with the fallback 503 until it's ready, never loading on the
+# request thread) and tries the server again after INFERENCE_RETRY_SECONDS.
+# The first frame the server answers again unloads that private copy.
+
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET")
+
+
+class InferenceUnavailable(Exception):
+    """The inference server didn't answer"""
+
+
+def _send_message(sock, payload):
+    sock.sendall(struct.pack("!I", len(payload)))
+    sock.sendall(payload)
+
+
+def _recv_message(sock, max_bytes):
+    """Next length-prefixed message, or None when the peer has gone"""
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    (length,) = struct.unpack("!I", header)
+    if length > max_bytes:
+        raise ValueError(f"Message of {length} bytes exceeds {max_bytes}")
+    return _recv_exact(sock, length)
+
+
+def _recv_exact(sock, length):
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return buffer
+
+
+class InferenceClient:
+    """Per-thread connections from a gunicorn worker to the inference server"""
+
+    def __init__(self, path, timeout, retry_after):
+        self.path = path
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self._stats = {"remote": 0, "failures": 0, "fallbacks": 0}
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def available(self):
+        return self.enabled and time.monotonic() >= self._down_until
+
+    def classify(self, frames):
+        """[(emotion, confidence, scores)] for a list of JPEG frames, or InferenceUnavailable"""
+        try:
+            sock = self._socket()
+            sock.sendall(struct.pack("!I", len(frames)))
+            for frame in frames:
+                _send_message(sock, frame)
+            reply = _recv_message(sock, 1 << 20)
+            if reply is None:
+                raise ConnectionError("Inference server closed the connection")
+        except (OSError, ValueError) as e:
+            self._close()
+            with self._lock:
+                self._stats["failures"] += 1
+                self._down_until = time.monotonic() + self.retry_after
+            raise InferenceUnavailable(str(e)) from e
+
+        result = json.loads(reply)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        with self._lock:
+            self._stats["remote"] += len(frames)
+        return [tuple(r) for r in result["results"]]
+
+    def fell_back(self):
+        with self._lock:
+            self._stats["fallbacks"] += 1
+
+    def _socket(self):
+        # One connection per thread, reopened after a fork or a failure
+        sock = getattr(self._local, "sock", None)
+        if sock is None or self._local.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+            self._local.pid = os.getpid()
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                enabled=self.enabled,
+                socket=self.path,
+                available=self.available(),
+            )
+
+
+inference_client = InferenceClient(
+    INFERENCE_SOCKET,
+    timeout=float(os.environ.get("INFERENCE_TIMEOUT_SECONDS", 10)),
+    retry_after=float(os.environ.get("INFERENCE_RETRY_SECONDS", 5)),
+)
+
+
+def classify_frame(image_bytes, image=None):
+    """(emotion, confidence, scores) from the inference server, else in-process
+
+    image is the already decoded frame, if the caller has one.
+    """
+    if inference_client.available():
+        try:
+            result = inference_client.classify([image_bytes])[0]
+        except InferenceUnavailable as e:
+            print(f"⚠️ Inference server unavailable ({e}), using the in-process model")
+        else:
+            model_lifecycle.release_fallback()
+            return result
+    if inference_client.enabled:
+        inference_client.fell_back()
+
+    if image is None:
+        loaded_model()
+        image = get_frame_preprocessor().decode(image_bytes)
+    # Batched with any other frames arriving at the same time
+    return batcher.submit(image)
+
+
+def classify_burst(frames):
+    """classify_frame for a burst of frames, run as one forward pass"""
+    if inference_client.available():
+        try:
+            results = inference_client.classify(frames)
+        except InferenceUnavailable as e:
+            print(f"⚠️ Inference server unavailable ({e}), using the in-process model")
+        else:
+            model_lifecycle.release_fallback()
+            return results
+    if inference_client.enabled:
+        inference_client.fell_back()
+
+    loaded_model()
+    preprocessor = get_frame_preprocessor()
+    return batcher.submit_burst([preprocessor.decode(frame) for frame in frames])
+
+
+def classify_burst_cached(user_id, frames):
+    """
+    classify_burst for only the frames that visibly changed. The first frame
+    is checked against the user's cached frame (as on /detect), every later
+    one against the frame before it; an unchanged frame reuses that result.
+    Returns (per-frame results, number of frames the model ran on).
+    """
+    hashes = [hash_frame(frame) for frame in frames]
+    results = [None] * len(frames)
+    sources = []    # index of the frame whose result each frame gets
+    changed = []
+    for i, frame_hash in enumerate(hashes):
+        if i == 0:
+            results[0] = frame_cache.lookup(user_id, frame_hash)
+            if results[0] is None:
+                changed.append(0)
+            sources.append(0)
+        elif frame_cache.same_frame(hashes[i - 1], frame_hash):
+            sources.append(sources[i - 1])
+        else:
+            changed.append(i)
+            sources.append(i)
+
+    if changed:
+        for i, result in zip(changed, classify_burst([frames[i] for i in changed])):
+            results[i] = result
+    results = [results[source] for source in sources]
+    frame_cache.store(user_id, hashes[-1], *results[-1])
+    return results, len(changed)
+
+
+# =======================
+# 🌐 ROUTES
+# =======================
+
+# Global error handler
+@app.errorhandler(Exception)
+def handle_error(e):
+    """Handle all unhandled exceptions"""
+    print(f"❌ Global error handler caught: {str(e)}")
+    return "Internal Server Error", 500
+
+
+@app.route('/')
+def index():
     return render_template('index.html')
 
 
@@ -313,20 +2089,12 @@ def manual_save():
         intensity = data.get('intensity', 2)
         
         if emotion:
-            conn = get_db()
-            conn.execute(
-                "INSERT INTO emotions (user_id, emotion, confidence) VALUES (?, ?, ?)",
-                (session['user_id'], emotion, intensity * 33.33)
-            )
-            conn.commit()
-            conn.close()
+            record_emotion(session['user_id'], emotion, intensity * 33.33)
             
-            # Find emotion match
-            matched_user_id, matched_username = find_emotion_match(session['user_id'], emotion)
+            # Pair with someone waiting on the same emotion (or start waiting)
+            match_id, matched_user_id, matched_username = matchmaker.pair(session['user_id'], emotion)
             
             if matched_user_id:
-                # Create match record
-                create_match(session['user_id'], matched_user_id, emotion)
                 return jsonify({
                     "success": True,
                     "message": "Emotion saved!",
@@ -349,182 +2117,897 @@ def manual_save():
         return jsonify({"error": "Something went wrong"}), 500
 
 
-@app.route('/dashboard')
-@login_required
-def dashboard():
+@app.route('/dashboard')
+@login_required
+def dashboard():
+    try:
+        write_behind.barrier()
+        emotions, next_before_id = get_emotion_history(session['user_id'])
+
+        # The chart is loaded from /dashboard/data
+        return render_template('dashboard.html', emotions=emotions, next_before_id=next_before_id)
+    except Exception as e:
+        print(f"❌ dashboard error: {str(e)}")
+        return "Internal Server Error", 500
+
+
+# The dashboard costs the same however much history a user has: the chart
+# comes from the emotion_daily rollup and the history list is read one
+# keyset page (DASHBOARD_PAGE_SIZE rows below a given id) at a time.
+DASHBOARD_PAGE_SIZE = int(os.environ.get("DASHBOARD_PAGE_SIZE", 20))
+DASHBOARD_CHART_DAYS = int(os.environ.get("DASHBOARD_CHART_DAYS", 30))
+
+
+def get_emotion_history(user_id, before_id=None, limit=None):
+    """One page of a user's emotions, newest first, plus the cursor for the next"""
+    limit = limit or DASHBOARD_PAGE_SIZE
+    rows = get_db().execute('''
+        SELECT id, emotion, confidence, created_at FROM emotions
+        WHERE user_id = ? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+    ''', (user_id, before_id or 2 ** 63 - 1, limit + 1)).fetchall()
+    next_before_id = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_before_id
+
+
+@app.route('/dashboard/data')
+@login_required
+def dashboard_data():
+    """Emotion totals and per-day counts for the dashboard chart"""
+    try:
+        write_behind.barrier()
+        conn = get_db()
+        user_id = session['user_id']
+
+        # The charts change when the user records a new emotion, and the
+        # daily window moves on at midnight (UTC, like the rollup's days)
+        row = conn.execute("SELECT emotion_id FROM user_state WHERE user_id = ?", (user_id,)).fetchone()
+        latest_id = (row['emotion_id'] if row else None) or 0
+        since = conn.execute("SELECT date('now', ?)", (f"-{DASHBOARD_CHART_DAYS - 1} days",)).fetchone()[0]
+        etag = f'"{user_id}-{latest_id}-{since}-{DASHBOARD_CHART_DAYS}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = app.response_class(status=304)
+            response.headers['ETag'] = etag
+            return response
+
+        totals = conn.execute('''
+            SELECT emotion, SUM(count) AS count FROM emotion_daily
+            WHERE user_id = ?
+            GROUP BY emotion
+            ORDER BY count DESC
+        ''', (user_id,)).fetchall()
+        daily = conn.execute('''
+            SELECT day, emotion, count FROM emotion_daily
+            WHERE user_id = ? AND day >= ?
+            ORDER BY day
+        ''', (user_id, since)).fetchall()
+
+        response = jsonify({
+            "totals": {r['emotion']: r['count'] for r in totals},
+            "daily": [dict(r) for r in daily],
+            "since": since,
+            "days": DASHBOARD_CHART_DAYS,
+            "latest_id": latest_id
+        })
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        print(f"❌ dashboard_data error: {str(e)}")
+        return jsonify({"error": "Something went wrong"}), 500
+
+
+@app.route('/dashboard/history')
+@login_required
+def dashboard_history():
+    """Older emotion history below ?before_id= (keyset pagination)"""
+    try:
+        write_behind.barrier()
+        before_id = request.args.get('before_id', type=int)
+        limit = min(max(request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int), 1), 100)
+        emotions, next_before_id = get_emotion_history(session['user_id'], before_id, limit)
+        return jsonify({
+            "emotions": [dict(row) for row in emotions],
+            "next_before_id": next_before_id
+        })
+    except Exception as e:
+        print(f"❌ dashboard_history error: {str(e)}")
+        return jsonify({"error": "Something went wrong"}), 500
+
+
+# =======================
+# 🔐 AUTH ROUTES
+# =======================
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    try:
+        if request.method == 'POST':
+            email = request.form.get('email')
+            password = request.form.get('password')
+
+            hashed_password = hash_password(password)
+
+            conn = get_db()
+            user = conn.execute(
+                'SELECT * FROM users WHERE email = ? AND password = ?',
+                (email, hashed_password)
+            ).fetchone()
+
+            if user:
+                session['user_id'] = user['id']
+                session['username'] = user['username']
+                return redirect(url_for('dashboard'))
+
+            flash("Invalid credentials")
+
+        return render_template('login.html')
+    except Exception as e:
+        print(f"❌ login error: {str(e)}")
+        return "Internal Server Error", 500
+
+
+@app.route('/signup', methods=['GET', 'POST'])
+def signup():
+    try:
+        if request.method == 'POST':
+            email = request.form.get('email')
+            username = request.form.get('username')
+            password = hash_password(request.form.get('password'))
+
+            conn = get_db()
+            conn.execute(
+                'INSERT INTO users (email, username, password) VALUES (?, ?, ?)',
+                (email, username, password)
+            )
+
+            return redirect(url_for('login'))
+
+        return render_template('signup.html')
+    except Exception as e:
+        print(f"❌ signup error: {str(e)}")
+        return "Internal Server Error", 500
+
+
+@app.route('/logout')
+def logout():
+    session.clear()
+    return redirect(url_for('index'))
+
+
+# =======================
+# 🎭 EMOTION DETECTION API
+# =======================
+
+# Contextual support messages based on emotion
+emotion_messages = {
+    "sad": "It seems you're feeling sad. Would you like to talk to someone or try a calming activity?",
+    "angry": "You look angry. Try taking a deep breath. Inhale slowly for 4 seconds.",
+    "happy": "You look happy! Spread positivity and connect with others.",
+    "fear": "You seem anxious. Try grounding yourself by focusing on breathing.",
+    "neutral": "You seem calm and balanced. A great time for meaningful conversations.",
+    "surprise": "That's surprising! Want to share what happened?",
+    "disgust": "You seem uncomfortable. Take a moment and relax."
+}
+
+# =======================
+# 🪞 FRAME RESULT CACHE
+# =======================
+# Someone sitting still in front of the camera sends nearly identical
+# frames every few seconds. Each user's last frame is kept as a 64-bit
+# difference hash; a new frame within DETECT_CACHE_MAX_DISTANCE bits of it
+# reuses the last prediction instead of running the model.
+
+def perceptual_hash(image):
+    """64-bit difference hash (dHash) of a 9x8 grayscale thumbnail
+
+    Neighbours within a couple of grey levels count as equal so sensor noise
+    over flat backgrounds doesn't flip bits.
+    """
+    import numpy as np
+    from PIL import Image
+
+    pixels = np.asarray(image.convert("L").resize((9, 8), Image.BOX), dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1] + 2
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def decode_thumbnail(image_bytes):
+    """Cheapest decode of a frame that still feeds perceptual_hash (JPEG at 1/8 scale)"""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("L", (64, 64))
+    return image.convert("L")
+
+
+def hash_frame(image_bytes):
+    """perceptual_hash of the uploaded bytes
+
+    Always hashed from the same grayscale thumbnail, whichever backend runs
+    the model, so a frame gets the same cache key in every deployment mode.
+    """
+    return perceptual_hash(decode_thumbnail(image_bytes))
+
+
+class FrameResultCache:
+    """Per-user LRU of (frame hash, emotion, confidence) with a TTL"""
+
+    def __init__(self, max_users, ttl, max_distance):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> (hash, emotion, confidence, scores, stored_at)
+        self._hits = 0
+        self._misses = 0
+
+    def lookup(self, user_id, frame_hash):
+        """Cached (emotion, confidence, scores) if this frame looks like the user's last one"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if (entry is not None and now - entry[4] <= self.ttl
+                    and (entry[0] ^ frame_hash).bit_count() <= self.max_distance):
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                return entry[1], entry[2], entry[3]
+            self._misses += 1
+            return None
+
+    def same_frame(self, previous_hash, frame_hash):
+        """Whether a burst frame looks like the one before it (counted like a lookup)"""
+        similar = (previous_hash ^ frame_hash).bit_count() <= self.max_distance
+        with self._lock:
+            if similar:
+                self._hits += 1
+            else:
+                self._misses += 1
+        return similar
+
+    def store(self, user_id, frame_hash, emotion, confidence, scores):
+        with self._lock:
+            self._entries[user_id] = (frame_hash, emotion, confidence, scores, time.monotonic())
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0,
+            }
+
+
+frame_cache = FrameResultCache(
+    max_users=int(os.environ.get("DETECT_CACHE_MAX_USERS", 5000)),
+    ttl=float(os.environ.get("DETECT_CACHE_TTL_SECONDS", 30)),
+    max_distance=int(os.environ.get("DETECT_CACHE_MAX_DISTANCE", 4)),
+)
+
+
+# =======================
+# 〰️ EMOTION SMOOTHING
+# =======================
+# Auto mode sends a frame every few seconds and single frames flicker
+# between neighbouring labels. Each user's softmax scores are folded into an
+# exponential moving average and the smoothed label is what gets matched and
+# stored. A new emotions row is written only when that label differs from
+# user_state or EMOTION_HEARTBEAT_SECONDS have passed since the last one, so
+# a long session no longer appends a near-identical row per frame.
+# The average itself lives in the user's user_state row (a one-row upsert
+# per reading, group-committed by write_behind), so consecutive frames
+# served by different gunicorn workers fold into the same average instead
+# of two diverging ones that would store each other's labels as changes.
+
+def _store_smoothed(conn, user_id, scores, now):
+    conn.execute('''
+        INSERT INTO user_state (user_id, smoothed, smoothed_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            smoothed = excluded.smoothed,
+            smoothed_at = excluded.smoothed_at
+    ''', (user_id, json.dumps(scores), now))
+
+
+class EmotionSmoother:
+    """Per-user exponential moving average over softmax scores, kept in user_state"""
+
+    def __init__(self, alpha, heartbeat):
+        self.alpha = min(max(alpha, 0.01), 1.0)
+        self.heartbeat = heartbeat
+        self._lock = threading.Lock()
+        self._persisted = 0
+        self._suppressed = 0
+
+    def update(self, user_id, scores):
+        """Fold scores into the user's average and return (emotion, confidence)"""
+        now = time.time()
+        write_behind.barrier()
+        row = get_db().execute(
+            "SELECT smoothed, smoothed_at FROM user_state WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        # A long gap means a new session - don't carry the old mood over
+        if row is not None and row['smoothed'] and now - row['smoothed_at'] <= self.heartbeat:
+            previous = json.loads(row['smoothed'])
+            scores = {
+                label: self.alpha * p + (1 - self.alpha) * previous.get(label, 0.0)
+                for label, p in scores.items()
+            }
+        write_behind.submit(_store_smoothed, (user_id, scores, now))
+
+        emotion = max(scores, key=scores.get)
+        return emotion, scores[emotion]
+
+    def should_persist(self, user_id, emotion):
+        """True if emotion differs from user_state or the heartbeat is due"""
+        write_behind.barrier()
+        row = get_db().execute(
+            "SELECT emotion, updated_at FROM user_state WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        persist = (row is None or row['emotion'] != emotion or row['updated_at'] is None
+                   or time.time() - row['updated_at'] >= self.heartbeat)
+        with self._lock:
+            if persist:
+                self._persisted += 1
+            else:
+                self._suppressed += 1
+        return persist
+
+    def stats(self):
+        with self._lock:
+            return {
+                "persisted": self._persisted,
+                "suppressed": self._suppressed,
+            }
+
+
+emotion_smoother = EmotionSmoother(
+    alpha=float(os.environ.get("EMOTION_SMOOTHING_ALPHA", 0.4)),
+    heartbeat=float(os.environ.get("EMOTION_HEARTBEAT_SECONDS", 60)),
+)
+
+
+# =======================
+# 🚦 DETECT ADMISSION CONTROL
+# =======================
+# Every /detect runs CPU-bound inference on one of a few worker threads, so
+# requests are admitted before any of that work starts. Each user gets a
+# token bucket of DETECT_RATE_BURST requests refilled at
+# DETECT_RATE_PER_SECOND (over it: 429), and all workers together run at
+# most DETECT_MAX_IN_FLIGHT detections at once with up to DETECT_MAX_QUEUED
+# more waiting DETECT_QUEUE_TIMEOUT_SECONDS for a slot (beyond that: 503).
+# Both answer at once with Retry-After, keeping latency bounded for the
+# requests that do get in. A request that is shed or not served (a 5xx,
+# e.g. the model-loading fallback) gets its token back.
+#
+# The in-flight and queue slots are files in the runtime directory, each
+# held with flock() by the request using it, so the bound is shared by
+# every gunicorn worker and the kernel frees a crashed worker's slots. The
+# token buckets live next to them in one file of fixed-size records (one
+# per user, indexed by user id), each updated under a lockf() byte-range
+# lock, so a user gets the configured rate however many workers serve them.
+# The token is spent before the upload is read; the slot is only taken
+# once the frames are in memory, so a slow upload doesn't hold one.
+
+class AdmissionRejected(Exception):
+    """A request turned away, with the HTTP status and Retry-After seconds to answer with"""
+
+    def __init__(self, status, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class DetectAdmission:
+    """Per-user token buckets plus a cross-worker bound on in-flight and queued detections"""
+
+    # One bucket in the shared file: user id, tokens, updated_at (monotonic)
+    _RECORD = struct.Struct("=qdd")
+
+    def __init__(self, rate, burst, max_in_flight, max_queued, queue_timeout, slot_dir,
+                 max_users=10000, poll_interval=0.005):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_in_flight = max(int(max_in_flight), 1)
+        self.max_queued = max(int(max_queued), 0)
+        self.queue_timeout = queue_timeout
+        self.slot_dir = slot_dir
+        self.max_users = max_users        # records in the bucket file
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._slot_dir_ready = False
+        self._bucket_fd = None
+        self._in_flight = 0               # this worker's share of the slots
+        self._queued = 0
+        self._stats = {"admitted": 0, "rate_limited": 0, "shed_queue_full": 0,
+                       "shed_queue_timeout": 0, "refunded": 0}
+        self._waits_ms = deque(maxlen=1000)
+
+    @contextmanager
+    def admit(self, user_id):
+        """take_token and slot together, refunding the token if the slot is refused"""
+        self.take_token(user_id)
+        try:
+            with self.slot():
+                yield
+        except AdmissionRejected:
+            self.refund(user_id)
+            raise
+
+    def take_token(self, user_id):
+        """Spend one of the user's tokens, or raise AdmissionRejected (429)"""
+        if self.rate <= 0:
+            return
+        with self._shared_bucket(user_id) as (bucket, save):
+            now = time.monotonic()
+            tokens, updated_at = bucket or (self.burst, now)
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                save(tokens, now)
+                self._stats["rate_limited"] += 1
+                raise AdmissionRejected(429, math.ceil((1 - tokens) / self.rate), "rate limited")
+            save(tokens - 1, now)
+
+    def refund(self, user_id):
+        """Give back the token of a request that was shed or not served"""
+        if self.rate <= 0:
+            return
+        with self._shared_bucket(user_id) as (bucket, save):
+            if bucket is not None:
+                save(min(self.burst, bucket[0] + 1), bucket[1])
+                self._stats["refunded"] += 1
+
+    @contextmanager
+    def _shared_bucket(self, user_id):
+        """
+        The user's (tokens, updated_at), or None for a fresh bucket, and a
+        save(tokens, updated_at) function, with the record locked against
+        other workers and self._lock held
+        """
+        size = self._RECORD.size
+        offset = (user_id % self.max_users) * size
+        fd = self._bucket_file()
+        # lockf() locks belong to the process, so threads still need _lock
+        with self._lock:
+            fcntl.lockf(fd, fcntl.LOCK_EX, size, offset)
+            try:
+                record = os.pread(fd, size, offset)
+                owner, tokens, updated_at = self._RECORD.unpack(record) if len(record) == size else (0, 0.0, 0.0)
+                # Another user sharing the record, or a record written
+                # before a reboot (another monotonic clock): start afresh
+                bucket = (tokens, updated_at) if owner == user_id and 0 < updated_at <= time.monotonic() else None
+
+                def save(tokens, updated_at):
+                    os.pwrite(fd, self._RECORD.pack(user_id, tokens, updated_at), offset)
+
+                yield bucket, save
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, size, offset)
+
+    def _bucket_file(self):
+        """fd of the shared bucket file, opened once per worker"""
+        if self._bucket_fd is None:
+            path = os.path.join(self._directory(), "buckets")
+            with self._lock:
+                if self._bucket_fd is None:
+                    self._bucket_fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        return self._bucket_fd
+
+    @contextmanager
+    def slot(self):
+        """Hold an inference slot for the request, or raise AdmissionRejected (503)"""
+        slot = self._acquire_slot()
+        try:
+            yield
+        finally:
+            os.close(slot)   # drops the flock
+            with self._lock:
+                self._in_flight -= 1
+                self._slot_freed.notify()
+
+    def _acquire_slot(self):
+        # Each frame takes about a forward pass, so a full queue clears in
+        # roughly a second or two
+        started = time.monotonic()
+        slot = self._lock_one("slot", self.max_in_flight)
+        if slot is None:
+            ticket = self._lock_one("queue", self.max_queued)
+            if ticket is None:
+                with self._lock:
+                    self._stats["shed_queue_full"] += 1
+                raise AdmissionRejected(503, 1, "queue full")
+
+            deadline = started + self.queue_timeout
+            with self._lock:
+                self._queued += 1
+            try:
+                while slot is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self._lock:
+                            self._stats["shed_queue_timeout"] += 1
+                        raise AdmissionRejected(503, 1, "queue timeout")
+                    # Woken at once by this worker's requests, by polling
+                    # for slots freed in other workers
+                    with self._slot_freed:
+                        self._slot_freed.wait(min(remaining, self.poll_interval))
+                    slot = self._lock_one("slot", self.max_in_flight)
+            finally:
+                os.close(ticket)
+                with self._lock:
+                    self._queued -= 1
+
+        with self._lock:
+            self._in_flight += 1
+            self._stats["admitted"] += 1
+            self._waits_ms.append((time.monotonic() - started) * 1000)
+        return slot
+
+    def _lock_one(self, kind, count):
+        """An fd holding the flock on one free <kind>-N file, or None if all count are held"""
+        directory = self._directory()
+        for i in range(count):
+            fd = os.open(os.path.join(directory, f"{kind}-{i}"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            return fd
+        return None
+
+    def _directory(self):
+        if not self._slot_dir_ready:
+            with self._lock:
+                if not self._slot_dir_ready:
+                    try:
+                        ensure_private_dir(self.slot_dir)
+                    except OSError as e:
+                        # Still bounded, but only within this worker
+                        self.slot_dir = tempfile.mkdtemp(prefix="echobridge-admission-")
+                        print(f"⚠️ Shared admission slots unavailable ({e}), limiting per worker")
+                    self._slot_dir_ready = True
+        return self.slot_dir
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                in_flight=self._in_flight,
+                queued=self._queued,
+                max_in_flight=self.max_in_flight,
+                max_queued=self.max_queued,
+                rate_per_second=self.rate,
+                burst=self.burst,
+                slot_dir=self.slot_dir,
+                queue_wait_ms=_percentiles(sorted(self._waits_ms)),
+            )
+
+
+detect_admission = DetectAdmission(
+    rate=float(os.environ.get("DETECT_RATE_PER_SECOND", 1)),
+    burst=float(os.environ.get("DETECT_RATE_BURST", 5)),
+    max_in_flight=int(os.environ.get("DETECT_MAX_IN_FLIGHT", 4)),
+    max_queued=int(os.environ.get("DETECT_MAX_QUEUED", 8)),
+    queue_timeout=float(os.environ.get("DETECT_QUEUE_TIMEOUT_SECONDS", 1)),
+    slot_dir=os.path.join(RUNTIME_DIR, "admission"),
+)
+
+
+def admission_controlled(f):
+    """
+    Run a detection view only if the user has a token left. The view takes
+    its inference slot with detect_admission.slot() once the upload is read.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        user_id = session['user_id']
+        try:
+            detect_admission.take_token(user_id)
+            response = app.make_response(f(*args, **kwargs))
+        except AdmissionRejected as e:
+            if e.status != 429:
+                # Shed while waiting for a slot
+                detect_admission.refund(user_id)
+            if e.status == 429:
+                message = "Too many detection requests. Please slow down."
+            else:
+                message = "Emotion detection is busy. Please try again shortly."
+            response = jsonify({"error": message, "retry_after": e.retry_after})
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response, e.status
+        if response.status_code >= 500:
+            # Not served (model still loading, detection failed): don't
+            # charge it against the user's burst
+            detect_admission.refund(user_id)
+        return response
+    return decorated_function
+
+
+# Largest webcam frame /detect accepts, checked before the body is read
+DETECT_MAX_FRAME_BYTES = int(os.environ.get("DETECT_MAX_FRAME_BYTES", 2 * 1024 * 1024))
+# Most frames one /detect-batch burst may carry
+DETECT_BURST_MAX_FRAMES = int(os.environ.get("DETECT_BURST_MAX_FRAMES", 8))
+
+# No request body may be larger than the largest burst; the detect routes
+# lower the limit further per request
+app.config["MAX_CONTENT_LENGTH"] = DETECT_BURST_MAX_FRAMES * (DETECT_MAX_FRAME_BYTES * 4 // 3 + 1024) + 64 * 1024
+
+
+def read_json_body(max_body):
+    """
+    Parse a JSON request body of at most max_body bytes. Reads one byte past
+    the limit so Werkzeug raises RequestEntityTooLarge for an oversized
+    chunked body (get_json() would quietly parse the truncated prefix).
+    Returns the parsed value, or None if the body isn't valid JSON.
+    """
+    chunks, size = [], 0
+    while size <= max_body:
+        chunk = request.stream.read(min(max_body + 1 - size, 64 * 1024))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    if size > max_body:
+        raise RequestEntityTooLarge()
+    body = b"".join(chunks)
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def read_frame_upload():
+    """
+    Read the uploaded frame as JPEG bytes. Accepts, in order of preference:
+      - a raw image/jpeg (or image/png) request body (auto.html)
+      - a multipart form with a "frame" file
+      - the old JSON body {"image": "data:image/jpeg;base64,..."}
+    Returns (image_bytes, None) or (None, error_response).
+    """
+    limit = DETECT_MAX_FRAME_BYTES
+    mimetype = request.mimetype
+    # Base64 inflates the JSON form by a third
+    max_body = limit * 4 // 3 + 1024 if mimetype == "application/json" else limit + 64 * 1024
+
+    if request.content_length is not None and request.content_length > max_body:
+        return None, (jsonify({"error": "Image too large"}), 413)
+    # Enforced while Werkzeug reads the body, so a chunked upload (no
+    # Content-Length) is cut off at the limit instead of buffered whole
+    request.max_content_length = max_body
+
     try:
-        conn = get_db()
-        emotions = conn.execute(
-            "SELECT emotion, confidence, created_at FROM emotions WHERE user_id = ? ORDER BY created_at DESC",
-            (session['user_id'],)
-        ).fetchall()
-        conn.close()
+        if mimetype in ("image/jpeg", "image/png", "application/octet-stream"):
+            image_bytes = request.stream.read(limit + 1)
+        elif mimetype == "multipart/form-data":
+            frame = request.files.get("frame")
+            image_bytes = frame.stream.read(limit + 1) if frame else b""
+        else:
+            data = read_json_body(max_body)
+            image_bytes = None
+    except RequestEntityTooLarge:
+        return None, (jsonify({"error": "Image too large"}), 413)
 
-        return render_template('dashboard.html', emotions=emotions)
-    except Exception as e:
-        print(f"❌ dashboard error: {str(e)}")
-        return "Internal Server Error", 500
+    if image_bytes is None:
+        if not isinstance(data, dict) or "image" not in data:
+            return None, (jsonify({"error": "No image received"}), 400)
+        try:
+            image_bytes = base64.b64decode(data["image"].split(",")[-1])
+        except (AttributeError, TypeError, ValueError):
+            return None, (jsonify({"error": "Invalid image data"}), 400)
 
+    if not image_bytes:
+        return None, (jsonify({"error": "No image received"}), 400)
+    if len(image_bytes) > limit:
+        # Chunked uploads have no Content-Length to check up front
+        return None, (jsonify({"error": "Image too large"}), 413)
+    return image_bytes, None
 
-# =======================
-# 🔐 AUTH ROUTES
-# =======================
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    try:
-        if request.method == 'POST':
-            email = request.form.get('email')
-            password = request.form.get('password')
+def read_burst_upload():
+    """
+    Read a burst of frames as a list of JPEG bytes, from either
+      - a multipart form with several "frame" files (auto.html burst mode)
+      - a JSON body {"images": ["data:image/jpeg;base64,...", ...]}
+    Returns (frames, None) or (None, error_response).
+    """
+    limit = DETECT_MAX_FRAME_BYTES
+    max_frames = DETECT_BURST_MAX_FRAMES
+    max_body = max_frames * (limit * 4 // 3 + 1024) + 64 * 1024
 
-            hashed_password = hash_password(password)
+    if request.content_length is not None and request.content_length > max_body:
+        return None, (jsonify({"error": "Burst too large"}), 413)
+    # As in read_frame_upload: also caps chunked bodies while they're read
+    request.max_content_length = max_body
 
-            conn = get_db()
-            user = conn.execute(
-                'SELECT * FROM users WHERE email = ? AND password = ?',
-                (email, hashed_password)
-            ).fetchone()
-            conn.close()
+    try:
+        if request.mimetype == "multipart/form-data":
+            uploads = request.files.getlist("frame")
+            data = None
+        else:
+            data = read_json_body(max_body)
+    except RequestEntityTooLarge:
+        return None, (jsonify({"error": "Burst too large"}), 413)
 
-            if user:
-                session['user_id'] = user['id']
-                session['username'] = user['username']
-                return redirect(url_for('dashboard'))
+    if request.mimetype == "multipart/form-data":
+        if len(uploads) > max_frames:
+            return None, (jsonify({"error": f"At most {max_frames} frames per burst"}), 400)
+        frames = [upload.stream.read(limit + 1) for upload in uploads]
+    else:
+        images = data.get("images") if isinstance(data, dict) else None
+        if not isinstance(images, list):
+            return None, (jsonify({"error": "No images received"}), 400)
+        if len(images) > max_frames:
+            return None, (jsonify({"error": f"At most {max_frames} frames per burst"}), 400)
+        try:
+            frames = [base64.b64decode(image.split(",")[-1]) for image in images]
+        except (AttributeError, TypeError, ValueError):
+            return None, (jsonify({"error": "Invalid image data"}), 400)
 
-            flash("Invalid credentials")
+    frames = [frame for frame in frames if frame]
+    if not frames:
+        return None, (jsonify({"error": "No images received"}), 400)
+    if any(len(frame) > limit for frame in frames):
+        return None, (jsonify({"error": "Image too large"}), 413)
+    return frames, None
 
-        return render_template('login.html')
-    except Exception as e:
-        print(f"❌ login error: {str(e)}")
-        return "Internal Server Error", 500
 
+def aggregate_burst(results):
+    """
+    Combine per-frame (emotion, confidence, scores) into one reading by
+    averaging the softmax scores. Returns (emotion, confidence, scores, spread)
+    where spread describes how much the frames agreed on that emotion.
+    """
+    labels = results[0][2].keys()
+    scores = {label: sum(r[2][label] for r in results) / len(results) for label in labels}
+    emotion = max(scores, key=scores.get)
 
-@app.route('/signup', methods=['GET', 'POST'])
-def signup():
-    try:
-        if request.method == 'POST':
-            email = request.form.get('email')
-            username = request.form.get('username')
-            password = hash_password(request.form.get('password'))
+    per_frame = [r[2][emotion] for r in results]
+    mean = scores[emotion]
+    spread = {
+        "frames": len(results),
+        "agreement": round(sum(1 for r in results if r[0] == emotion) / len(results), 2),
+        "min": round(min(per_frame) * 100, 2),
+        "max": round(max(per_frame) * 100, 2),
+        "stdev": round((sum((p - mean) ** 2 for p in per_frame) / len(per_frame)) ** 0.5 * 100, 2),
+    }
+    return emotion, mean, scores, spread
 
-            conn = get_db()
-            conn.execute(
-                'INSERT INTO users (email, username, password) VALUES (?, ?, ?)',
-                (email, username, password)
-            )
-            conn.commit()
-            conn.close()
 
-            return redirect(url_for('login'))
+def finish_detection(emotion, confidence, raw_emotion, **extra):
+    """Store the (smoothed) reading if due, try to pair the user and build the /detect response"""
+    # Get contextual support message
+    message = emotion_messages.get(emotion, "Stay positive!")
 
-        return render_template('signup.html')
-    except Exception as e:
-        print(f"❌ signup error: {str(e)}")
-        return "Internal Server Error", 500
+    # Save emotion only when the smoothed label changes (or on a heartbeat)
+    if emotion_smoother.should_persist(session['user_id'], emotion):
+        record_emotion(session['user_id'], emotion, confidence * 100)
 
+    # Pair with someone waiting on the same emotion (or start waiting)
+    match_id, matched_user_id, matched_username = matchmaker.pair(session['user_id'], emotion)
 
-@app.route('/logout')
-def logout():
-    session.clear()
-    return redirect(url_for('index'))
+    response = {
+        "emotion": emotion,
+        "confidence": round(confidence * 100, 2),
+        "raw_emotion": raw_emotion,
+        "message": message,
+        **extra,
+    }
+    if matched_user_id:
+        response.update(matched=True, matched_user=matched_username, match_emotion=emotion)
+    else:
+        response.update(matched=False, message_match="Waiting for someone with similar emotion...")
+    return jsonify(response)
 
 
-# =======================
-# 🎭 EMOTION DETECTION API
-# =======================
+def model_loading_response():
+    """The graceful 503 while the model is (re)loading in the background"""
+    print("⚠️ Model not available, returning graceful error")
+    # Loading usually takes a few seconds
+    return jsonify({
+        "error": "Emotion detection temporarily unavailable. Please try manual selection.",
+        "fallback": True
+    }), 503, {"Retry-After": "5"}
 
-# Contextual support messages based on emotion
-emotion_messages = {
-    "sad": "It seems you're feeling sad. Would you like to talk to someone or try a calming activity?",
-    "angry": "You look angry. Try taking a deep breath. Inhale slowly for 4 seconds.",
-    "happy": "You look happy! Spread positivity and connect with others.",
-    "fear": "You seem anxious. Try grounding yourself by focusing on breathing.",
-    "neutral": "You seem calm and balanced. A great time for meaningful conversations.",
-    "surprise": "That's surprising! Want to share what happened?",
-    "disgust": "You seem uncomfortable. Take a moment and relax."
-}
 
 @app.route('/detect', methods=['POST'])
 @login_required
+@admission_controlled
 def detect_emotion():
     """Detect emotion from uploaded image with full error handling"""
+    started = time.monotonic()
     
-    # Use lazy loading to get model
-    processor, model = get_model()
-    
-    if model is None or processor is None:
-        print("⚠️ Model not available, returning graceful error")
-        return jsonify({
-            "error": "Emotion detection temporarily unavailable. Please try manual selection.",
-            "fallback": True
-        }), 503
+    # Not needed while the inference server is up; otherwise the model is
+    # loaded (or reloaded after an idle unload) in the background while
+    # the client falls back
+    remote = inference_client.available()
+    if not remote:
+        if not model_lifecycle.ready():
+            return model_loading_response()
 
-    data = request.get_json()
+    image_bytes, error = read_frame_upload()
+    if error:
+        return error
 
-    if not data or "image" not in data:
-        return jsonify({"error": "No image received"}), 400
+    # Only now that the frame is in memory: a slow upload doesn't hold a slot
+    with detect_admission.slot():
+        try:
+            # Reuse the last prediction if the frame hasn't visibly changed
+            frame_hash = hash_frame(image_bytes)
+            cached = frame_cache.lookup(session['user_id'], frame_hash)
 
-    try:
-        # Decode and process image
-        image_data = data["image"].split(",")[1]
-        image_bytes = base64.b64decode(image_data)
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+            if cached:
+                raw_emotion, raw_confidence, scores = cached
+            else:
+                # The server decodes the frame itself; locally decode at reduced
+                # scale - the model only needs its input size
+                image = None if remote else get_frame_preprocessor().decode(image_bytes)
+                raw_emotion, raw_confidence, scores = classify_frame(image_bytes, image)
+                frame_cache.store(session['user_id'], frame_hash, raw_emotion, raw_confidence, scores)
 
-        inputs = processor(images=image, return_tensors="pt")
+                if _model_stats["first_detect_ms"] is None:
+                    _model_stats["first_detect_ms"] = round((time.monotonic() - started) * 1000, 1)
 
-        with torch.no_grad():
-            outputs = model(**inputs)
+            # Smooth over recent frames so one odd frame doesn't flip the label
+            emotion, confidence = emotion_smoother.update(session['user_id'], scores)
+            print("🎯 Predicted Emotion:", raw_emotion, "→ smoothed:", emotion)
 
-        logits = outputs.logits
-        predicted_class_id = logits.argmax().item()
+            return finish_detection(emotion, confidence, raw_emotion)
 
-        emotion = model.config.id2label[predicted_class_id]
-        confidence = torch.softmax(logits, dim=1)[0][predicted_class_id].item()
+        except ModelUnavailable:
+            # Unloaded between the readiness check and inference
+            return model_loading_response()
+        except Exception as e:
+            print("❌ Detection Error:", str(e))
+            # Return graceful error instead of crashing
+            return jsonify({
+                "error": "Detection failed. Please try again or use manual selection.",
+                "fallback": True
+            }), 500
 
-        print("🎯 Predicted Emotion:", emotion)
 
-        # Get contextual support message
-        message = emotion_messages.get(emotion, "Stay positive!")
+@app.route('/detect-batch', methods=['POST'])
+@login_required
+@admission_controlled
+def detect_emotion_batch():
+    """Detect one emotion from a short burst of frames, run as a single batch"""
+    if not inference_client.available():
+        if not model_lifecycle.ready():
+            return model_loading_response()
 
-        # Save emotion
-        conn = get_db()
-        conn.execute(
-            "INSERT INTO emotions (user_id, emotion, confidence) VALUES (?, ?, ?)",
-            (session['user_id'], emotion, confidence * 100)
-        )
-        conn.commit()
-        conn.close()
+    frames, error = read_burst_upload()
+    if error:
+        return error
 
-        # Find emotion match
-        matched_user_id, matched_username = find_emotion_match(session['user_id'], emotion)
-        
-        if matched_user_id:
-            # Create match record
-            create_match(session['user_id'], matched_user_id, emotion)
-            return jsonify({
-                "emotion": emotion,
-                "confidence": round(confidence * 100, 2),
-                "message": message,
-                "matched": True,
-                "matched_user": matched_username,
-                "match_emotion": emotion
-            })
-        else:
-            return jsonify({
-                "emotion": emotion,
-                "confidence": round(confidence * 100, 2),
-                "message": message,
-                "matched": False,
-                "message_match": "Waiting for someone with similar emotion..."
-            })
+    with detect_admission.slot():
+        try:
+            # Frames that haven't visibly changed skip the forward pass
+            results, classified = classify_burst_cached(session['user_id'], frames)
+            raw_emotion, raw_confidence, scores, spread = aggregate_burst(results)
 
-    except Exception as e:
-        print("❌ Detection Error:", str(e))
-        # Return graceful error instead of crashing
-        return jsonify({
-            "error": "Detection failed. Please try again or use manual selection.",
-            "fallback": True
-        }), 500
+            # The burst is one reading: one smoothing step, at most one insert
+            # and one matchmaking attempt
+            emotion, confidence = emotion_smoother.update(session['user_id'], scores)
+            print("🎯 Predicted Emotion (burst of", len(frames), ",", classified, "classified):",
+                  raw_emotion, "→ smoothed:", emotion)
+
+            return finish_detection(emotion, confidence, raw_emotion, spread=spread)
+
+        except ModelUnavailable:
+            return model_loading_response()
+        except Exception as e:
+            print("❌ Detection Error:", str(e))
+            return jsonify({
+                "error": "Detection failed. Please try again or use manual selection.",
+                "fallback": True
+            }), 500
 
 
 # =======================
@@ -549,12 +3032,10 @@ def match_status():
             JOIN users u1 ON m.user1_id = u1.id
             JOIN users u2 ON m.user2_id = u2.id
             WHERE m.user1_id = ? OR m.user2_id = ?
-            ORDER BY m.created_at DESC
+            ORDER BY m.id DESC
             LIMIT 1
         ''', (session['user_id'], session['user_id'], session['user_id'])).fetchone()
         
-        conn.close()
-        
         if match:
             return jsonify({
                 "matched": True,
@@ -594,29 +3075,18 @@ def find_match():
             })
         
         # Get user's latest emotion
-        conn = get_db()
-        latest_emotion = conn.execute('''
-            SELECT emotion FROM emotions 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (session['user_id'],)).fetchone()
-        conn.close()
+        emotion = latest_emotions.get(session['user_id'])
         
-        if not latest_emotion:
+        if not emotion:
             return jsonify({
                 "matched": False,
                 "message": "No emotion detected yet. Please detect your emotion first."
             })
         
-        emotion = latest_emotion['emotion']
-        
         # Try to find a match
-        matched_user_id, matched_username = find_emotion_match(session['user_id'], emotion)
+        match_id, matched_user_id, matched_username = matchmaker.pair(session['user_id'], emotion)
         
         if matched_user_id:
-            # Create match
-            match_id = create_match(session['user_id'], matched_user_id, emotion)
             return jsonify({
                 "matched": True,
                 "match_id": match_id,
@@ -656,7 +3126,6 @@ def chat(match_id):
             JOIN users u2 ON m.user2_id = u2.id
             WHERE m.id = ?
         ''', (session['user_id'], match_id)).fetchone()
-        conn.close()
         
         if not match:
             flash("Chat not found")
@@ -705,7 +3174,17 @@ def get_messages_route(match_id):
         if not validate_match_access(session['user_id'], match_id):
             return jsonify({"error": "Unauthorized"}), 403
         
-        messages = get_messages(match_id)
+        since_id = request.args.get('since_id', 0, type=int)
+
+        # Cheap "nothing new" answer: the ETag is the latest message id
+        latest_id = get_latest_message_id(match_id)
+        etag = f'"{match_id}-{latest_id}"'
+        if latest_id <= since_id or request.headers.get('If-None-Match') == etag:
+            response = app.response_class(status=304)
+            response.headers['ETag'] = etag
+            return response
+
+        messages = get_messages(match_id, since_id)
         
         # Format messages with sender info
         formatted_messages = []
@@ -718,12 +3197,82 @@ def get_messages_route(match_id):
                 "is_me": msg['sender_id'] == session['user_id']
             })
         
-        return jsonify({"messages": formatted_messages})
+        last_id = formatted_messages[-1]["id"] if formatted_messages else latest_id
+        response = jsonify({"messages": formatted_messages, "last_id": last_id})
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         print(f"❌ get_messages error: {str(e)}")
         return jsonify({"error": "Something went wrong"}), 500
 
 
+# Server-Sent Events push channel for a match. Each stream lives for at most
+# CHAT_STREAM_SECONDS (the browser reconnects with Last-Event-ID) and each
+# worker holds at most CHAT_STREAM_MAX_PER_WORKER of them so streams cannot
+# starve the thread pool; clients over the limit fall back to polling.
+CHAT_STREAM_SECONDS = float(os.environ.get("CHAT_STREAM_SECONDS", 55))
+CHAT_STREAM_HEARTBEAT_SECONDS = float(os.environ.get("CHAT_STREAM_HEARTBEAT_SECONDS", 15))
+_chat_stream_slots = threading.BoundedSemaphore(int(os.environ.get("CHAT_STREAM_MAX_PER_WORKER", 4)))
+
+
+@app.route('/chat-stream/<int:match_id>')
+@login_required
+def chat_stream(match_id):
+    """Push new messages and the end-of-chat event as they happen"""
+    if not validate_match_access(session['user_id'], match_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    if not _chat_stream_slots.acquire(blocking=False):
+        return jsonify({"error": "Too many open streams"}), 503
+
+    user_id = session['user_id']
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('since_id', 0, type=int)
+    redirect_url = url_for('dashboard')
+
+    def generate():
+        nonlocal last_id
+        version = notification_bus.subscribe(match_id)
+        try:
+            deadline = time.monotonic() + CHAT_STREAM_SECONDS
+            yield "retry: 1000\n\n"
+
+            while True:
+                for msg in get_messages(match_id, last_id):
+                    last_id = msg['id']
+                    payload = json.dumps({
+                        "id": msg['id'],
+                        "sender_id": msg['sender_id'],
+                        "message": msg['message'],
+                        "created_at": msg['created_at'],
+                        "is_me": msg['sender_id'] == user_id
+                    })
+                    yield f"id: {last_id}\nevent: message\ndata: {payload}\n\n"
+
+                if not is_match_active(match_id):
+                    yield f"event: ended\ndata: {json.dumps({'redirect': redirect_url})}\n\n"
+                    return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+
+                new_version = notification_bus.wait(match_id, version, min(CHAT_STREAM_HEARTBEAT_SECONDS, remaining))
+                if new_version == version:
+                    yield ": keepalive\n\n"
+                version = new_version
+        finally:
+            notification_bus.unsubscribe(match_id)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(_chat_stream_slots.release)
+    return response
+
+
 @app.route('/end-chat/<int:match_id>', methods=['POST'])
 @login_required
 def end_chat(match_id):
@@ -757,8 +3306,439 @@ ai_system_prompts = {
     "disgust": "You are a non-judgmental, understanding AI companion. Acknowledge the user's feelings without judgment. Help them process their emotions calmly."
 }
 
-# AI chat history storage (in-memory for simplicity, can be moved to database)
-ai_chat_history = {}
+AI_CHAT_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+
+
+class AiLatencyStats:
+    """Time-to-first-token and total latency of recent completions"""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._ttft_ms = deque(maxlen=window)
+        self._total_ms = deque(maxlen=window)
+        self._completions = 0
+        self._streamed = 0
+        self._errors = 0
+        self._degraded = 0
+
+    def record(self, ttft_ms, total_ms, streamed):
+        with self._lock:
+            self._completions += 1
+            self._streamed += int(streamed)
+            if ttft_ms is not None:
+                self._ttft_ms.append(ttft_ms)
+            self._total_ms.append(total_ms)
+
+    def error(self):
+        with self._lock:
+            self._errors += 1
+
+    def degraded(self):
+        with self._lock:
+            self._degraded += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "completions": self._completions,
+                "streamed": self._streamed,
+                "errors": self._errors,
+                "degraded": self._degraded,
+                "ttft_ms": _percentiles(sorted(self._ttft_ms)),
+                "total_ms": _percentiles(sorted(self._total_ms)),
+            }
+
+
+ai_latency = AiLatencyStats()
+
+
+# =======================
+# 🛡️ OPENAI GATEWAY
+# =======================
+# Every completion goes through one gateway per worker so a slow or failing
+# upstream can't tie up the thread pool:
+#   - the client has connect/read timeouts and no retries of its own
+#   - at most OPENAI_MAX_CONCURRENCY calls run at once; a caller that can't
+#     get a slot within OPENAI_QUEUE_TIMEOUT_SECONDS is turned away
+#   - connection errors, timeouts, 429s and 5xx are retried up to
+#     OPENAI_MAX_RETRIES times with full-jitter backoff (a completion has no
+#     side effects, so retrying it is safe)
+#   - OPENAI_BREAKER_FAILURES such failures in a row open the breaker: calls
+#     fail fast for OPENAI_BREAKER_RESET_SECONDS, then a single probe decides
+#     whether it closes again
+# Callers turn AiUnavailable into the canned emotion_responses replies.
+
+class AiUnavailable(Exception):
+    """The upstream can't take this call now (breaker open, saturated or failing)"""
+
+
+def _is_upstream_failure(error):
+    """Errors that say the upstream is unhealthy (and are safe to retry)"""
+    import openai
+    return isinstance(error, (openai.APIConnectionError, openai.RateLimitError,
+                              openai.InternalServerError, ConnectionError, TimeoutError))
+
+
+class OpenAIGateway:
+    """Concurrency cap, jittered retries and a circuit breaker around chat completions"""
+
+    def __init__(self, max_concurrency, queue_timeout, max_retries, retry_base,
+                 failure_threshold, reset_seconds):
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.queue_timeout = queue_timeout
+        self.max_retries = max(int(max_retries), 0)
+        self.retry_base = retry_base
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.reset_seconds = reset_seconds
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._state = "closed"          # closed -> open -> half_open -> closed/open
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._in_flight = 0
+        self._stats = {"calls": 0, "retries": 0, "failures": 0,
+                       "rejected_open": 0, "rejected_busy": 0, "breaker_opened": 0}
+        self._latency_ms = deque(maxlen=500)
+
+    def complete(self, client, messages):
+        """Reply text for messages, or AiUnavailable"""
+        with self._call():
+            completion = self._create(client, messages, stream=False)
+        return completion.choices[0].message.content
+
+    def stream(self, client, messages):
+        """Yield reply deltas; AiUnavailable before the first one means nothing was sent"""
+        with self._call():
+            for chunk in self._create(client, messages, stream=True):
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+
+    def _create(self, client, messages, stream):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return client.chat.completions.create(model=AI_CHAT_MODEL, messages=messages, stream=stream)
+            except Exception as e:
+                if attempt == self.max_retries or not _is_upstream_failure(e):
+                    raise
+                with self._lock:
+                    self._stats["retries"] += 1
+                # Full jitter so threads retrying together don't stampede
+                time.sleep(random.uniform(0, self.retry_base * 2 ** attempt))
+
+    @contextmanager
+    def _call(self):
+        probe = self._admit()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._stats["rejected_busy"] += 1
+                if probe:
+                    self._probe_in_flight = False
+            raise AiUnavailable("too many concurrent AI calls")
+
+        with self._lock:
+            self._in_flight += 1
+        started = time.monotonic()
+        healthy = None      # stays None if the caller abandons a stream
+        try:
+            yield
+            healthy = True
+        except Exception as e:
+            healthy = not _is_upstream_failure(e)
+            if not healthy:
+                raise AiUnavailable(str(e)) from e
+            raise
+        finally:
+            self._slots.release()
+            self._finish(healthy, probe, started)
+
+    def _admit(self):
+        """Raise if the breaker is open; True if this call is the half-open probe"""
+        with self._lock:
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    self._stats["rejected_open"] += 1
+                    raise AiUnavailable("circuit open")
+                self._state = "half_open"
+            if self._state == "half_open":
+                if self._probe_in_flight:
+                    self._stats["rejected_open"] += 1
+                    raise AiUnavailable("circuit half-open")
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def _finish(self, healthy, probe, started):
+        with self._lock:
+            self._in_flight -= 1
+            if probe:
+                self._probe_in_flight = False
+            if healthy is None:
+                if probe:
+                    self._state = "half_open"
+                return
+            self._stats["calls"] += 1
+            self._latency_ms.append((time.monotonic() - started) * 1000)
+            if healthy:
+                self._consecutive_failures = 0
+                self._state = "closed"
+                return
+            self._stats["failures"] += 1
+            self._consecutive_failures += 1
+            if probe or self._consecutive_failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._stats["breaker_opened"] += 1
+                    print(f"🔌 OpenAI breaker open for {self.reset_seconds:.0f}s "
+                          f"after {self._consecutive_failures} failures")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(
+                state=self._state,
+                consecutive_failures=self._consecutive_failures,
+                in_flight=self._in_flight,
+                max_concurrency=self.max_concurrency,
+                latency_ms=_percentiles(sorted(self._latency_ms)),
+            )
+        return stats
+
+
+openai_gateway = OpenAIGateway(
+    max_concurrency=int(os.environ.get("OPENAI_MAX_CONCURRENCY", 4)),
+    queue_timeout=float(os.environ.get("OPENAI_QUEUE_TIMEOUT_SECONDS", 2)),
+    max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", 2)),
+    retry_base=float(os.environ.get("OPENAI_RETRY_BASE_SECONDS", 0.25)),
+    failure_threshold=int(os.environ.get("OPENAI_BREAKER_FAILURES", 5)),
+    reset_seconds=float(os.environ.get("OPENAI_BREAKER_RESET_SECONDS", 30)),
+)
+
+
+# =======================
+# 💬 AI CONVERSATION STORE
+# =======================
+# AI chat turns live in the ai_messages table instead of the session
+# cookie, capped at the newest AI_HISTORY_MAX_MESSAGES per user. Each worker
+# keeps those messages for recently active users in an LRU; writes go through the write-behind
+# queue and tell other workers to drop their copy on the "ai" bus topic.
+# Only the newest turns that fit AI_CONTEXT_TOKEN_BUDGET are sent to the
+# model with each new message.
+
+AI_HISTORY_MAX_MESSAGES = int(os.environ.get("AI_HISTORY_MAX_MESSAGES", 50))
+AI_CONTEXT_TOKEN_BUDGET = int(os.environ.get("AI_CONTEXT_TOKEN_BUDGET", 1500))
+
+
+def _insert_ai_turn(conn, user_id, user_message, reply, keep):
+    conn.executemany(
+        "INSERT INTO ai_messages (user_id, role, content) VALUES (?, ?, ?)",
+        ((user_id, "user", user_message), (user_id, "assistant", reply))
+    )
+    # Same transaction: drop everything older than the newest `keep`
+    # messages (both lookups walk the (user_id, id) index)
+    conn.execute('''
+        DELETE FROM ai_messages
+        WHERE user_id = ? AND id <= (
+            SELECT id FROM ai_messages WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+        )
+    ''', (user_id, user_id, keep))
+
+
+def _delete_ai_messages(conn, user_id):
+    conn.execute("DELETE FROM ai_messages WHERE user_id = ?", (user_id,))
+
+
+class AiConversationStore:
+    """Bounded in-process LRU in front of the ai_messages table"""
+
+    def __init__(self, max_users, max_messages):
+        self.max_users = max_users
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> [{"role", "content"}, ...]
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, user_id):
+        """The user's most recent messages, oldest first"""
+        notification_bus.ensure_listener()
+        write_behind.barrier()
+        with self._lock:
+            messages = self._entries.get(user_id)
+            if messages is not None:
+                self._entries.move_to_end(user_id)
+                self._hits += 1
+                return list(messages)
+            self._misses += 1
+            generation = self._generation
+
+        rows = get_db().execute('''
+            SELECT role, content FROM (
+                SELECT id, role, content FROM ai_messages
+                WHERE user_id = ? ORDER BY id DESC LIMIT ?
+            ) ORDER BY id
+        ''', (user_id, self.max_messages)).fetchall()
+        messages = [{"role": row['role'], "content": row['content']} for row in rows]
+
+        with self._lock:
+            # Skip filling if a write raced with our read
+            if generation == self._generation:
+                self._put(user_id, messages)
+        return list(messages)
+
+    def append_turn(self, user_id, user_message, reply):
+        turn = [{"role": "user", "content": user_message}, {"role": "assistant", "content": reply}]
+        write_behind.submit(
+            _insert_ai_turn, (user_id, user_message, reply, self.max_messages),
+            lambda: self._written(user_id, lambda messages: (messages + turn)[-self.max_messages:])
+        )
+
+    def clear(self, user_id):
+        write_behind.submit(
+            _delete_ai_messages, (user_id,),
+            lambda: self._written(user_id, lambda messages: [])
+        )
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def _written(self, user_id, update):
+        """Apply a committed write to this worker's copy and drop everyone else's"""
+        with self._lock:
+            self._generation += 1
+            if user_id in self._entries:
+                self._put(user_id, update(self._entries[user_id]))
+        notification_bus.publish(user_id, topic="ai")
+
+    def _put(self, user_id, messages):
+        self._entries[user_id] = messages
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0,
+            }
+
+
+ai_conversations = AiConversationStore(
+    max_users=int(os.environ.get("AI_HISTORY_CACHE_SIZE", 1000)),
+    max_messages=AI_HISTORY_MAX_MESSAGES,
+)
+notification_bus.register("ai", ai_conversations.invalidate)
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token plus per-message overhead)"""
+    return len(text) // 4 + 4
+
+
+def build_ai_context(system_prompt, history, user_message, budget=None):
+    """System prompt, the newest turns that fit the token budget, then the new message"""
+    budget = budget or AI_CONTEXT_TOKEN_BUDGET
+    used = estimate_tokens(system_prompt) + estimate_tokens(user_message)
+    kept = []
+    for message in reversed(history):
+        used += estimate_tokens(message["content"])
+        if used > budget:
+            break
+        kept.append(message)
+    kept.reverse()
+
+    # Drop from the oldest end a whole turn at a time
+    if kept and kept[0]["role"] == "assistant":
+        kept = kept[1:]
+    return ([{"role": "system", "content": system_prompt}] + kept
+            + [{"role": "user", "content": user_message}])
+
+
+# =======================
+# ♻️ AI REPLY CACHE
+# =======================
+# Many conversations open with the same few words ("hi", "I feel sad")
+# under the same emotion prompt. With AI_REPLY_CACHE_SIZE > 0, replies to
+# short first-turn messages are cached per (emotion, normalized message)
+# for AI_REPLY_CACHE_TTL_SECONDS. Later turns always go to the model, since
+# their context differs.
+
+def normalize_opener(text):
+    """Lowercase, drop punctuation and collapse whitespace ("I'm sad!!" -> "im sad")"""
+    return " ".join("".join(ch for ch in text.lower() if ch.isalnum() or ch.isspace()).split())
+
+
+class AiReplyCache:
+    """LRU+TTL of first-turn replies, tracking the upstream latency each hit saved"""
+
+    def __init__(self, max_entries, ttl, max_chars=80):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (emotion, opener) -> (reply, latency_ms, stored_at)
+        self._hits = 0
+        self._misses = 0
+        self._saved_ms = 0.0
+
+    def _key(self, emotion, message):
+        opener = normalize_opener(message)
+        if self.max_entries <= 0 or not opener or len(opener) > self.max_chars:
+            return None
+        return emotion, opener
+
+    def get(self, emotion, message):
+        key = self._key(emotion, message)
+        if key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] <= self.ttl:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                self._saved_ms += entry[1]
+                return entry[0]
+            self._misses += 1
+            return None
+
+    def put(self, emotion, message, reply, latency_ms):
+        key = self._key(emotion, message)
+        if key is None:
+            return
+        with self._lock:
+            self._entries[key] = (reply, latency_ms, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.max_entries > 0,
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0,
+                "latency_saved_ms": round(self._saved_ms, 1),
+                "avg_saved_ms": round(self._saved_ms / self._hits, 1) if self._hits else 0,
+            }
+
+
+ai_reply_cache = AiReplyCache(
+    max_entries=int(os.environ.get("AI_REPLY_CACHE_SIZE", 0)),
+    ttl=float(os.environ.get("AI_REPLY_CACHE_TTL_SECONDS", 600)),
+)
 
 
 @app.route('/ai-chat-page')
@@ -767,20 +3747,10 @@ def ai_chat_page():
     """Render the AI chat page"""
     try:
         # Get user's latest emotion
-        conn = get_db()
-        latest_emotion = conn.execute('''
-            SELECT emotion FROM emotions 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (session['user_id'],)).fetchone()
-        conn.close()
+        emotion = latest_emotions.get(session['user_id']) or 'neutral'
         
-        emotion = latest_emotion['emotion'] if latest_emotion else 'neutral'
-        
-        # Initialize chat history for user if not exists
-        if 'ai_chat' not in session:
-            session['ai_chat'] = []
+        # History used to live in the cookie - shrink old sessions
+        session.pop('ai_chat', None)
         
         # Get system prompt based on emotion
         system_prompt = ai_system_prompts.get(emotion, ai_system_prompts['neutral'])
@@ -788,7 +3758,7 @@ def ai_chat_page():
         return render_template('ai-chat.html', 
                               emotion=emotion, 
                               system_prompt=system_prompt,
-                              chat_history=session.get('ai_chat', []))
+                              chat_history=ai_conversations.get(session['user_id']))
     except Exception as e:
         print(f"❌ ai_chat_page error: {str(e)}")
         return "Internal Server Error", 500
@@ -812,72 +3782,135 @@ def ai_chat():
             return jsonify({"error": "Empty message"}), 400
         
         # Get user's latest emotion
-        conn = get_db()
-        latest_emotion = conn.execute('''
-            SELECT emotion FROM emotions 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (session['user_id'],)).fetchone()
-        conn.close()
-        
-        emotion = latest_emotion['emotion'] if latest_emotion else 'neutral'
+        emotion = latest_emotions.get(session['user_id']) or 'neutral'
         system_prompt = ai_system_prompts.get(emotion, ai_system_prompts['neutral'])
         
-        # Get API key from environment
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            return jsonify({"error": "OpenAI API key not configured"}), 500
-        
-        # Build messages array
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ]
-        
-        # Call OpenAI API with new syntax
-        completion = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages
-        )
-        
-        ai_response = completion.choices[0].message.content
+        # Build messages array: recent history trimmed to the token budget
+        history = ai_conversations.get(session['user_id'])
+        messages = build_ai_context(system_prompt, history, user_message)
         
-        # Save to chat history in session
-        if 'ai_chat' not in session:
-            session['ai_chat'] = []
+        # A common opener may already have a cached reply
+        first_turn = not history
+        ai_response = ai_reply_cache.get(emotion, user_message) if first_turn else None
+        degraded = False
         
-        session['ai_chat'].append({"role": "user", "content": user_message})
-        session['ai_chat'].append({"role": "assistant", "content": ai_response})
+        if ai_response is None:
+            # Call OpenAI through the gateway (timeouts, retries, breaker)
+            started = time.monotonic()
+            try:
+                ai_response = openai_gateway.complete(client, messages)
+                total_ms = (time.monotonic() - started) * 1000
+                ai_latency.record(total_ms, total_ms, streamed=False)
+                if first_turn:
+                    ai_reply_cache.put(emotion, user_message, ai_response, total_ms)
+            except AiUnavailable as e:
+                # Upstream is slow or down - answer locally rather than wait
+                print(f"⚠️ AI degraded ({e}), using a canned reply")
+                ai_latency.degraded()
+                ai_response = canned_reply(emotion)
+                degraded = True
         
-        # Keep only last 20 messages to prevent session bloat
-        if len(session['ai_chat']) > 20:
-            session['ai_chat'] = session['ai_chat'][-20:]
+        # Save the turn server-side
+        ai_conversations.append_turn(session['user_id'], user_message, ai_response)
         
         return jsonify({
             "success": True,
             "response": ai_response,
-            "emotion": emotion
+            "emotion": emotion,
+            "degraded": degraded
         })
         
     except Exception as e:
         print("❌ OpenAI Error:", str(e))
+        ai_latency.error()
         return jsonify({"error": "AI service error. Please try again."}), 500
 
 
+@app.route('/ai-chat-stream', methods=['POST'])
+@login_required
+def ai_chat_stream():
+    """Like /ai-chat, but forwards the reply token by token as Server-Sent Events
+
+    Events: "token" ({"delta"}), then "done" ({"emotion", "ttft_ms",
+    "total_ms", "degraded"}) or "error". A 503 before the stream starts
+    means the page should fall back to /chatbot-response.
+    """
+    client = get_openai_client()
+    if client is None:
+        return jsonify({"error": "OpenAI API key not configured", "fallback": True}), 503
+
+    data = request.get_json(silent=True) or {}
+    user_message = data.get('message', '').strip()
+    if not user_message:
+        return jsonify({"error": "Empty message"}), 400
+
+    user_id = session['user_id']
+    emotion = latest_emotions.get(user_id) or 'neutral'
+    system_prompt = ai_system_prompts.get(emotion, ai_system_prompts['neutral'])
+    history = ai_conversations.get(user_id)
+    messages = build_ai_context(system_prompt, history, user_message)
+    first_turn = not history
+
+    def generate():
+        started = time.monotonic()
+        ttft_ms = None
+        degraded = False
+        reply = []
+        cached = ai_reply_cache.get(emotion, user_message) if first_turn else None
+        try:
+            deltas = [cached] if cached is not None else openai_gateway.stream(client, messages)
+            for delta in deltas:
+                if ttft_ms is None:
+                    ttft_ms = (time.monotonic() - started) * 1000
+                reply.append(delta)
+                yield f"event: token\ndata: {json.dumps({'delta': delta})}\n\n"
+        except Exception as e:
+            if ttft_ms is not None or not isinstance(e, AiUnavailable):
+                # Part of a reply is already on screen - nothing to degrade to
+                print("❌ OpenAI stream error:", str(e))
+                ai_latency.error()
+                yield f"event: error\ndata: {json.dumps({'error': 'AI service error. Please try again.'})}\n\n"
+                return
+            print(f"⚠️ AI degraded ({e}), using a canned reply")
+            ai_latency.degraded()
+            degraded = True
+            reply.append(canned_reply(emotion))
+            yield f"event: token\ndata: {json.dumps({'delta': reply[0]})}\n\n"
+
+        ai_conversations.append_turn(user_id, user_message, "".join(reply))
+        total_ms = (time.monotonic() - started) * 1000
+        if not degraded and cached is None:
+            ai_latency.record(ttft_ms, total_ms, streamed=True)
+            if first_turn:
+                ai_reply_cache.put(emotion, user_message, "".join(reply), total_ms)
+        done = {
+            "emotion": emotion,
+            "ttft_ms": round(ttft_ms or total_ms, 1),
+            "total_ms": round(total_ms, 1),
+            "degraded": degraded
+        }
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.route('/ai-get-messages')
 @login_required
 def ai_get_messages():
     """Get AI chat history"""
-    chat_history = session.get('ai_chat', [])
-    return jsonify({"messages": chat_history})
+    return jsonify({"messages": ai_conversations.get(session['user_id'])})
 
 
 @app.route('/ai-clear', methods=['POST'])
 @login_required
 def ai_clear():
     """Clear AI chat history"""
-    session['ai_chat'] = []
+    ai_conversations.clear(session['user_id'])
+    session.pop('ai_chat', None)
     return jsonify({"success": True})
 
 
@@ -964,6 +3997,11 @@ default_responses = [
 ]
 
 
+def canned_reply(emotion):
+    """A predefined reply for emotion (also the fallback when OpenAI is down)"""
+    return random.choice(emotion_responses.get(emotion, default_responses))
+
+
 @app.route('/chatbot-response', methods=['POST'])
 @login_required
 def chatbot_response():
@@ -975,23 +4013,11 @@ def chatbot_response():
         if not user_message:
             return jsonify({"error": "Empty message"}), 400
         
-        # Get user's latest emotion from database
-        conn = get_db()
-        latest_emotion = conn.execute('''
-            SELECT emotion FROM emotions 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        ''', (session['user_id'],)).fetchone()
-        conn.close()
-        
-        emotion = latest_emotion['emotion'] if latest_emotion else 'neutral'
-        
-        # Get responses based on emotion
-        responses = emotion_responses.get(emotion, default_responses)
+        # Get user's latest emotion
+        emotion = latest_emotions.get(session['user_id']) or 'neutral'
         
-        # Pick a random response
-        selected_response = random.choice(responses)
+        # Pick a random response based on emotion
+        selected_response = canned_reply(emotion)
         
         return jsonify({
             "reply": selected_response,
@@ -1002,6 +4028,110 @@ def chatbot_response():
         return jsonify({"error": "Something went wrong"}), 500
 
 
+# =======================
+# 🚀 APP STARTUP
+# =======================
+# Importing app.py has no side effects: migrations and expiring stale
+# matchmaking waiters happen in startup(), which create_app() runs (the Procfile
+# uses gunicorn 'app:create_app()') and the first request runs otherwise.
+# The ML stack is only imported when the model is first needed or
+# preloaded.
+
+_startup_lock = threading.Lock()
+_started_for = None     # DATABASE_PATH the current process was started for
+
+
+def startup():
+    """Migrate the database and expire stale matchmaking waiters (once per database)"""
+    global _started_for
+    if _started_for == DATABASE_PATH:
+        return
+    with _startup_lock:
+        if _started_for != DATABASE_PATH:
+            init_db()
+            matchmaker.expire_stale()
+            _started_for = DATABASE_PATH
+
+
+def create_app():
+    """App factory for gunicorn: run startup() and return the app"""
+    startup()
+    return app
+
+
+@app.before_request
+def ensure_started():
+    startup()
+
+
+# =======================
+# 📊 METRICS
+# =======================
+
+def _process_memory():
+    """RSS of this process plus how much of it is shared with other workers (Linux only)"""
+    memory = {}
+    for path, keys in (("/proc/self/status", ("VmRSS",)),
+                       ("/proc/self/smaps_rollup", ("Pss", "Shared_Clean", "Shared_Dirty"))):
+        try:
+            with open(path) as f:
+                for line in f:
+                    name, _, value = line.partition(":")
+                    if name in keys:
+                        memory[name.lower() + "_kb"] = int(value.split()[0])
+        except OSError:
+            pass
+    return memory
+
+
+# /metrics exposes pids, memory, queue depths and limits, so it is only
+# served to callers sending this value in an X-Metrics-Token header (and
+# not at all when it is unset)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+
+@app.route('/metrics')
+def metrics():
+    """Runtime metrics for tuning throughput against latency"""
+    supplied = request.headers.get("X-Metrics-Token", "")
+    if not METRICS_TOKEN or not hmac.compare_digest(supplied.encode(), METRICS_TOKEN.encode()):
+        return jsonify({"error": "Not found"}), 404
+
+    with _db_stats_lock:
+        db_stats = dict(_db_stats)
+    return jsonify({
+        "pid": os.getpid(),
+        "memory": _process_memory(),
+        "model": dict(_model_stats, loaded=_model is not None),
+        "model_lifecycle": model_lifecycle.stats(),
+        "inference_batcher": batcher.stats(),
+        "matchmaking": matchmaker.stats(),
+        "db": db_stats,
+        "latest_emotion_cache": latest_emotions.stats(),
+        "frame_cache": frame_cache.stats(),
+        "emotion_smoothing": emotion_smoother.stats(),
+        "write_behind": write_behind.stats(),
+        "ai_chat": ai_latency.stats(),
+        "openai": openai_gateway.stats(),
+        "ai_conversations": ai_conversations.stats(),
+        "ai_reply_cache": ai_reply_cache.stats(),
+        "inference_server": inference_client.stats(),
+        "detect_admission": detect_admission.stats()
+    })
+
+
+# =======================
+# 🛠️ CLI COMMANDS (flask --app app <command>)
+# =======================
+# Benchmarks, the OpenAI stub and the inference server live in tools/ and
+# import this module, so they're registered only once it's fully defined
+# (and not when it runs as a script, which would import it twice).
+
+if __name__ != '__main__':
+    from tools import register_commands
+    register_commands(app)
+
+
 # =======================
 
 # Production: Gunicorn handles the server (defined in Procfile/render.yaml)
@@ -1011,4 +4141,4 @@ if __name__ == '__main__':
     # Local development only - Use PORT 10000 for Render compatibility
     import os
     port = int(os.environ.get("PORT", 10000))
-    app.run(host="0.0.0.0", port=port)
+    create_app().run(host="0.0.0.0", port=port)
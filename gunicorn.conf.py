@@ -0,0 +1,35 @@
+# Gunicorn settings for Render (see Procfile / render.yaml)
+import os
+
+# Set before torch is imported: one OpenMP thread per process, so nothing
+# the master starts has to survive the fork into the workers
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = 8
+timeout = 120
+
+# EMOTION_MODEL_PRELOAD=1 imports app.py and loads the model in the master
+# before forking, so the workers share its weights copy-on-write
+preload_app = os.environ.get("EMOTION_MODEL_PRELOAD", "0") == "1"
+
+
+def when_ready(server):
+    # Runs in the master after the app is imported, before any worker forks
+    if preload_app:
+        import app
+        app.preload_model()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import torch
+        torch.set_num_threads(1)
+
+
+def worker_exit(server, worker):
+    # Commit anything still in the write-behind queue (DB_DURABILITY=async)
+    import app
+    app.write_behind.close()
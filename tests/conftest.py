@@ -0,0 +1,104 @@
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+# Configure the app before it is imported: scratch database and socket
+# directories, the default DB_DURABILITY (group), and none of the ML stack.
+_scratch = tempfile.mkdtemp(prefix="echobridge-tests-")
+os.environ.setdefault("DATABASE_PATH", os.path.join(_scratch, "import.db"))
+os.environ.setdefault("ECHOBRIDGE_RUNTIME_DIR", os.path.join(_scratch, "run"))
+os.environ.setdefault("CHAT_BUS_DIR", os.path.join(_scratch, "bus"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """The Flask app migrated against a fresh database"""
+    monkeypatch.setattr(app_module, "DATABASE_PATH", str(tmp_path / "test.db"))
+    # User ids start over with every database, so nothing cached per user
+    # may outlive a test
+    for store in (app_module.latest_emotions, app_module.frame_cache,
+                  app_module.ai_conversations, app_module.ai_reply_cache):
+        store._entries.clear()
+    # The token buckets are a file shared by workers; give each test its own
+    gate = app_module.detect_admission
+    monkeypatch.setattr(app_module, "detect_admission", app_module.DetectAdmission(
+        rate=gate.rate, burst=gate.burst, max_in_flight=gate.max_in_flight,
+        max_queued=gate.max_queued, queue_timeout=gate.queue_timeout,
+        slot_dir=str(tmp_path / "admission")))
+    app_module.create_app()
+    app_module.app.config["TESTING"] = True
+    yield app_module
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def signup_and_login(client, name):
+    client.post("/signup", data={"email": f"{name}@example.com", "username": name, "password": "secret"})
+    client.post("/login", data={"email": f"{name}@example.com", "password": "secret"})
+    with client.session_transaction() as session:
+        return session["user_id"]
+
+
+def start_match(app, user1_id, user2_id, emotion="sad"):
+    """An active match between two users, as matchmaking would create it"""
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    with conn:
+        match_id = conn.execute(
+            "INSERT INTO matches (user1_id, user2_id, emotion, active) VALUES (?, ?, ?, 1)",
+            (user1_id, user2_id, emotion)
+        ).lastrowid
+    conn.close()
+    return match_id
+
+
+def jpeg_frame(seed=0):
+    """A small JPEG webcam frame; skips the test without Pillow/NumPy (frame hashing needs both)"""
+    pytest.importorskip("numpy")
+    Image = pytest.importorskip("PIL.Image")
+    from PIL import ImageDraw
+
+    image = Image.new("RGB", (320, 240), (40, 40, 40))
+    ImageDraw.Draw(image).ellipse((80 + seed * 40, 40, 240, 200), fill=(220, 180, 150))
+    out = io.BytesIO()
+    image.save(out, "JPEG")
+    return out.getvalue()
+
+
+LABELS = ["angry", "disgust", "fear", "happy", "neutral", "sad", "surprise"]
+
+
+@pytest.fixture(scope="session")
+def tiny_model_dir(tmp_path_factory):
+    """A randomly initialised, tiny ViT saved like a local model snapshot"""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    torch.manual_seed(0)
+    config = transformers.ViTConfig(
+        image_size=32, patch_size=8, hidden_size=32, num_hidden_layers=1, num_attention_heads=2,
+        intermediate_size=64, num_labels=len(LABELS),
+        id2label=dict(enumerate(LABELS)), label2id={label: i for i, label in enumerate(LABELS)},
+    )
+    path = tmp_path_factory.mktemp("tiny-vit")
+    transformers.ViTForImageClassification(config).eval().save_pretrained(path)
+    transformers.ViTImageProcessor(size={"height": 32, "width": 32}).save_pretrained(path)
+    return str(path)
+
+
+@pytest.fixture
+def tiny_model(app, tiny_model_dir, monkeypatch):
+    """Point the app's model settings at tiny_model_dir"""
+    monkeypatch.setattr(app, "EMOTION_MODEL_DIR", tiny_model_dir)
+    monkeypatch.setattr(app, "EMOTION_MODEL_SOURCE", tiny_model_dir)
+    return tiny_model_dir
@@ -0,0 +1,133 @@
+import threading
+import time
+
+import pytest
+
+from conftest import jpeg_frame, signup_and_login
+
+
+def admission(app, slot_dir, **options):
+    settings = dict(rate=0, burst=5, max_in_flight=2, max_queued=0, queue_timeout=0.05)
+    settings.update(options)
+    return app.DetectAdmission(slot_dir=str(slot_dir), **settings)
+
+
+def test_in_flight_bound_is_shared_by_workers(app, tmp_path):
+    # Two instances over one slot directory stand in for two gunicorn workers
+    worker_a = admission(app, tmp_path)
+    worker_b = admission(app, tmp_path)
+
+    with worker_a.admit(1), worker_b.admit(2):
+        with pytest.raises(app.AdmissionRejected) as rejected:
+            with worker_a.admit(3):
+                pass
+    assert rejected.value.status == 503
+    assert worker_a.stats()["shed_queue_full"] == 1
+
+    # Both slots are free again
+    with worker_a.admit(4), worker_b.admit(5):
+        pass
+
+
+def test_queued_request_gets_a_slot_freed_by_another_worker(app, tmp_path):
+    worker_a = admission(app, tmp_path, max_in_flight=1, max_queued=1, queue_timeout=2)
+    worker_b = admission(app, tmp_path, max_in_flight=1, max_queued=1, queue_timeout=2)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with worker_a.admit(1):
+            holding.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert holding.wait(5)
+    threading.Timer(0.05, release.set).start()
+
+    with worker_b.admit(2):
+        pass
+    holder.join()
+    assert worker_b.stats()["queue_wait_ms"]["max"] >= 40
+
+
+def test_queue_timeout_sheds_and_refunds_the_token(app, tmp_path):
+    gate = admission(app, tmp_path, rate=0.001, burst=2, max_in_flight=1, max_queued=1)
+
+    with gate.admit(1):
+        started = time.monotonic()
+        with pytest.raises(app.AdmissionRejected) as rejected:
+            with gate.admit(2):
+                pass
+        assert time.monotonic() - started >= 0.05
+    assert rejected.value.status == 503
+    stats = gate.stats()
+    assert stats["shed_queue_timeout"] == 1
+    assert stats["refunded"] == 1
+
+    # User 2 still has the whole burst
+    with gate.admit(2):
+        pass
+    with gate.admit(2):
+        pass
+    with pytest.raises(app.AdmissionRejected) as limited:
+        with gate.admit(2):
+            pass
+    assert limited.value.status == 429
+
+
+def test_model_loading_fallback_does_not_spend_the_burst(app, client, tmp_path, monkeypatch):
+    signup_and_login(client, "warming")
+    monkeypatch.setattr(app, "detect_admission", admission(app, tmp_path, rate=0.001, burst=2))
+    monkeypatch.setattr(app.inference_client, "available", lambda: False)
+    monkeypatch.setattr(app.model_lifecycle, "ready", lambda: False)
+
+    statuses = [client.post("/detect", data=jpeg_frame(0), content_type="image/jpeg").status_code
+                for _ in range(5)]
+
+    assert statuses == [503] * 5
+    assert app.detect_admission.stats()["refunded"] == 5
+    assert app.detect_admission.stats()["rate_limited"] == 0
+
+
+def test_rate_limit_is_shared_by_workers(app, tmp_path):
+    worker_a = admission(app, tmp_path, rate=0.001, burst=2)
+    worker_b = admission(app, tmp_path, rate=0.001, burst=2)
+
+    worker_a.take_token(1)
+    worker_b.take_token(1)
+    with pytest.raises(app.AdmissionRejected) as limited:
+        worker_a.take_token(1)
+    assert limited.value.status == 429
+    worker_b.take_token(2)                # other users keep their own bucket
+
+    # A refund in one worker is seen by the other
+    worker_b.refund(1)
+    worker_a.take_token(1)
+
+
+def test_slot_is_taken_after_the_upload_is_read(app, client, tmp_path, monkeypatch):
+    signup_and_login(client, "uploader")
+    gate = admission(app, tmp_path, rate=1, burst=5, max_in_flight=1)
+    monkeypatch.setattr(app, "detect_admission", gate)
+    monkeypatch.setattr(app.inference_client, "available", lambda: True)
+    monkeypatch.setattr(app, "classify_frame", lambda image_bytes, image=None: ("happy", 0.9, {"happy": 0.9, "sad": 0.1}))
+    in_flight_while_reading = []
+    read_frame_upload = app.read_frame_upload
+
+    def reading():
+        in_flight_while_reading.append(gate.stats()["in_flight"])
+        return read_frame_upload()
+
+    monkeypatch.setattr(app, "read_frame_upload", reading)
+
+    # Every slot is held by another worker: the upload is still read, then shed
+    with admission(app, tmp_path, max_in_flight=1).slot():
+        response = client.post("/detect", data=jpeg_frame(0), content_type="image/jpeg")
+    assert response.status_code == 503
+    assert in_flight_while_reading == [0]
+    assert gate.stats()["refunded"] == 1
+
+    response = client.post("/detect", data=jpeg_frame(0), content_type="image/jpeg")
+    assert response.status_code == 200
+    assert in_flight_while_reading == [0, 0]
@@ -0,0 +1,30 @@
+import sqlite3
+
+
+def stored_messages(app, user_id):
+    app.write_behind.barrier()   # DB_DURABILITY=async commits in the background
+    with sqlite3.connect(app.DATABASE_PATH) as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT content FROM ai_messages WHERE user_id = ? ORDER BY id", (user_id,))]
+
+
+def test_stored_history_stays_bounded(app):
+    store = app.AiConversationStore(max_users=10, max_messages=6)
+    for turn in range(10):
+        store.append_turn(1, f"question {turn}", f"answer {turn}")
+
+    assert stored_messages(app, 1) == [
+        "question 7", "answer 7", "question 8", "answer 8", "question 9", "answer 9",
+    ]
+    store.invalidate(1)
+    assert [m["content"] for m in store.get(1)] == stored_messages(app, 1)
+
+
+def test_bound_is_per_user(app):
+    store = app.AiConversationStore(max_users=10, max_messages=4)
+    store.append_turn(2, "hello", "hi there")
+    for turn in range(5):
+        store.append_turn(1, f"question {turn}", f"answer {turn}")
+
+    assert len(stored_messages(app, 1)) == 4
+    assert stored_messages(app, 2) == ["hello", "hi there"]
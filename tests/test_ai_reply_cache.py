@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+from conftest import signup_and_login
+
+
+def test_openers_are_normalized(app):
+    assert app.normalize_opener("  I'm   SAD!! ") == "im sad"
+    assert app.normalize_opener("?!") == ""
+
+
+def test_replies_are_keyed_by_emotion_and_normalized_message(app):
+    cache = app.AiReplyCache(max_entries=10, ttl=60)
+    cache.put("sad", "Hi!", "Hello, I'm here.", 800.0)
+
+    assert cache.get("sad", "hi") == "Hello, I'm here."
+    assert cache.get("happy", "hi") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["latency_saved_ms"] == 800.0
+
+
+def test_entries_expire_and_the_cache_stays_bounded(app):
+    cache = app.AiReplyCache(max_entries=2, ttl=60)
+    for opener in ("hi", "hello", "hey"):
+        cache.put("neutral", opener, opener.upper(), 100.0)
+    assert cache.stats()["size"] == 2
+    assert cache.get("neutral", "hi") is None     # least recently used went first
+
+    cache.ttl = -1
+    assert cache.get("neutral", "hey") is None
+
+
+def test_long_messages_and_disabled_cache_are_not_stored(app):
+    cache = app.AiReplyCache(max_entries=10, ttl=60, max_chars=10)
+    cache.put("sad", "this opener is far too long", "reply", 100.0)
+    assert cache.stats()["size"] == 0
+
+    disabled = app.AiReplyCache(max_entries=0, ttl=60)
+    disabled.put("sad", "hi", "reply", 100.0)
+    assert disabled.get("sad", "hi") is None
+
+
+def test_only_first_turns_are_answered_from_the_cache(app, client, monkeypatch):
+    calls = []
+
+    def create(model, messages, stream):
+        calls.append(messages)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"reply {len(calls)}"))])
+
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(app, "get_openai_client", lambda: fake)
+    monkeypatch.setattr(app, "ai_reply_cache", app.AiReplyCache(max_entries=10, ttl=60))
+
+    signup_and_login(client, "first")
+    assert client.post("/ai-chat", json={"message": "Hi!"}).get_json()["response"] == "reply 1"
+    assert client.post("/ai-chat", json={"message": "hi"}).get_json()["response"] == "reply 2"
+
+    client.get("/logout")
+    signup_and_login(client, "second")
+    assert client.post("/ai-chat", json={"message": "hi"}).get_json()["response"] == "reply 1"
+    assert len(calls) == 2
@@ -0,0 +1,160 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import signup_and_login
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    def __init__(self, deltas):
+        self.deltas = deltas
+        self.calls = []
+
+    def create(self, model, messages, stream):
+        self.calls.append(messages)
+        if isinstance(self.deltas, Exception):
+            raise self.deltas
+        return iter([chunk(delta) for delta in self.deltas])
+
+
+@pytest.fixture
+def fake_openai(app, monkeypatch):
+    def install(deltas):
+        completions = FakeCompletions(deltas)
+        fake = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        monkeypatch.setattr(app, "get_openai_client", lambda: fake)
+        monkeypatch.setattr(app, "openai_gateway", app.OpenAIGateway(
+            max_concurrency=2, queue_timeout=0.1, max_retries=0, retry_base=0,
+            failure_threshold=1, reset_seconds=60))
+        return completions
+    return install
+
+
+def events(response):
+    parsed = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        event, data = block.split("\n")
+        parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return parsed
+
+
+def test_reply_is_streamed_token_by_token_and_saved(app, client, fake_openai):
+    fake_openai(["Hello", " there", "!"])
+    signup_and_login(client, "streamer")
+
+    response = client.post("/ai-chat-stream", json={"message": "hi"})
+    assert response.mimetype == "text/event-stream"
+
+    received = events(response)
+    assert [data["delta"] for event, data in received if event == "token"] == ["Hello", " there", "!"]
+    assert received[-1][0] == "done"
+    assert received[-1][1]["degraded"] is False
+
+    history = client.get("/ai-get-messages").get_json()["messages"]
+    assert [m["content"] for m in history] == ["hi", "Hello there!"]
+
+
+def test_unavailable_upstream_streams_a_canned_reply(app, client, fake_openai, monkeypatch):
+    import openai
+    fake_openai(openai.APIConnectionError(request=None))
+    monkeypatch.setattr(app, "canned_reply", lambda emotion: "I'm here for you.")
+    signup_and_login(client, "offline")
+
+    received = events(client.post("/ai-chat-stream", json={"message": "hi"}))
+    assert received[0] == ("token", {"delta": "I'm here for you."})
+    assert received[-1][0] == "done"
+    assert received[-1][1]["degraded"] is True
+
+
+def test_empty_message_is_rejected_before_streaming(app, client, fake_openai):
+    completions = fake_openai(["unused"])
+    signup_and_login(client, "quiet")
+
+    response = client.post("/ai-chat-stream", json={"message": "  "})
+    assert response.status_code == 400
+    assert completions.calls == []
+
+
+def test_missing_api_key_asks_the_page_to_fall_back(app, client, monkeypatch):
+    monkeypatch.setattr(app, "get_openai_client", lambda: None)
+    signup_and_login(client, "nokey")
+
+    response = client.post("/ai-chat-stream", json={"message": "hi"})
+    assert response.status_code == 503
+    assert response.get_json()["fallback"] is True
+
+
+def start_stub(*options):
+    """Run `flask --app app openai-stub` on a free port; returns (process, base_url)"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "flask", "--app", "app", "openai-stub", "--port", str(port),
+         "--first-token-ms", "0", "--token-ms", "0", *options],
+        cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return stub, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.05)
+    stub.kill()
+    pytest.fail("openai-stub did not start")
+
+
+@pytest.fixture
+def stub_openai(app, monkeypatch):
+    """Point the real OpenAI client at a local openai-stub"""
+    pytest.importorskip("openai")
+    stubs = []
+
+    def start(*options):
+        stub, base_url = start_stub(*options)
+        stubs.append(stub)
+        monkeypatch.setenv("OPENAI_API_KEY", "stub")
+        monkeypatch.setenv("OPENAI_BASE_URL", base_url)
+        monkeypatch.setattr(app, "client", None)
+        monkeypatch.setattr(app, "openai_gateway", app.OpenAIGateway(
+            max_concurrency=2, queue_timeout=1, max_retries=0, retry_base=0,
+            failure_threshold=5, reset_seconds=60))
+
+    yield start
+    for stub in stubs:
+        stub.kill()
+        stub.wait()
+
+
+def test_stub_tokens_arrive_in_order(app, client, stub_openai):
+    stub_openai()
+    signup_and_login(client, "stubbed")
+
+    received = events(client.post("/ai-chat-stream", json={"message": "hello"}))
+    tokens = [data["delta"] for event, data in received if event == "token"]
+    assert tokens[:3] == ["You", " said:", " hello."]
+    assert "".join(tokens) == "You said: hello. I'm here to listen - tell me more about how that feels."
+    assert received[-1][0] == "done"
+    assert received[-1][1]["degraded"] is False
+
+
+def test_failing_stub_falls_back_to_a_canned_reply(app, client, stub_openai, monkeypatch):
+    stub_openai("--error-rate", "1")
+    monkeypatch.setattr(app, "canned_reply", lambda emotion: "I'm here for you.")
+    signup_and_login(client, "stubfail")
+
+    received = events(client.post("/ai-chat-stream", json={"message": "hello"}))
+    assert received[0] == ("token", {"delta": "I'm here for you."})
+    assert received[-1][1]["degraded"] is True
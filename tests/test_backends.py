@@ -0,0 +1,46 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+def pixels(count=4):
+    torch.manual_seed(1)
+    return torch.randn(count, 3, 32, 32)
+
+
+def test_int8_backend_quantizes_linear_layers(app, tiny_model):
+    _, reference = app.load_emotion_model("eager")
+    _, quantized = app.load_emotion_model("int8")
+
+    assert any("quantized" in type(module).__module__ for module in quantized.modules())
+    with torch.no_grad():
+        expected = reference(pixel_values=pixels()).logits
+        actual = quantized(pixel_values=pixels()).logits
+    assert actual.shape == expected.shape
+    assert (actual - expected).abs().max().item() < 0.1
+
+
+def test_onnx_backend_matches_the_float32_model(app, tiny_model, tmp_path, monkeypatch):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    from click.testing import CliRunner
+    from tools.model import export_onnx
+
+    path = str(tmp_path / "tiny.onnx")
+    result = CliRunner().invoke(export_onnx, ["--output", path])
+    assert result.exit_code == 0, result.output
+    monkeypatch.setattr(app, "EMOTION_ONNX_PATH", path)
+
+    _, reference = app.load_emotion_model("eager")
+    _, model = app.load_emotion_model("onnx")
+
+    assert model.config.id2label == reference.config.id2label
+    with torch.no_grad():
+        expected = reference(pixel_values=pixels()).logits
+    actual = model(pixel_values=pixels()).logits
+    assert torch.allclose(actual, expected, atol=1e-4)
+
+
+def test_unknown_backend_is_rejected(app, tiny_model):
+    with pytest.raises(ValueError, match="EMOTION_MODEL_BACKEND"):
+        app.load_emotion_model("fp4")
@@ -0,0 +1,79 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+
+class FakeModel:
+    """Scores each image by its first pixel value and records batch sizes"""
+
+    config = SimpleNamespace(id2label={0: "happy", 1: "sad"})
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, pixel_values):
+        self.batches.append(pixel_values.shape[0])
+        first = pixel_values[:, 0, 0, 0]
+        return SimpleNamespace(logits=torch.stack([first, -first], dim=1))
+
+
+class FakePreprocessor:
+    def batch(self, images):
+        return torch.tensor(images, dtype=torch.float32).reshape(len(images), 1, 1, 1)
+
+
+@pytest.fixture
+def model(app, monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(app, "_model", model)
+    monkeypatch.setattr(app, "_processor", object())
+    monkeypatch.setattr(app, "_frame_preprocessor", FakePreprocessor())
+    return model
+
+
+def test_concurrent_frames_share_one_forward_pass(app, model):
+    batcher = app.InferenceBatcher(window_ms=200, max_batch_size=4)
+    results = {}
+    start = threading.Barrier(4)
+
+    def detect(value):
+        start.wait()
+        results[value] = batcher.submit(value)
+
+    threads = [threading.Thread(target=detect, args=(v,)) for v in (1.0, -1.0, 2.0, -2.0)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert model.batches == [4]
+    # Each caller gets its own frame's result back
+    assert {v: r[0] for v, r in results.items()} == {1.0: "happy", -1.0: "sad", 2.0: "happy", -2.0: "sad"}
+    assert batcher.stats()["batch_size_histogram"] == {4: 1}
+
+
+def test_batches_are_capped_at_max_batch_size(app, model):
+    batcher = app.InferenceBatcher(window_ms=0, max_batch_size=8)
+    assert [r[0] for r in batcher.submit_burst([1.0, -1.0, 3.0])] == ["happy", "sad", "happy"]
+
+    batcher = app.InferenceBatcher(window_ms=100, max_batch_size=2)
+    threads = [threading.Thread(target=batcher.submit, args=(1.0,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(model.batches[1:]) <= 2
+    assert sum(model.batches[1:]) == 4
+
+
+def test_a_failed_batch_fails_every_frame_in_it(app, model, monkeypatch):
+    def broken(pixel_values):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(app, "_model", broken)
+    batcher = app.InferenceBatcher(window_ms=0)
+    with pytest.raises(RuntimeError, match="out of memory"):
+        batcher.submit(1.0)
@@ -0,0 +1,35 @@
+from conftest import signup_and_login, start_match
+
+
+def test_polling_returns_only_messages_after_the_cursor(app):
+    alice, bob = app.app.test_client(), app.app.test_client()
+    match_id = start_match(app, signup_and_login(alice, "alice"), signup_and_login(bob, "bob"))
+
+    for text in ("hi", "how are you?"):
+        assert alice.post("/send-message", json={"match_id": match_id, "message": text}).json["success"]
+    first = bob.get(f"/get-messages/{match_id}").json
+    assert [m["message"] for m in first["messages"]] == ["hi", "how are you?"]
+    assert [m["is_me"] for m in first["messages"]] == [False, False]
+
+    alice.post("/send-message", json={"match_id": match_id, "message": "still there?"})
+    newer = bob.get(f"/get-messages/{match_id}?since_id={first['last_id']}").json
+    assert [m["message"] for m in newer["messages"]] == ["still there?"]
+    assert newer["last_id"] > first["last_id"]
+
+
+def test_polling_with_nothing_new_is_a_304(app):
+    alice, bob = app.app.test_client(), app.app.test_client()
+    match_id = start_match(app, signup_and_login(alice, "alice"), signup_and_login(bob, "bob"))
+    alice.post("/send-message", json={"match_id": match_id, "message": "hi"})
+
+    latest = bob.get(f"/get-messages/{match_id}")
+    assert bob.get(f"/get-messages/{match_id}?since_id={latest.json['last_id']}").status_code == 304
+    assert bob.get(f"/get-messages/{match_id}", headers={"If-None-Match": latest.headers["ETag"]}).status_code == 304
+
+
+def test_only_the_matched_users_can_poll(app):
+    alice, bob, eve = app.app.test_client(), app.app.test_client(), app.app.test_client()
+    match_id = start_match(app, signup_and_login(alice, "alice"), signup_and_login(bob, "bob"))
+    signup_and_login(eve, "eve")
+
+    assert eve.get(f"/get-messages/{match_id}").status_code == 403
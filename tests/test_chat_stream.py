@@ -0,0 +1,60 @@
+import os
+import socket
+import threading
+import time
+
+from conftest import signup_and_login, start_match
+
+
+def read_events(response):
+    """(event, data) pairs from a finished text/event-stream body"""
+    events = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if ": " in line and not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields["event"], fields.get("data")))
+    return events
+
+
+def test_stream_pushes_messages_and_the_end_of_chat(app, monkeypatch):
+    monkeypatch.setattr(app, "CHAT_STREAM_SECONDS", 0.5)
+    alice, bob = app.app.test_client(), app.app.test_client()
+    match_id = start_match(app, signup_and_login(alice, "alice"), signup_and_login(bob, "bob"))
+    alice.post("/send-message", json={"match_id": match_id, "message": "hello"})
+
+    # Sent while the stream is open
+    threading.Timer(0.1, alice.post, args=("/send-message",), kwargs={"json": {"match_id": match_id, "message": "late"}}).start()
+
+    events = read_events(bob.get(f"/chat-stream/{match_id}"))
+    assert [e for e, _ in events] == ["message", "message"]
+    assert '"hello"' in events[0][1] and '"late"' in events[1][1]
+
+    alice.post(f"/end-chat/{match_id}")
+    # An ended match can't be streamed any more
+    assert bob.get(f"/chat-stream/{match_id}").status_code == 403
+
+
+def test_waiting_stream_is_woken_by_a_publish(app):
+    version = app.notification_bus.subscribe(7)
+    try:
+        threading.Timer(0.05, app.notification_bus.publish, args=(7,)).start()
+        started = time.monotonic()
+        assert app.notification_bus.wait(7, version, timeout=5) != version
+        assert time.monotonic() - started < 2
+    finally:
+        app.notification_bus.unsubscribe(7)
+
+
+def test_publish_reaches_the_other_workers(app):
+    app.notification_bus.ensure_listener()
+    # Another worker's socket in the bus directory
+    other = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    path = os.path.join(app.notification_bus.bus_dir, "999999.sock")
+    other.bind(path)
+    other.settimeout(2)
+    try:
+        app.notification_bus.publish(42, topic="emotion")
+        assert other.recv(128) == b"emotion:42"
+    finally:
+        other.close()
+        os.unlink(path)
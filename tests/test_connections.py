@@ -0,0 +1,54 @@
+import sqlite3
+import threading
+
+from conftest import signup_and_login
+
+
+def user_count(app):
+    return sqlite3.connect(app.DATABASE_PATH).execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def insert_user(conn, name):
+    conn.execute("INSERT INTO users (email, username, password) VALUES (?, ?, 'x')", (f"{name}@example.com", name))
+
+
+def test_requests_on_a_thread_reuse_one_connection(app, client):
+    signup_and_login(client, "pooled")
+    opened = app._db_stats["connections_opened"]
+    for _ in range(5):
+        assert client.get("/dashboard").status_code == 200
+    assert app._db_stats["connections_opened"] == opened
+
+    # Another thread gets its own
+    other = []
+    thread = threading.Thread(target=lambda: other.append(app.get_db()))
+    with app.app.app_context():
+        mine = app.get_db()
+    thread.start()
+    thread.join()
+    assert other[0] is not mine
+
+
+def test_request_writes_commit_once_then_run_callbacks(app):
+    events = []
+    with app.app.test_request_context("/"):
+        insert_user(app.get_db(), "one")
+        insert_user(app.get_db(), "two")
+        app.after_commit(lambda: events.append(user_count(app)))
+        # Nothing is visible to other connections before the view returns
+        assert user_count(app) == 0
+
+        app.finish_db_transaction(app.app.response_class(status=200))
+
+    assert events == [2]
+
+
+def test_server_error_rolls_back_the_request(app):
+    events = []
+    with app.app.test_request_context("/"):
+        insert_user(app.get_db(), "doomed")
+        app.after_commit(lambda: events.append("ran"))
+        app.finish_db_transaction(app.app.response_class(status=500))
+
+    assert user_count(app) == 0
+    assert events == []
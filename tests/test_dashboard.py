@@ -0,0 +1,23 @@
+from conftest import signup_and_login
+
+
+def test_dashboard_etag_revalidates(app, client):
+    signup_and_login(client, "charts")
+    first = client.get("/dashboard/data")
+    assert first.status_code == 200
+
+    again = client.get("/dashboard/data", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_dashboard_etag_follows_the_day_window(app, client, monkeypatch):
+    signup_and_login(client, "window")
+    first = client.get("/dashboard/data")
+    assert first.json["since"] in first.headers["ETag"]
+
+    # A different window (or tomorrow's) must not revalidate a stale chart
+    monkeypatch.setattr(app, "DASHBOARD_CHART_DAYS", 7)
+    moved = client.get("/dashboard/data", headers={"If-None-Match": first.headers["ETag"]})
+    assert moved.status_code == 200
+    assert moved.json["days"] == 7
+    assert moved.json["since"] != first.json["since"]
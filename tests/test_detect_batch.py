@@ -0,0 +1,94 @@
+import base64
+import io
+import sqlite3
+
+import pytest
+
+from conftest import jpeg_frame, signup_and_login
+
+SAD = {"sad": 0.7, "happy": 0.2, "neutral": 0.1}
+HAPPY = {"sad": 0.3, "happy": 0.6, "neutral": 0.1}
+
+
+def reading(scores):
+    return max(scores, key=scores.get), max(scores.values()), scores
+
+
+def as_data_url(frame):
+    return "data:image/jpeg;base64," + base64.b64encode(frame).decode()
+
+
+def test_scores_are_averaged_across_the_burst(app):
+    emotion, confidence, scores, spread = app.aggregate_burst([reading(SAD), reading(SAD), reading(HAPPY)])
+
+    assert emotion == "sad"
+    assert confidence == pytest.approx(1.7 / 3)
+    assert scores["happy"] == pytest.approx(1.0 / 3)
+    assert spread == {"frames": 3, "agreement": 0.67, "min": 30.0, "max": 70.0, "stdev": 18.86}
+
+
+@pytest.fixture
+def burst(app, client, monkeypatch):
+    """Log in and have the model answer one reading per frame"""
+    signup_and_login(client, "bursty")
+    monkeypatch.setattr(app, "emotion_smoother", app.EmotionSmoother(alpha=1.0, heartbeat=60))
+    monkeypatch.setattr(app.inference_client, "available", lambda: True)
+    calls = []
+
+    def classify(frames):
+        calls.append(len(frames))
+        return [reading(SAD if i % 2 == 0 else HAPPY) for i in range(len(frames))]
+
+    monkeypatch.setattr(app, "classify_burst", classify)
+    return calls
+
+
+def test_burst_is_classified_once_and_stored_once(app, client, burst):
+    frames = [as_data_url(jpeg_frame(seed)) for seed in range(3)]
+    response = client.post("/detect-batch", json={"images": frames})
+
+    assert response.status_code == 200
+    assert response.json["emotion"] == "sad"
+    assert response.json["spread"]["frames"] == 3
+    assert burst == [3]                   # one forward pass for the whole burst
+
+    app.write_behind.barrier()
+    rows = sqlite3.connect(app.DATABASE_PATH).execute("SELECT emotion FROM emotions").fetchall()
+    assert rows == [("sad",)]
+
+
+def test_multipart_bursts_are_accepted(app, client, burst):
+    data = {"frame": [(io.BytesIO(jpeg_frame(seed)), f"{seed}.jpg") for seed in range(2)]}
+    response = client.post("/detect-batch", data=data, content_type="multipart/form-data")
+
+    assert response.status_code == 200
+    assert burst == [2]
+
+
+def test_too_many_frames_are_rejected(app, client, burst):
+    frames = [as_data_url(jpeg_frame(0))] * (app.DETECT_BURST_MAX_FRAMES + 1)
+    response = client.post("/detect-batch", json={"images": frames})
+
+    assert response.status_code == 400
+    assert burst == []
+
+
+def test_missing_images_are_rejected(app, client, burst):
+    assert client.post("/detect-batch", json={"image": "x"}).status_code == 400
+    assert burst == []
+
+
+def test_unchanged_frames_skip_the_forward_pass(app, client, burst):
+    still, moved = as_data_url(jpeg_frame(0)), as_data_url(jpeg_frame(2))
+    response = client.post("/detect-batch", json={"images": [still, still, moved, moved]})
+
+    assert response.status_code == 200
+    assert burst == [2]                   # one frame per visible change
+    assert response.json["spread"]["frames"] == 4
+    assert response.json["spread"]["agreement"] == 0.5
+
+    # The next burst starts where this one ended: nothing changed, no pass
+    response = client.post("/detect-batch", json={"images": [moved, moved]})
+    assert response.status_code == 200
+    assert burst == [2]
+    assert response.json["raw_emotion"] == "happy"
@@ -0,0 +1,23 @@
+import pytest
+
+from conftest import jpeg_frame, signup_and_login
+
+
+@pytest.mark.parametrize("remote", [True, False])
+def test_cache_key_does_not_depend_on_backend(app, client, monkeypatch, remote):
+    signup_and_login(client, "hasher")
+    frame = jpeg_frame(0)
+    stored = []
+
+    monkeypatch.setattr(app.inference_client, "available", lambda: remote)
+    monkeypatch.setattr(app.model_lifecycle, "ready", lambda: True)
+    monkeypatch.setattr(app, "classify_frame", lambda image_bytes, image=None: ("happy", 0.9, {"happy": 0.9, "sad": 0.1}))
+    monkeypatch.setattr(app.frame_cache, "store", lambda *args: stored.append(args[1]))
+    if not remote:
+        monkeypatch.setattr(app, "get_frame_preprocessor", lambda: type("P", (), {"decode": staticmethod(lambda b: None)})())
+
+    response = client.post("/detect", data=frame, content_type="image/jpeg")
+
+    assert response.status_code == 200
+    assert stored == [app.hash_frame(frame)]
+    assert stored[0] != app.hash_frame(jpeg_frame(2))
@@ -0,0 +1,83 @@
+import os
+import stat
+import threading
+import time
+
+from conftest import jpeg_frame, signup_and_login
+from tools.inference_server import serve_inference
+
+
+def test_runtime_dir_is_private(app, tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir(mode=0o777)
+    os.chmod(shared, 0o777)
+
+    app.ensure_private_dir(str(shared))
+
+    assert stat.S_IMODE(os.stat(shared).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(app.ensure_private_dir(str(tmp_path / "new"))).st_mode) == 0o700
+
+
+def test_runtime_dir_owned_by_someone_else_is_refused(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app.os, "getuid", lambda: os.stat(tmp_path).st_uid + 1)
+    try:
+        app.ensure_private_dir(str(tmp_path))
+    except OSError:
+        pass
+    else:
+        raise AssertionError("a directory owned by another user was accepted")
+
+
+def test_inference_socket_is_created_private(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "preload_model", lambda: True)
+    path = str(tmp_path / "inference.sock")
+    previous = os.umask(0o002)   # a permissive umask
+    try:
+        threading.Thread(target=serve_inference, args=(path,), daemon=True).start()
+        for _ in range(200):
+            if os.path.exists(path):
+                break
+            time.sleep(0.01)
+    finally:
+        os.umask(previous)
+
+    assert stat.S_IMODE(os.stat(path).st_mode) & 0o077 == 0
+
+
+def test_unreachable_server_falls_back_through_the_lifecycle(app, client, tmp_path, monkeypatch):
+    signup_and_login(client, "remote")
+    loads = []
+    monkeypatch.setattr(app.inference_client, "path", str(tmp_path / "missing.sock"))
+    monkeypatch.setattr(app.inference_client, "_down_until", 0.0)
+    monkeypatch.setattr(app, "model_lifecycle", app.ModelLifecycle())
+    monkeypatch.setattr(app, "_model", None)
+    monkeypatch.setattr(app, "_load_model", lambda: loads.append(threading.current_thread().name))
+
+    response = client.post("/detect", data=jpeg_frame(1), content_type="image/jpeg")
+
+    assert response.status_code == 503
+    assert response.json["fallback"] is True
+    for _ in range(100):
+        if loads:
+            break
+        time.sleep(0.01)
+    # Loaded in the background, not on the request thread
+    assert loads == ["model-loader"]
+
+
+def test_fallback_model_is_unloaded_once_the_server_answers(app, monkeypatch):
+    monkeypatch.setattr(app, "model_lifecycle", app.ModelLifecycle())   # idle eviction off
+    monkeypatch.setattr(app, "_model", object())
+    monkeypatch.setattr(app, "_processor", object())
+    monkeypatch.setitem(app._model_stats, "preloaded", False)
+    monkeypatch.setattr(app, "_malloc_trim", lambda: None)
+    monkeypatch.setattr(app.inference_client, "path", "/unused.sock")
+    monkeypatch.setattr(app.inference_client, "_down_until", 0.0)
+    monkeypatch.setattr(app.inference_client, "classify", lambda frames: [("sad", 0.9, {"sad": 0.9})] * len(frames))
+
+    with app.model_lifecycle.in_use():
+        app.classify_frame(b"frame")
+        assert app._model is not None     # not while a fallback batch runs
+    assert app.classify_burst([b"a", b"b"]) == [("sad", 0.9, {"sad": 0.9})] * 2
+    assert app._model is None
+    assert app.model_lifecycle.stats()["evictions"] == 1
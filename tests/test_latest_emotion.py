@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture
+def store(app, monkeypatch):
+    store = app.LatestEmotionStore(max_users=2, ttl=60)
+    monkeypatch.setattr(app, "latest_emotions", store)
+    return store
+
+
+def write_elsewhere(app, user_id, emotion):
+    """What another worker's record_emotion leaves in the database"""
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    with conn:
+        app._insert_emotion(conn, user_id, emotion, 80.0)
+    conn.close()
+
+
+def test_recorded_emotion_is_served_from_the_cache(app, store):
+    with app.app.test_request_context("/"):
+        app.record_emotion(1, "sad", 90.0)
+        app.finish_db_transaction(app.app.response_class(status=200))
+
+    with app.app.app_context():
+        assert store.get(1) == "sad"
+    assert store.stats()["hits"] == 1
+    assert store.stats()["misses"] == 0
+
+
+def test_invalidation_from_another_worker_is_picked_up(app, store):
+    write_elsewhere(app, 1, "sad")
+    with app.app.app_context():
+        assert store.get(1) == "sad"
+        write_elsewhere(app, 1, "happy")
+        assert store.get(1) == "sad"      # still cached
+
+        store.invalidate(1)               # the bus's "emotion" notification
+        assert store.get(1) == "happy"
+
+
+def test_entries_expire_and_the_cache_stays_bounded(app, store):
+    for user_id in (1, 2, 3):
+        write_elsewhere(app, user_id, "neutral")
+    with app.app.app_context():
+        for user_id in (1, 2, 3):
+            store.get(user_id)
+        assert store.stats()["size"] == 2
+
+        store.ttl = -1                    # everything has expired
+        write_elsewhere(app, 3, "angry")
+        assert store.get(3) == "angry"
+
+
+def test_user_without_emotions_has_none(app, store):
+    with app.app.app_context():
+        assert store.get(99) is None
@@ -0,0 +1,86 @@
+import sqlite3
+import threading
+import time
+
+
+def queue_size(app):
+    with sqlite3.connect(app.DATABASE_PATH) as conn:
+        return conn.execute("SELECT COUNT(*) FROM match_queue").fetchone()[0]
+
+
+def test_second_user_with_same_emotion_is_paired(app):
+    assert app.matchmaker.pair(1, "sad") == (None, None, None)
+    match_id, partner_id, _ = app.matchmaker.pair(2, "sad")
+
+    assert match_id is not None and partner_id == 1
+    # The first user gets the same match back on their next call
+    assert app.matchmaker.pair(1, "sad")[:2] == (match_id, 2)
+    assert queue_size(app) == 0
+
+
+def test_different_emotions_wait_separately(app):
+    app.matchmaker.pair(1, "sad")
+    assert app.matchmaker.pair(2, "happy") == (None, None, None)
+    assert app.matchmaker.stats()["waiting"] == {"sad": 1, "happy": 1}
+
+
+def test_stats_follow_pairs_made_by_another_worker(app):
+    other_worker = app.MatchmakingPool(wait_ttl=600)
+    app.matchmaker.pair(1, "sad")
+    assert app.matchmaker.stats()["waiting"] == {"sad": 1}
+
+    assert other_worker.pair(2, "sad")[1] == 1
+    assert app.matchmaker.stats()["waiting"] == {}
+
+
+def test_stale_waiters_are_not_paired(app):
+    pool = app.MatchmakingPool(wait_ttl=600)
+    pool.pair(1, "sad")
+    with sqlite3.connect(app.DATABASE_PATH) as conn:
+        conn.execute("UPDATE match_queue SET last_seen = last_seen - 601")
+
+    assert pool.pair(2, "sad") == (None, None, None)
+    assert pool.stats()["expired"] == 1
+    assert pool.stats()["waiting"] == {"sad": 1}
+
+
+def test_concurrent_pairing_never_double_books(app):
+    users = list(range(1, 41))
+    barrier = threading.Barrier(len(users))
+    errors = []
+
+    def arrive(user_id):
+        barrier.wait()
+        try:
+            app.matchmaker.pair(user_id, "sad")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=arrive, args=(user_id,)) for user_id in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with sqlite3.connect(app.DATABASE_PATH) as conn:
+        rows = conn.execute("SELECT user1_id, user2_id FROM matches WHERE active = 1").fetchall()
+    matched = [user_id for row in rows for user_id in row]
+    assert len(rows) == 20
+    assert sorted(matched) == users
+    assert queue_size(app) == 0
+
+
+def test_unchanged_wait_does_not_take_the_write_lock(app):
+    app.matchmaker.pair(1, "sad")
+
+    # Another worker holding the write lock must not block a waiter's re-check
+    blocker = sqlite3.connect(app.DATABASE_PATH)
+    blocker.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.monotonic()
+        assert app.matchmaker.pair(1, "sad") == (None, None, None)
+        assert time.monotonic() - started < 1
+    finally:
+        blocker.rollback()
+        blocker.close()
@@ -0,0 +1,32 @@
+import threading
+
+
+def test_metrics_hidden_without_token(app, client, monkeypatch):
+    monkeypatch.setattr(app, "METRICS_TOKEN", None)
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"X-Metrics-Token": ""}).status_code == 404
+
+
+def test_metrics_require_matching_token(app, client, monkeypatch):
+    monkeypatch.setattr(app, "METRICS_TOKEN", "s3cret")
+    assert client.get("/metrics").status_code == 404
+    assert client.get("/metrics", headers={"X-Metrics-Token": "wrong"}).status_code == 404
+
+    response = client.get("/metrics", headers={"X-Metrics-Token": "s3cret"})
+    assert response.status_code == 200
+    assert "db" in response.get_json()
+
+
+def test_db_counters_do_not_lose_updates(app):
+    before = app._db_stats["commits"]
+
+    def bump():
+        for _ in range(10000):
+            app._count_db("commits")
+
+    threads = [threading.Thread(target=bump) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert app._db_stats["commits"] - before == 80000
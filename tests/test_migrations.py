@@ -0,0 +1,67 @@
+import sqlite3
+
+# The schema the app shipped with before migrations existed
+LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT UNIQUE NOT NULL,
+    username TEXT UNIQUE NOT NULL, password TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE emotions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, emotion TEXT,
+    confidence REAL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE matches (id INTEGER PRIMARY KEY AUTOINCREMENT, user1_id INTEGER, user2_id INTEGER,
+    emotion TEXT, active INTEGER DEFAULT 1, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE chat_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, match_id INTEGER, sender_id INTEGER,
+    message TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+"""
+
+
+def indexes(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_fresh_database_is_fully_migrated(app, tmp_path):
+    path = str(tmp_path / "fresh.db")
+    app.init_db(path)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == app.MIGRATIONS[-1][0]
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert {"idx_emotions_user_latest", "idx_matches_user1", "idx_matches_user2",
+            "idx_chat_messages_match", "idx_match_queue_emotion"} <= indexes(conn)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert "matchmaking_state" not in tables
+
+
+def test_migrating_again_is_a_no_op(app, tmp_path, capsys):
+    path = str(tmp_path / "twice.db")
+    app.init_db(path)
+    capsys.readouterr()
+
+    app.init_db(path)
+    assert "Applying migration" not in capsys.readouterr().out
+
+
+def test_legacy_database_is_upgraded_in_place(app, tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute("INSERT INTO users (email, username, password) VALUES ('a@example.com', 'a', 'x')")
+    conn.executemany("INSERT INTO emotions (user_id, emotion, confidence) VALUES (1, ?, 90)", [("sad",), ("happy",)])
+    conn.execute("INSERT INTO chat_messages (match_id, sender_id, message) VALUES (1, 1, 'hi')")
+    conn.commit()
+    conn.close()
+
+    app.init_db(path)
+
+    conn = sqlite3.connect(path)
+    # Old rows survive and the new tables are backfilled from them
+    assert conn.execute("SELECT sender_type FROM chat_messages").fetchone()[0] == "user"
+    assert conn.execute("SELECT emotion, emotion_id FROM user_state WHERE user_id = 1").fetchone() == ("happy", 2)
+    assert dict(conn.execute("SELECT emotion, count FROM emotion_daily WHERE user_id = 1").fetchall()) == {"sad": 1, "happy": 1}
+
+
+def test_target_stops_part_way(app, tmp_path):
+    path = str(tmp_path / "partial.db")
+    app.init_db(path, target=2)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 2
+    assert "idx_emotions_user_latest" not in indexes(conn)
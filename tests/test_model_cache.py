@@ -0,0 +1,85 @@
+import os
+import shutil
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from conftest import jpeg_frame
+
+
+@pytest.fixture
+def cache_dir(app, tmp_path, monkeypatch):
+    path = str(tmp_path / "cache")
+    monkeypatch.setattr(app, "EMOTION_MODEL_CACHE_DIR", path)
+    return path
+
+
+def pixels():
+    torch.manual_seed(2)
+    return torch.randn(2, 3, 32, 32)
+
+
+def cached_artifacts(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith(".pt"))
+
+
+def test_torchscript_is_traced_once_then_loaded_from_the_cache(app, tiny_model, cache_dir, monkeypatch):
+    _, reference = app.load_emotion_model("eager")
+    _, traced = app.load_emotion_model("torchscript")
+    assert len(cached_artifacts(cache_dir)) == 1
+
+    def no_tracing(model):
+        raise AssertionError("the cached artifact should have been used")
+
+    monkeypatch.setattr(app, "trace_emotion_model", no_tracing)
+    processor, cached = app.load_emotion_model("torchscript")
+
+    assert cached.config.id2label == reference.config.id2label
+    with torch.no_grad():
+        expected = reference(pixel_values=pixels()).logits
+        assert torch.allclose(traced(pixel_values=pixels()).logits, expected, atol=1e-5)
+        assert torch.allclose(cached(pixel_values=pixels()).logits, expected, atol=1e-5)
+
+    # The cached processor settings are enough for the frame preprocessor
+    preprocessor = app.FramePreprocessor(processor)
+    pixel_values = preprocessor.batch([preprocessor.decode(jpeg_frame())])
+    assert tuple(pixel_values.shape) == (1, 3, 32, 32)
+
+
+def test_a_changed_snapshot_gets_a_new_artifact(app, tiny_model_dir, cache_dir, tmp_path, monkeypatch):
+    snapshot = str(tmp_path / "snapshot")
+    shutil.copytree(tiny_model_dir, snapshot)
+    monkeypatch.setattr(app, "EMOTION_MODEL_DIR", snapshot)
+    monkeypatch.setattr(app, "EMOTION_MODEL_SOURCE", snapshot)
+
+    app.load_emotion_model("torchscript")
+    first = app.model_snapshot_hash(snapshot)
+    with open(os.path.join(snapshot, "config.json"), "a") as f:
+        f.write("\n")
+
+    assert app.model_snapshot_hash(snapshot) != first
+    app.load_emotion_model("torchscript")
+    assert len(cached_artifacts(cache_dir)) == 2
+
+
+def test_snapshot_directory_loads_without_the_network(app, tiny_model, cache_dir, monkeypatch):
+    from transformers import AutoModelForImageClassification
+
+    seen = {}
+    original = AutoModelForImageClassification.from_pretrained.__func__
+
+    def spy(cls, source, **kwargs):
+        seen.update(kwargs)
+        return original(cls, source, **kwargs)
+
+    monkeypatch.setattr(AutoModelForImageClassification, "from_pretrained", classmethod(spy))
+    app.load_emotion_model("eager")
+
+    assert seen["local_files_only"] is True
+    assert seen["use_safetensors"] is True
+
+
+def test_snapshot_without_weights_has_no_hash(app, tmp_path, cache_dir):
+    (tmp_path / "config.json").write_text("{}")
+    assert app.model_snapshot_hash(str(tmp_path)) is None
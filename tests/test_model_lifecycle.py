@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from conftest import jpeg_frame, signup_and_login
+
+
+@pytest.fixture
+def lifecycle(app, monkeypatch):
+    """A fresh ModelLifecycle with a stand-in model that loads instantly"""
+    lifecycle = app.ModelLifecycle(idle_seconds=60, retry_seconds=5, max_retry_seconds=20)
+    monkeypatch.setattr(app, "model_lifecycle", lifecycle)
+    monkeypatch.setattr(app, "_model", object())
+    monkeypatch.setattr(app, "_processor", object())
+    monkeypatch.setitem(app._model_stats, "preloaded", False)
+    monkeypatch.setattr(app, "_malloc_trim", lambda: None)
+    return lifecycle
+
+
+def idle_for(lifecycle, seconds):
+    lifecycle._last_used = time.monotonic() - seconds
+
+
+def test_idle_model_is_evicted(app, lifecycle):
+    idle_for(lifecycle, 30)
+    assert not lifecycle.evict_if_idle()
+    assert app._model is not None
+
+    idle_for(lifecycle, 61)
+    assert lifecycle.evict_if_idle()
+    assert app._model is None
+    assert lifecycle.stats()["evictions"] == 1
+
+
+def test_model_in_use_is_not_evicted(app, lifecycle):
+    with lifecycle.in_use():
+        idle_for(lifecycle, 61)
+        assert not lifecycle.evict_if_idle()
+    assert app._model is not None
+
+
+def test_preloaded_model_is_never_evicted(app, lifecycle, monkeypatch):
+    monkeypatch.setitem(app._model_stats, "preloaded", True)
+    idle_for(lifecycle, 3600)
+    assert not lifecycle.evictable()
+    assert not lifecycle.evict_if_idle()
+    assert app._model is not None
+
+
+def test_unloaded_model_never_loads_on_the_request_thread(app, lifecycle, monkeypatch):
+    monkeypatch.setattr(app, "_model", None)
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_load():
+        loading.set()
+        release.wait(5)
+        app._model, app._processor = object(), object()
+        lifecycle.loaded()
+
+    monkeypatch.setattr(app, "_load_model", slow_load)
+
+    with pytest.raises(app.ModelUnavailable):
+        app.loaded_model()
+    # ...but a background load was started for the next request
+    assert loading.wait(5)
+    assert lifecycle.stats()["state"] == "loading"
+
+    release.set()
+    for _ in range(100):
+        if lifecycle.ready():
+            break
+        time.sleep(0.01)
+    assert app.loaded_model()[1] is app._model
+
+
+def test_batch_after_eviction_falls_back(app, lifecycle, monkeypatch):
+    pytest.importorskip("torch")
+    monkeypatch.setattr(app, "_model", None)
+    monkeypatch.setattr(app, "_load_model", lambda: None)
+    with pytest.raises(app.ModelUnavailable):
+        app.InferenceBatcher(window_ms=0).submit(None)
+
+
+def test_failed_loads_back_off_exponentially(app, lifecycle, monkeypatch):
+    monkeypatch.setattr(app, "_model", None)
+    delays = []
+    for _ in range(4):
+        lifecycle.load_failed()
+        delays.append(lifecycle._retry_at - time.monotonic())
+
+    assert [round(d) for d in delays] == [5, 10, 20, 20]
+    assert not lifecycle.retry_due()
+    assert not lifecycle.ready()   # no new load before the backoff runs out
+    assert lifecycle.stats()["state"] == "failed"
+
+    lifecycle._retry_at = 0
+    lifecycle.loaded()
+    assert lifecycle.stats()["retry_in"] == 0
+
+
+def test_detect_evicted_after_readiness_check_gets_503(app, client, lifecycle, monkeypatch):
+    from conftest import jpeg_frame, signup_and_login
+    
+
+    signup_and_login(client, "evicted")
+    monkeypatch.setattr(app, "_model", None)
+    monkeypatch.setattr(app, "_load_model", lambda: None)
+    monkeypatch.setattr(app.inference_client, "available", lambda: False)
+    monkeypatch.setattr(lifecycle, "ready", lambda: True)   # evicted right after
+    monkeypatch.setattr(app, "get_frame_preprocessor", lambda: type("P", (), {"decode": staticmethod(lambda b: None)})())
+
+    response = client.post("/detect", data=jpeg_frame(0), content_type="image/jpeg")
+
+    assert response.status_code == 503
+    assert response.json["fallback"] is True
@@ -0,0 +1,111 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+
+def reply(text):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))])
+
+
+class FakeClient:
+    """Answers from a script: an exception is raised, anything else returned"""
+
+    def __init__(self, *script, delay=0):
+        self.script = list(script)
+        self.delay = delay
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=self)
+
+    def create(self, model, messages, stream):
+        self.calls += 1
+        time.sleep(self.delay)
+        outcome = self.script.pop(0) if len(self.script) > 1 else self.script[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return reply(outcome)
+
+
+def down():
+    return openai.APIConnectionError(request=None)
+
+
+@pytest.fixture
+def gateway(app):
+    def make(**kwargs):
+        settings = dict(max_concurrency=2, queue_timeout=0.05, max_retries=0, retry_base=0,
+                        failure_threshold=2, reset_seconds=60)
+        settings.update(kwargs)
+        return app.OpenAIGateway(**settings)
+    return make
+
+
+def test_transient_failures_are_retried(app, gateway):
+    client = FakeClient(down(), down(), "hello")
+    assert gateway(max_retries=2).complete(client, []) == "hello"
+    assert client.calls == 3
+
+
+def test_breaker_opens_after_repeated_failures_and_fails_fast(app, gateway):
+    gw = gateway()
+    client = FakeClient(down())
+    for _ in range(2):
+        with pytest.raises(app.AiUnavailable):
+            gw.complete(client, [])
+    assert gw.stats()["state"] == "open"
+
+    with pytest.raises(app.AiUnavailable, match="circuit open"):
+        gw.complete(client, [])
+    assert client.calls == 2              # the open breaker never called out
+    assert gw.stats()["rejected_open"] == 1
+
+
+def test_half_open_probe_closes_or_reopens_the_breaker(app, gateway):
+    gw = gateway(failure_threshold=1, reset_seconds=0)
+    with pytest.raises(app.AiUnavailable):
+        gw.complete(FakeClient(down()), [])
+    assert gw.stats()["state"] == "open"
+
+    with pytest.raises(app.AiUnavailable):
+        gw.complete(FakeClient(down()), [])   # the probe fails
+    assert gw.stats()["state"] == "open"
+    assert gw.stats()["breaker_opened"] == 2
+
+    assert gw.complete(FakeClient("back"), []) == "back"
+    assert gw.stats()["state"] == "closed"
+
+
+def test_non_upstream_errors_do_not_trip_the_breaker(app, gateway):
+    gw = gateway(failure_threshold=1)
+    with pytest.raises(ValueError):
+        gw.complete(FakeClient(ValueError("bad request")), [])
+    assert gw.stats()["state"] == "closed"
+
+
+def test_calls_beyond_the_concurrency_cap_are_turned_away(app, gateway):
+    gw = gateway(max_concurrency=1)
+    slow = FakeClient("slow", delay=0.3)
+    worker = threading.Thread(target=gw.complete, args=(slow, []))
+    worker.start()
+    time.sleep(0.05)
+
+    with pytest.raises(app.AiUnavailable, match="concurrent"):
+        gw.complete(FakeClient("fast"), [])
+    worker.join()
+
+    stats = gw.stats()
+    assert stats["rejected_busy"] == 1
+    assert stats["in_flight"] == 0
+    assert stats["state"] == "closed"     # being busy isn't an upstream failure
+
+
+def test_client_has_timeouts_and_no_retries_of_its_own(app, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr(app, "client", None)
+    client = app.get_openai_client()
+
+    assert client.max_retries == 0
+    assert client.timeout.connect == app.OPENAI_CONNECT_TIMEOUT_SECONDS
+    assert client.timeout.read == app.OPENAI_READ_TIMEOUT_SECONDS
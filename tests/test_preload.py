@@ -0,0 +1,49 @@
+import gc
+import os
+import runpy
+
+import pytest
+
+
+@pytest.fixture
+def fresh_model_state(app, monkeypatch):
+    # preload_model loads into the module globals; put them back afterwards
+    for name in ("_model", "_processor", "_frame_preprocessor"):
+        monkeypatch.setattr(app, name, None)
+    monkeypatch.setattr(app, "model_lifecycle", app.ModelLifecycle())
+    monkeypatch.setitem(app._model_stats, "preloaded", False)
+    yield
+    gc.unfreeze()
+
+
+def test_preload_loads_warms_up_and_freezes(app, tiny_model, fresh_model_state):
+    assert app.preload_model()
+
+    assert app._model is not None
+    assert app._model_stats["preloaded"]
+    # Everything allocated so far is out of the collector's reach, so
+    # collections in the workers don't dirty the shared pages
+    assert gc.get_freeze_count() > 0
+
+
+def test_failed_preload_leaves_the_lazy_path(app, fresh_model_state, monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("PIL")
+    monkeypatch.setattr(app, "load_emotion_model", lambda backend: 1 / 0)
+
+    assert not app.preload_model()
+    assert not app._model_stats["preloaded"]
+    assert app.model_lifecycle.stats()["state"] == "failed"
+
+
+@pytest.mark.parametrize("flag, preloads", [("1", True), ("0", False)])
+def test_gunicorn_preloads_in_the_master_only_when_asked(app, monkeypatch, flag, preloads):
+    monkeypatch.setenv("EMOTION_MODEL_PRELOAD", flag)
+    calls = []
+    monkeypatch.setattr(app, "preload_model", lambda: calls.append("preload"))
+
+    config = runpy.run_path(os.path.join(os.path.dirname(app.__file__), "gunicorn.conf.py"))
+    config["when_ready"](server=None)
+
+    assert config["preload_app"] is preloads
+    assert calls == (["preload"] if preloads else [])
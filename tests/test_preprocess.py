@@ -0,0 +1,31 @@
+import pytest
+
+from conftest import jpeg_frame
+
+np = pytest.importorskip("numpy")
+transformers = pytest.importorskip("transformers")
+
+
+@pytest.fixture
+def processor(tiny_model_dir):
+    return transformers.AutoImageProcessor.from_pretrained(tiny_model_dir)
+
+
+def test_frames_decode_at_reduced_scale_but_never_below_the_input(app, processor):
+    preprocessor = app.FramePreprocessor(processor)
+    image = preprocessor.decode(jpeg_frame())   # 320x240
+
+    assert image.mode == "RGB"
+    assert image.size[0] < 320
+    assert min(image.size) >= 32
+
+
+def test_fast_path_matches_the_image_processor(app, processor):
+    preprocessor = app.FramePreprocessor(processor)
+    image = preprocessor.decode(jpeg_frame())
+
+    expected = np.asarray(processor(images=image, return_tensors="np")["pixel_values"][0])
+    actual = preprocessor.batch([image]).numpy()[0]
+
+    assert actual.shape == expected.shape == (3, 32, 32)
+    assert np.abs(actual - expected).max() < 1e-4
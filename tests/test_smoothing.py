@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from conftest import jpeg_frame, signup_and_login
+
+SAD = {"sad": 0.7, "happy": 0.2, "neutral": 0.1}
+HAPPY = {"sad": 0.1, "happy": 0.8, "neutral": 0.1}
+
+
+def test_one_odd_frame_does_not_flip_the_label(app):
+    smoother = app.EmotionSmoother(alpha=0.4, heartbeat=60)
+    smoother.update(1, SAD)
+    smoother.update(1, SAD)
+    assert smoother.update(1, HAPPY)[0] == "sad"
+
+    # ...but a sustained change does
+    assert smoother.update(1, HAPPY)[0] == "happy"
+
+
+def test_workers_fold_frames_into_the_same_average(app):
+    # Two smoothers stand in for two gunicorn workers serving one user
+    first = app.EmotionSmoother(alpha=0.4, heartbeat=60)
+    second = app.EmotionSmoother(alpha=0.4, heartbeat=60)
+    first.update(1, SAD)
+    second.update(1, SAD)
+    assert first.update(1, HAPPY)[0] == "sad"
+    assert second.update(1, HAPPY)[0] == "happy"
+
+
+def test_a_long_gap_starts_over(app, monkeypatch):
+    smoother = app.EmotionSmoother(alpha=0.4, heartbeat=0)
+    smoother.update(1, SAD)
+    assert smoother.update(1, HAPPY) == ("happy", 0.8)
+
+
+@pytest.fixture
+def detect(app, client, monkeypatch):
+    """POST a frame to /detect with the model answering `scores`"""
+    signup_and_login(client, "steady")
+    monkeypatch.setattr(app, "emotion_smoother", app.EmotionSmoother(alpha=1.0, heartbeat=60))
+    monkeypatch.setattr(app.inference_client, "available", lambda: True)
+
+    def post(scores, seed):
+        monkeypatch.setattr(app, "classify_frame", lambda *args: (max(scores, key=scores.get), max(scores.values()), scores))
+        response = client.post("/detect", data=jpeg_frame(seed), content_type="image/jpeg")
+        assert response.status_code == 200
+        return response.json["emotion"]
+    return post
+
+
+def stored_emotions(app):
+    app.write_behind.barrier()
+    return [row[0] for row in sqlite3.connect(app.DATABASE_PATH).execute("SELECT emotion FROM emotions ORDER BY id")]
+
+
+def test_only_label_changes_are_stored(app, detect):
+    assert [detect(SAD, seed) for seed in (0, 1, 2)] == ["sad", "sad", "sad"]
+    assert stored_emotions(app) == ["sad"]
+
+    assert detect(HAPPY, 3) == "happy"
+    assert stored_emotions(app) == ["sad", "happy"]
+    assert app.emotion_smoother.stats() == {"persisted": 2, "suppressed": 2}
+
+
+def test_an_unchanged_label_is_stored_again_after_the_heartbeat(app, detect):
+    detect(SAD, 0)
+    app.emotion_smoother.heartbeat = 0
+    detect(SAD, 1)
+    assert stored_emotions(app) == ["sad", "sad"]
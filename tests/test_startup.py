@@ -0,0 +1,33 @@
+import json
+import os
+import subprocess
+import sys
+
+from tools.startup import _STARTUP_PROBE
+
+HEAVY = ("torch", "transformers", "PIL", "numpy", "openai")
+
+
+def run_probe(tmp_path, code=_STARTUP_PROBE):
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DATABASE_PATH=str(tmp_path / "startup.db"))
+    done = subprocess.run([sys.executable, "-c", code], cwd=app_dir, env=env,
+                          capture_output=True, text=True, timeout=120)
+    assert done.returncode == 0, done.stderr
+    return json.loads(done.stdout.strip().splitlines()[-1])
+
+
+def test_import_and_first_request_load_no_heavy_modules(tmp_path):
+    result = run_probe(tmp_path)
+    assert result["heavy"] == []
+
+
+def test_heavy_modules_load_only_when_used(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    result = run_probe(tmp_path, (
+        "import json, sys\n"
+        "import app\n"
+        "app.get_openai_client()\n"
+        f"print(json.dumps([m for m in {HEAVY!r} if m in sys.modules]))\n"
+    ))
+    assert result == ["openai"]
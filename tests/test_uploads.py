@@ -0,0 +1,80 @@
+import base64
+import io
+import json
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+from conftest import signup_and_login
+
+
+class CountingStream(io.RawIOBase):
+    """An endless request body that records how much of it was read"""
+
+    def __init__(self, prefix=b""):
+        self.prefix = prefix
+        self.read_bytes = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = (self.prefix + b"A" * len(buffer))[:len(buffer)]
+        self.prefix = self.prefix[len(chunk):]
+        buffer[:len(chunk)] = chunk
+        self.read_bytes += len(chunk)
+        return len(chunk)
+
+
+def chunked_request(app, path, content_type, stream):
+    # No Content-Length: the body only ends when the client stops sending
+    environ = EnvironBuilder(path, method="POST", content_type=content_type).get_environ()
+    environ.pop("CONTENT_LENGTH", None)
+    environ["wsgi.input"] = stream
+    environ["wsgi.input_terminated"] = True
+    return app.app.request_context(environ)
+
+
+@pytest.mark.parametrize("content_type, prefix", [
+    ("application/json", b'{"image": "data:image/jpeg;base64,'),
+    ("image/jpeg", b""),
+])
+def test_chunked_frame_upload_is_cut_off(app, content_type, prefix):
+    stream = CountingStream(prefix)
+    with chunked_request(app, "/detect", content_type, stream):
+        image_bytes, error = app.read_frame_upload()
+
+    assert image_bytes is None
+    assert error[1] == 413
+    assert stream.read_bytes <= app.DETECT_MAX_FRAME_BYTES * 2
+
+
+def test_chunked_burst_upload_is_cut_off(app):
+    stream = CountingStream(b'{"images": ["')
+    with chunked_request(app, "/detect-batch", "application/json", stream):
+        frames, error = app.read_burst_upload()
+
+    assert frames is None
+    assert error[1] == 413
+    assert stream.read_bytes <= app.app.config["MAX_CONTENT_LENGTH"] + 65536
+
+
+def test_frame_within_limit_is_accepted(app):
+    frame = b"\xff\xd8" + b"x" * 1000
+    body = json.dumps({"image": "data:image/jpeg;base64," + base64.b64encode(frame).decode()})
+    with app.app.test_request_context("/detect", method="POST", data=body, content_type="application/json"):
+        assert app.read_frame_upload() == (frame, None)
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/detect", {"image": 123}),
+    ("/detect", {"image": None}),
+    ("/detect-batch", {"images": [123]}),
+])
+def test_malformed_image_data_is_a_bad_request(app, client, monkeypatch, path, body):
+    monkeypatch.setattr(app.inference_client, "available", lambda: True)
+    signup_and_login(client, "malformed")
+
+    response = client.post(path, json=body)
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Invalid image data"
@@ -0,0 +1,187 @@
+import os
+import sqlite3
+import struct
+import subprocess
+import threading
+import time
+
+import pytest
+
+from conftest import signup_and_login, start_match
+
+
+@pytest.fixture
+def make_queue(app, monkeypatch):
+    queues = []
+
+    def make(mode, **kwargs):
+        queue = app.WriteBehindQueue(mode=mode, **kwargs)
+        monkeypatch.setattr(app, "write_behind", queue)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.close()
+
+
+def count_rows(app, user_id):
+    conn = sqlite3.connect(app.DATABASE_PATH)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM emotions WHERE user_id = ?", (user_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_unknown_mode_is_rejected(app):
+    with pytest.raises(ValueError):
+        app.WriteBehindQueue(mode="eventually")
+
+
+def test_sync_writes_inside_the_request_transaction(app, make_queue):
+    queue = make_queue("sync")
+    done = []
+    with app.app.test_request_context("/"):
+        queue.submit(app._insert_emotion, (1, "sad", 90.0), callback=lambda: done.append(1))
+        assert done == []                 # not committed yet
+        app.finish_db_transaction(app.app.response_class(status=200))
+
+    assert done == [1]
+    assert count_rows(app, 1) == 1
+    assert queue.stats()["commits"] == 0  # nothing went through the flusher
+
+
+def test_group_returns_only_once_committed(app, make_queue):
+    queue = make_queue("group")
+    done = []
+    queue.submit(app._insert_emotion, (1, "happy", 80.0), callback=lambda: done.append(1))
+
+    assert done == [1]
+    assert count_rows(app, 1) == 1
+    assert queue.stats()["rows"] == 1
+
+
+def test_group_commit_batches_concurrent_rows(app, make_queue):
+    queue = make_queue("group", window_ms=50)
+    threads = [
+        threading.Thread(target=queue.submit, args=(app._insert_emotion, (1, "neutral", 50.0)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = queue.stats()
+    assert count_rows(app, 1) == 8
+    assert stats["rows"] == 8
+    assert stats["commits"] < 8
+    assert stats["max_batch"] > 1
+
+
+def test_async_rows_are_visible_after_the_barrier(app, make_queue):
+    queue = make_queue("async", window_ms=20)
+    release = threading.Event()
+
+    def slow_insert(conn, *args):
+        release.wait(5)
+        app._insert_emotion(conn, *args)
+
+    queue.submit(slow_insert, (1, "angry", 70.0))
+    assert queue.stats()["queued"] == 1   # submit returned before the commit
+
+    release.set()
+    queue.barrier()
+    assert queue.stats()["queued"] == 0
+    assert count_rows(app, 1) == 1
+
+
+def test_a_failing_row_does_not_sink_the_batch(app, make_queue):
+    queue = make_queue("async", window_ms=50)
+
+    def broken(conn):
+        conn.execute("INSERT INTO no_such_table VALUES (1)")
+
+    queue.submit(app._insert_emotion, (1, "sad", 60.0))
+    queue.submit(broken, ())
+    queue.submit(app._insert_emotion, (1, "sad", 61.0))
+    queue.barrier()
+
+    stats = queue.stats()
+    assert count_rows(app, 1) == 2
+    assert stats["rows"] == 2
+    assert stats["failed_rows"] == 1
+
+
+@pytest.mark.parametrize("mode", ["group", "async"])
+def test_chat_routes_see_their_own_writes(app, make_queue, mode):
+    queue = make_queue(mode)
+    alice, bob = app.app.test_client(), app.app.test_client()
+    match_id = start_match(app, signup_and_login(alice, "alice"), signup_and_login(bob, "bob"))
+
+    for text in ("one", "two", "three"):
+        assert alice.post("/send-message", json={"match_id": match_id, "message": text}).json["success"]
+        messages = alice.get(f"/get-messages/{match_id}").json["messages"]
+        assert messages[-1]["message"] == text
+    assert queue.stats()["rows"] == 3
+
+
+def test_flusher_follows_the_database_path(app, make_queue, tmp_path, monkeypatch):
+    queue = make_queue("group")
+    queue.submit(app._insert_emotion, (1, "sad", 90.0))
+    assert count_rows(app, 1) == 1
+
+    monkeypatch.setattr(app, "DATABASE_PATH", str(tmp_path / "moved.db"))
+    app.init_db()
+    queue.submit(app._insert_emotion, (1, "happy", 80.0))
+    assert count_rows(app, 1) == 1          # written to the new database, not the first
+
+
+def publish(state_dir, pid, seq):
+    with open(os.path.join(state_dir, f"{pid}.seq"), "wb") as f:
+        f.write(struct.pack("!Q", seq))
+
+
+def test_barrier_waits_for_the_worker_that_queued_the_users_last_row(app, make_queue, tmp_path):
+    state_dir = str(tmp_path)
+    queue = make_queue("async", state_dir=state_dir)
+    other_worker = subprocess.Popen(["sleep", "30"])
+    try:
+        publish(state_dir, other_worker.pid, 3)
+        threading.Timer(0.2, publish, (state_dir, other_worker.pid, 5)).start()
+
+        with app.app.test_request_context("/"):
+            app.session["_write_seq"] = [other_worker.pid, 5]
+            started = time.monotonic()
+            queue.barrier()
+            assert time.monotonic() - started >= 0.2
+            assert "_write_seq" not in app.session
+    finally:
+        other_worker.kill()
+        other_worker.wait()
+
+
+def test_barrier_does_not_wait_on_an_exited_worker(app, make_queue, tmp_path):
+    state_dir = str(tmp_path)
+    queue = make_queue("async", state_dir=state_dir)
+    exited = subprocess.Popen(["true"])
+    exited.wait()
+    publish(state_dir, exited.pid, 1)
+
+    with app.app.test_request_context("/"):
+        app.session["_write_seq"] = [exited.pid, 5]
+        started = time.monotonic()
+        queue.barrier(timeout=5)
+        assert time.monotonic() - started < 1
+
+
+def test_async_writes_publish_how_far_they_are_committed(app, make_queue, tmp_path):
+    queue = make_queue("async", state_dir=str(tmp_path))
+    with app.app.test_request_context("/"):
+        for _ in range(3):
+            queue.submit(app._insert_emotion, (1, "sad", 60.0))
+        assert app.session["_write_seq"] == [os.getpid(), 3]
+    queue.barrier()
+
+    with open(tmp_path / f"{os.getpid()}.seq", "rb") as f:
+        assert struct.unpack("!Q", f.read())[0] == 3
@@ -0,0 +1,30 @@
+"""
+Operational commands for EchoBridge, kept out of app.py so the web module
+is only the web app. app.py registers them on import, so they still run
+as `flask --app app <command>`:
+
+    db-query-plans, bench-writes    - database benchmarks (tools/db.py)
+    export-onnx, check-backend-parity,
+    bench-preprocess, bench-coldstart - model backends and load time (tools/model.py)
+    bench-startup                    - import/startup budget (tools/startup.py)
+    openai-stub                      - local stand-in for the OpenAI API (tools/openai_stub.py)
+    inference-server                 - shared model server for the workers (tools/inference_server.py)
+"""
+
+
+def register_commands(app):
+    """Add every tool to the Flask app's CLI"""
+    from tools import db, inference_server, model, openai_stub, startup
+
+    for command in (
+        db.db_query_plans,
+        db.bench_writes,
+        model.export_onnx,
+        model.check_backend_parity,
+        model.bench_preprocess,
+        model.bench_coldstart,
+        startup.bench_startup,
+        openai_stub.openai_stub,
+        inference_server.inference_server,
+    ):
+        app.cli.add_command(command)
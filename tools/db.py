@@ -0,0 +1,164 @@
+"""
+Database benchmarks: hot query plans against synthetic data, and insert
+throughput per DB_DURABILITY mode.
+"""
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import click
+
+import app
+
+
+# The hot queries the indexes from migration 3 are meant to serve
+HOT_QUERIES = {
+    "latest_emotion": (
+        "SELECT emotion FROM emotions WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        (42,)
+    ),
+    "emotion_history": (
+        "SELECT id, emotion, confidence, created_at FROM emotions WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT 21",
+        (42, 2 ** 63 - 1)
+    ),
+    "active_match": (
+        "SELECT id FROM matches WHERE active = 1 AND (user1_id = ? OR user2_id = ?) ORDER BY id DESC LIMIT 1",
+        (42, 42)
+    ),
+    "match_partner": (
+        "SELECT user_id, last_seen FROM match_queue WHERE emotion = ? AND user_id != ? ORDER BY enqueued_at LIMIT 1",
+        ("sad", 42)
+    ),
+    "chat_messages": (
+        "SELECT id, sender_id, message, created_at FROM chat_messages WHERE match_id = ? AND id > ? ORDER BY id ASC",
+        (42, 0)
+    ),
+    "login_by_email": (
+        "SELECT * FROM users WHERE email = ? AND password = ?",
+        ("user42@example.com", "x")
+    ),
+}
+
+
+@click.command("db-query-plans")
+@click.option("--users", default=2000, help="Synthetic users to create")
+@click.option("--emotions", default=500000, help="Synthetic emotion rows to create")
+@click.option("--messages", default=200000, help="Synthetic chat messages to create")
+def db_query_plans(users, emotions, messages):
+    """Compare hot query plans before/after the index migration on synthetic data"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        app.init_db(db_path, target=2)
+
+        conn = sqlite3.connect(db_path)
+        rng = random.Random(0)
+        labels = list(app.emotion_messages)
+        conn.executemany(
+            "INSERT INTO users (email, username, password) VALUES (?, ?, ?)",
+            ((f"user{i}@example.com", f"user{i}", "x") for i in range(users))
+        )
+        conn.executemany(
+            "INSERT INTO emotions (user_id, emotion, confidence) VALUES (?, ?, ?)",
+            ((rng.randint(1, users), rng.choice(labels), rng.random() * 100) for _ in range(emotions))
+        )
+        conn.executemany(
+            "INSERT INTO matches (user1_id, user2_id, emotion, active) VALUES (?, ?, ?, ?)",
+            ((rng.randint(1, users), rng.randint(1, users), rng.choice(labels), int(rng.random() < 0.1)) for _ in range(users * 5))
+        )
+        conn.executemany(
+            "INSERT INTO chat_messages (match_id, sender_id, message) VALUES (?, ?, ?)",
+            ((rng.randint(1, users * 5), rng.randint(1, users), "hello") for _ in range(messages))
+        )
+        conn.executemany(
+            "INSERT INTO match_queue (user_id, emotion, enqueued_at, last_seen) VALUES (?, ?, ?, ?)",
+            ((i, rng.choice(labels), i, i) for i in range(1, users + 1))
+        )
+        conn.commit()
+
+        def report(title):
+            click.echo(f"\n== {title} ==")
+            scans = []
+            for name, (sql, params) in HOT_QUERIES.items():
+                plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+                started = time.perf_counter()
+                for _ in range(20):
+                    conn.execute(sql, params).fetchall()
+                elapsed_ms = (time.perf_counter() - started) / 20 * 1000
+                click.echo(f"{name:16} {elapsed_ms:8.3f} ms  {' | '.join(plan)}")
+                if any(step.startswith("SCAN") for step in plan):
+                    scans.append(name)
+            return scans
+
+        report("before indexes")
+        app.migrate(conn)
+        conn.execute("ANALYZE")
+        scans = report("after indexes")
+        conn.close()
+
+    if scans:
+        raise click.ClickException(f"Full table scans remain for: {', '.join(scans)}")
+    click.echo("\n✅ All hot queries use an index")
+
+
+@click.command("bench-writes")
+@click.option("--threads", default=16, show_default=True, help="Concurrent writers")
+@click.option("--rows", default=2000, show_default=True, help="Rows per mode")
+@click.option("--mode", "modes", multiple=True, type=click.Choice(["sync", "group", "async"]),
+              help="Durability mode(s) to run (default: all)")
+def bench_writes(threads, rows, modes):
+    """Concurrent emotion inserts per durability mode, against a scratch database
+
+    The scratch database sits next to DATABASE_PATH so commits pay the same
+    disk's fsync cost.
+    """
+    for mode in modes or ("sync", "group", "async"):
+        scratch = tempfile.mkdtemp(prefix=".bench-writes-", dir=os.path.dirname(os.path.abspath(app.DATABASE_PATH)))
+        db_path = os.path.join(scratch, "bench.db")
+        app.init_db(db_path)
+        queue_ = app.WriteBehindQueue(
+            mode=mode, window_ms=app.write_behind.window * 1000, max_rows=app.write_behind.max_rows,
+            max_queued=app.write_behind.max_queued, db_path=db_path,
+        )
+        per_thread = rows // threads
+        sync_commits = [0]
+        latencies = []
+        lock = threading.Lock()
+
+        def writer(user_id):
+            conn = app._connect(db_path) if mode == "sync" else None
+            mine = []
+            for _ in range(per_thread):
+                started = time.perf_counter()
+                if mode == "sync":
+                    # What every request did before: its own transaction per row
+                    app._insert_emotion(conn, user_id, "happy", 90.0)
+                    conn.commit()
+                else:
+                    queue_.submit(app._insert_emotion, (user_id, "happy", 90.0))
+                mine.append((time.perf_counter() - started) * 1000)
+            with lock:
+                latencies.extend(mine)
+                if conn is not None:
+                    sync_commits[0] += per_thread
+                    conn.close()
+
+        workers = [threading.Thread(target=writer, args=(i + 1,)) for i in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        queue_.barrier()
+        elapsed = time.perf_counter() - started
+
+        commits = sync_commits[0] if mode == "sync" else queue_.stats()["commits"]
+        written = sqlite3.connect(db_path).execute("SELECT COUNT(*) FROM emotions").fetchone()[0]
+        shutil.rmtree(scratch, ignore_errors=True)
+        latency = app._percentiles(sorted(latencies))
+        click.echo(f"{mode:5}  {written / elapsed:8.0f} rows/s  {commits / elapsed:7.0f} commits/s  "
+                   f"{written / max(commits, 1):6.1f} rows/commit  "
+                   f"call p50 {latency['p50']} ms p95 {latency['p95']} ms")
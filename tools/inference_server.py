@@ -0,0 +1,118 @@
+"""
+`flask --app app inference-server`: the process behind INFERENCE_SOCKET.
+It owns the only model copy and answers the gunicorn workers'
+InferenceClient (see 🛰️ SHARED INFERENCE SERVER in app.py for the wire
+format), batching frames from all of them together.
+"""
+import json
+import os
+import signal
+import socket
+import struct
+import threading
+import time
+
+import click
+
+import app
+
+
+def serve_inference(socket_path):
+    """Load the model and answer frames on socket_path until killed"""
+    if not app.preload_model():
+        raise RuntimeError("Model not available")
+
+    if os.path.dirname(socket_path) == app.RUNTIME_DIR:
+        app.ensure_private_dir(app.RUNTIME_DIR)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)   # left behind by a previous run
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Created 0600 rather than chmod-ed after bind, so the socket is never
+    # reachable by other users, even briefly
+    umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    server.listen(64)
+    print(f"🛰️ Inference server {os.getpid()} listening on {socket_path}")
+
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=_serve_connection, args=(conn,), daemon=True).start()
+
+
+def _serve_connection(conn):
+    # One thread per worker thread; a worker dying just closes its socket
+    with conn:
+        while True:
+            try:
+                header = app._recv_exact(conn, 4)
+                if header is None:
+                    return
+                (count,) = struct.unpack("!I", header)
+                if not 1 <= count <= app.DETECT_BURST_MAX_FRAMES:
+                    return
+                frames = [app._recv_message(conn, app.DETECT_MAX_FRAME_BYTES) for _ in range(count)]
+            except (OSError, ValueError):
+                return
+            if any(frame is None for frame in frames):
+                return
+
+            try:
+                images = [app.get_frame_preprocessor().decode(frame) for frame in frames]
+                if count == 1:
+                    # Batched with single frames from the other workers
+                    results = [app.batcher.submit(images[0])]
+                else:
+                    results = app.batcher.submit_burst(images)
+                reply = {"results": results}
+            except Exception as e:
+                reply = {"error": str(e)}
+
+            try:
+                app._send_message(conn, json.dumps(reply).encode())
+            except OSError:
+                return
+
+
+@click.command("inference-server")
+@click.option("--socket", "socket_path", default=app.INFERENCE_SOCKET or os.path.join(app.RUNTIME_DIR, "inference.sock"),
+              show_default=True, help="Unix socket to listen on (point INFERENCE_SOCKET at it)")
+def inference_server(socket_path):
+    """Serve the model to every gunicorn worker, restarting the server if it dies"""
+    child = None
+    backoff = 1
+
+    def stop(signum, frame):
+        if child:
+            os.kill(child, signal.SIGTERM)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # The model lives in a forked child so a crash (or OOM kill) there
+    # only costs a reload; workers load their own copy meanwhile
+    while True:
+        started = time.monotonic()
+        child = os.fork()
+        if child == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                serve_inference(socket_path)
+            except BaseException as e:
+                print(f"❌ Inference server failed: {e}")
+            finally:
+                os._exit(1)
+
+        _, status = os.waitpid(child, 0)
+        # Back off only if it keeps dying soon after starting
+        if time.monotonic() - started > 60:
+            backoff = 1
+        print(f"⚠️ Inference server exited (status {status}), restarting in {backoff}s")
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30)
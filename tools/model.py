@@ -0,0 +1,194 @@
+"""
+Model backend tooling: ONNX export, label parity between backends, the
+fast-path preprocessor benchmark and cold-start timing.
+"""
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+import app
+
+
+@click.command("export-onnx")
+@click.option("--output", default=app.EMOTION_ONNX_PATH, show_default=True, help="Where to write the .onnx file")
+def export_onnx(output):
+    """Export the float32 model to ONNX for EMOTION_MODEL_BACKEND=onnx"""
+    import torch
+
+    processor, model = app.load_emotion_model("eager")
+    height = processor.size["height"]
+    width = processor.size["width"]
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    torch.onnx.export(
+        app.logits_only(model),
+        (torch.zeros(1, 3, height, width),),
+        output,
+        input_names=["pixel_values"],
+        output_names=["logits"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+        dynamo=False,
+    )
+    click.echo(f"✅ Exported {app.EMOTION_MODEL_SOURCE} to {output}")
+
+
+@click.command("check-backend-parity")
+@click.argument("image_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--backend", type=click.Choice(["int8", "onnx", "torchscript"]), default="int8", show_default=True)
+@click.option("--threshold", default=0.95, show_default=True, help="Minimum label agreement with float32")
+def check_backend_parity(image_dir, backend, threshold):
+    """Fail if a backend's labels drift from the float32 model on local images"""
+    import torch
+    from PIL import Image
+
+    paths = sorted(
+        os.path.join(image_dir, name) for name in os.listdir(image_dir)
+        if name.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    if not paths:
+        raise click.ClickException(f"No images found in {image_dir}")
+
+    processor, reference = app.load_emotion_model("eager")
+    _, candidate = app.load_emotion_model(backend)
+
+    agree = 0
+    for start in range(0, len(paths), 16):
+        images = [Image.open(path).convert("RGB") for path in paths[start:start + 16]]
+        inputs = processor(images=images, return_tensors="pt")
+        with torch.no_grad():
+            expected = reference(**inputs).logits.argmax(dim=1)
+            actual = candidate(**inputs).logits.argmax(dim=1)
+        agree += (expected == actual).sum().item()
+
+    agreement = agree / len(paths)
+    click.echo(f"{backend}: {agree}/{len(paths)} labels agree with float32 ({agreement:.1%})")
+    if agreement < threshold:
+        raise click.ClickException(f"Label agreement {agreement:.1%} is below the {threshold:.1%} threshold")
+
+
+@click.command("bench-preprocess")
+@click.argument("image_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--iterations", default=50, show_default=True)
+@click.option("--tolerance", default=0.05, show_default=True, help="Max absolute logit difference allowed")
+def bench_preprocess(image_path, iterations, tolerance):
+    """Compare decode+preprocess time/memory of the HF processor and the fast path"""
+    import torch
+    from PIL import Image
+
+    processor, model = app.get_model()
+    if model is None:
+        raise click.ClickException("Model not available")
+    preprocessor = app.get_frame_preprocessor()
+    if not callable(processor):
+        # The torchscript backend only keeps the processor's settings
+        from transformers import AutoImageProcessor
+        processor = AutoImageProcessor.from_pretrained(app.EMOTION_MODEL_SOURCE, use_fast=True)
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+
+    def hf_path():
+        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        return processor(images=image, return_tensors="pt")["pixel_values"], image.size
+
+    def fast_path():
+        image = preprocessor.decode(image_bytes)
+        return preprocessor.batch([image]), image.size
+
+    results = {}
+    for name, path in (("hf processor", hf_path), ("fast path", fast_path)):
+        path()  # warm up
+        started = time.perf_counter()
+        for _ in range(iterations):
+            pixel_values, decoded_size = path()
+        elapsed_ms = (time.perf_counter() - started) / iterations * 1000
+
+        tracemalloc.start()
+        path()
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+        # PIL's pixel buffers aren't seen by tracemalloc, so report them separately
+        decoded_kb = decoded_size[0] * decoded_size[1] * 3 / 1024
+        click.echo(f"{name:13} {elapsed_ms:8.2f} ms/frame  decoded {decoded_size[0]}x{decoded_size[1]} "
+                   f"({decoded_kb:.0f} KB)  peak python/numpy {peak_kb:.0f} KB")
+        results[name] = pixel_values
+
+    with torch.no_grad():
+        expected = model(pixel_values=results["hf processor"]).logits
+        actual = model(pixel_values=results["fast path"]).logits
+    max_diff = (expected - actual).abs().max().item()
+    click.echo(f"max logit difference {max_diff:.4f} (tolerance {tolerance})")
+    if max_diff > tolerance or expected.argmax().item() != actual.argmax().item():
+        raise click.ClickException("Fast-path logits are outside tolerance")
+
+
+# Run in a fresh interpreter by bench-coldstart; prints one JSON line
+_COLDSTART_PROBE = """
+import json, time
+started = time.perf_counter()
+import app
+processor, model = app.get_model()
+loaded = time.perf_counter()
+if model is not None:
+    from PIL import Image
+    app.batcher.submit(Image.new("RGB", (480, 360)))
+inferred = time.perf_counter()
+print(json.dumps({
+    "ok": model is not None,
+    "load_ms": (loaded - started) * 1000,
+    "first_inference_ms": (inferred - started) * 1000,
+    "rss_mb": app._process_memory().get("vmrss_kb", 0) / 1024,
+}))
+"""
+
+
+@click.command("bench-coldstart")
+@click.option("--snapshot-dir", default=app.EMOTION_MODEL_DIR, help="Local model snapshot (defaults to EMOTION_MODEL_DIR)")
+@click.option("--runs", default=3, show_default=True, help="Fresh interpreters per configuration")
+def bench_coldstart(snapshot_dir, runs):
+    """Time from process start to first inference: hub id vs local snapshot vs TorchScript cache"""
+    if not snapshot_dir:
+        raise click.ClickException("Pass --snapshot-dir or set EMOTION_MODEL_DIR")
+
+    app_dir = os.path.dirname(os.path.abspath(app.__file__))
+    with tempfile.TemporaryDirectory() as scratch:
+        base = dict(os.environ, DETECT_BATCH_WINDOW_MS="0", EMOTION_MODEL_CACHE_DIR=os.path.join(scratch, "cache"))
+        base.pop("EMOTION_MODEL_DIR", None)
+        base.pop("EMOTION_MODEL_BACKEND", None)
+        snapshot = {"EMOTION_MODEL_DIR": snapshot_dir}
+        torchscript = dict(snapshot, EMOTION_MODEL_BACKEND="torchscript")
+        cases = [
+            (f"hub id {app.EMOTION_MODEL_NAME} (eager)", {}, runs),
+            ("local snapshot (eager)", snapshot, runs),
+            ("local snapshot (torchscript, building the cache)", torchscript, 1),
+            ("local snapshot (torchscript, cached)", torchscript, runs),
+        ]
+
+        for label, extra, count in cases:
+            results = []
+            for _ in range(count):
+                done = subprocess.run([sys.executable, "-c", _COLDSTART_PROBE], cwd=app_dir,
+                                      env=dict(base, **extra), capture_output=True, text=True)
+                lines = done.stdout.strip().splitlines()
+                result = json.loads(lines[-1]) if done.returncode == 0 and lines else {"ok": False}
+                if not result["ok"]:
+                    break
+                results.append(result)
+
+            if len(results) < count:
+                click.echo(f"{label:<52} failed (model could not be loaded)")
+                continue
+            load_ms = statistics.median(r["load_ms"] for r in results)
+            first_ms = statistics.median(r["first_inference_ms"] for r in results)
+            rss_mb = statistics.median(r["rss_mb"] for r in results)
+            click.echo(f"{label:<52} load {load_ms:6.0f} ms  first inference {first_ms:6.0f} ms  "
+                       f"RSS {rss_mb:4.0f} MB  (median of {count})")
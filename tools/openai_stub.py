@@ -0,0 +1,84 @@
+"""
+A local stand-in for the OpenAI chat completions API, for exercising the
+streaming AI chat and the OpenAI gateway without network access.
+"""
+import json
+import random
+import time
+
+import click
+
+
+@click.command("openai-stub")
+@click.option("--port", default=8089, show_default=True)
+@click.option("--first-token-ms", default=300, show_default=True, help="Delay before the first token")
+@click.option("--token-ms", default=40, show_default=True, help="Delay between tokens")
+@click.option("--error-rate", default=0.0, show_default=True, help="Fraction of requests answered with a 503")
+def openai_stub(port, first_token_ms, token_ms, error_rate):
+    """Local stand-in for the OpenAI chat completions API
+
+    Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+    and any OPENAI_API_KEY. It answers every request by echoing the last
+    user message, streamed or not; --error-rate and the delays simulate a
+    degraded upstream.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            last = next((m["content"] for m in reversed(body.get("messages", [])) if m["role"] == "user"), "")
+            words = f"You said: {last}. I'm here to listen - tell me more about how that feels.".split(" ")
+            base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": body.get("model", "stub")}
+
+            if random.random() < error_rate:
+                payload = json.dumps({"error": {"message": "stub overloaded", "type": "server_error"}}).encode()
+                self.send_response(503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            time.sleep(first_token_ms / 1000)
+            if not body.get("stream"):
+                payload = json.dumps(dict(base, object="chat.completion", choices=[{
+                    "index": 0, "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                }])).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(token_ms / 1000)
+                chunk = dict(base, object="chat.completion.chunk", choices=[{
+                    "index": 0, "finish_reason": None,
+                    "delta": {"content": word if i == 0 else " " + word},
+                }])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            final = dict(base, object="chat.completion.chunk",
+                         choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+            self.close_connection = True
+
+        def log_message(self, format, *args):
+            pass
+
+    click.echo(f"🧪 OpenAI stub on http://127.0.0.1:{port}/v1 "
+               f"(first token {first_token_ms} ms, then {token_ms} ms/token)")
+    ThreadingHTTPServer(("127.0.0.1", port), StubHandler).serve_forever()
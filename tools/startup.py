@@ -0,0 +1,71 @@
+"""
+Startup budget check: `import app` time, RSS and which heavy modules got
+imported, measured in fresh interpreters.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import click
+
+import app
+
+
+# Run in a fresh interpreter by bench-startup; prints one JSON line
+_STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+ready = time.perf_counter()
+app.app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "first_request_ms": (served - ready) * 1000,
+    "rss_mb": app._process_memory().get("vmrss_kb", 0) / 1024,
+    "heavy": [m for m in ("torch", "transformers", "PIL", "numpy", "openai") if m in sys.modules],
+}))
+"""
+
+
+@click.command("bench-startup")
+@click.option("--runs", default=5, show_default=True, help="Fresh interpreters to time")
+@click.option("--max-import-ms", default=1000.0, show_default=True, help="Budget for `import app` (median)")
+@click.option("--max-rss-mb", default=100.0, show_default=True, help="Budget for RSS after the first request (median)")
+def bench_startup(runs, max_import_ms, max_rss_mb):
+    """Time `import app` and a first /login in fresh processes; fail past the budget"""
+    app_dir = os.path.dirname(os.path.abspath(app.__file__))
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        env = dict(os.environ, DATABASE_PATH=os.path.join(scratch, "startup.db"))
+        for _ in range(runs):
+            done = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=app_dir, env=env,
+                                  capture_output=True, text=True)
+            if done.returncode != 0:
+                raise click.ClickException(f"Startup probe failed:\n{done.stderr}")
+            results.append(json.loads(done.stdout.strip().splitlines()[-1]))
+
+    summary = {key: statistics.median(r[key] for r in results)
+               for key in ("import_ms", "startup_ms", "first_request_ms", "rss_mb")}
+    heavy = sorted({m for r in results for m in r["heavy"]})
+    click.echo(f"import {summary['import_ms']:.0f} ms  startup {summary['startup_ms']:.0f} ms  "
+               f"first /login {summary['first_request_ms']:.0f} ms  RSS {summary['rss_mb']:.0f} MB  "
+               f"(median of {runs})")
+    click.echo(f"heavy modules loaded: {', '.join(heavy) or 'none'}")
+
+    failures = []
+    if summary["import_ms"] > max_import_ms:
+        failures.append(f"import took {summary['import_ms']:.0f} ms (budget {max_import_ms:.0f})")
+    if summary["rss_mb"] > max_rss_mb:
+        failures.append(f"RSS is {summary['rss_mb']:.0f} MB (budget {max_rss_mb:.0f})")
+    if heavy:
+        failures.append(f"{', '.join(heavy)} imported before the model was needed")
+    if failures:
+        raise click.ClickException("; ".join(failures))
+    click.echo("✅ Within the startup budget")